@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class MetadataConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
-    name = "django_model_metadata"
\ No newline at end of file
+    name = "django_model_metadata"
+
+    def ready(self):
+        from .autocomplete import autocomplete_indexes
+        from .checks import check_definition_cache
+        from .receivers import connect_receivers
+
+        checks.register(check_definition_cache, checks.Tags.caches)
+        connect_receivers()
+        autocomplete_indexes.build()
@@ -0,0 +1,169 @@
+"""
+Autocomplete indexes
+The selectable choices (relation models, on delete actions) are indexed once at app ready
+in a sorted list of lowercased tokens, searched by prefix with a binary search.
+"""
+
+import hashlib
+import re
+from bisect import bisect_left
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .conf import get_setting
+
+ALL_MODELS = "__all__"
+TOKEN_SPLIT_RE = re.compile(r"[\s._\-]+")
+
+
+class ChoicesIndex:
+    """Prefix index over (value, title) choices"""
+
+    def __init__(self, choices):
+        self.choices = list(choices)
+
+        tokens = set()
+        for position, (value, title) in enumerate(self.choices):
+            for text in (str(value), str(title)):
+                text = text.lower()
+                tokens.add((text, position))
+                tokens.update((token, position) for token in TOKEN_SPLIT_RE.split(text) if token)
+
+        self._tokens = sorted(tokens)
+        self._keys = [token for token, position in self._tokens]
+        self.version = hashlib.md5(
+            repr([(str(value), str(title)) for value, title in self.choices]).encode(), usedforsecurity=False
+        ).hexdigest()
+
+    def __len__(self):
+        return len(self.choices)
+
+    def match_word(self, word):
+        start = bisect_left(self._keys, word)
+        positions = set()
+        for token, position in self._tokens[start:]:
+            if not token.startswith(word):
+                break
+            positions.add(position)
+        return positions
+
+    def search(self, query):
+        """Returns the positions of the choices having a token starting with every word of the query"""
+        words = [word for word in TOKEN_SPLIT_RE.split(query.strip().lower()) if word]
+        if not words:
+            return range(len(self.choices))
+
+        positions = self.match_word(words[0])
+        for word in words[1:]:
+            if not positions:
+                break
+            positions &= self.match_word(word)
+        return sorted(positions)
+
+    def get_page(self, query, page=1, limit=20):
+        positions = self.search(query)
+        start = (page - 1) * limit
+        return {
+            "results": [
+                {"title": str(self.choices[position][1]), "value": self.choices[position][0]}
+                for position in positions[start : start + limit]
+            ],
+            "page": page,
+            "count": len(positions),
+            "has_more": start + limit < len(positions),
+        }
+
+
+def get_fk_models():
+    """
+    The relation models from the ``DJANGO_MODEL_METADATA_FK_MODELS`` setting : ``"__all__"`` for all the
+    installed models, or a list of labels or (label, title) pairs. ``GENERAL_FK_MODELS`` by default.
+    """
+    fk_models = get_setting("FK_MODELS")
+    if fk_models is None:
+        from .model_mixins import GENERAL_FK_MODELS
+
+        return list(GENERAL_FK_MODELS)
+
+    if fk_models == ALL_MODELS:
+        return [(model._meta.label, model._meta.verbose_name) for model in apps.get_models()]
+
+    choices = []
+    for fk_model in fk_models:
+        if isinstance(fk_model, str):
+            model = apps.get_model(fk_model)
+            choices.append((model._meta.label, model._meta.verbose_name))
+        else:
+            choices.append(tuple(fk_model))
+    return choices
+
+
+class IndexRegistry:
+    """The autocomplete indexes by element type, built on first use (or at app ready)"""
+
+    def __init__(self):
+        self._indexes = None
+
+    def build(self):
+        from .model_mixins import ON_DELETE_CHOICES
+
+        self._indexes = {
+            "models": ChoicesIndex(get_fk_models()),
+            "on_delete": ChoicesIndex(ON_DELETE_CHOICES),
+        }
+
+    def get(self, el_type):
+        if self._indexes is None:
+            self.build()
+        return self._indexes.get(el_type)
+
+
+autocomplete_indexes = IndexRegistry()
+
+
+def get_fk_model_choices():
+    """The (label, title) choices of the relation models, from the ``models`` index"""
+    return autocomplete_indexes.get("models").choices
+
+
+def get_search_fields(model):
+    """
+    The fields searched by prefix for the rows of a relation model : its ``metadata_search_fields``
+    attribute, or its ``name``/``title`` field. They should be indexed.
+    """
+    search_fields = getattr(model, "metadata_search_fields", None)
+    if search_fields is not None:
+        return list(search_fields)
+
+    field_names = {field.name for field in model._meta.concrete_fields}
+    return [field_name for field_name in ("name", "title") if field_name in field_names][:1]
+
+
+def get_objects_queryset(model, query):
+    """The rows of ``model`` matching ``query`` by prefix on the search fields, or by pk"""
+    queryset = model._default_manager.order_by("pk")
+    query = query.strip()
+    if not query:
+        return queryset
+
+    condition = Q()
+    for field_name in get_search_fields(model):
+        condition |= Q(**{f"{field_name}__istartswith": query})
+    try:
+        condition |= Q(pk=model._meta.pk.to_python(query))
+    except ValidationError:
+        pass
+
+    return queryset.filter(condition) if condition else queryset.none()
+
+
+def get_object_title(obj):
+    """The title of a related row, the same description as the formatted metadata"""
+    return str(getattr(obj, "get_metadata_description", obj.__str__)())
+
+
+def is_fk_model(model):
+    """Whether the model is one of the relation models of the metadata"""
+    return model._meta.label in {str(value) for value, title in get_fk_model_choices()}
@@ -0,0 +1,251 @@
+"""
+Benchmarks of the metadata hot paths
+Synthetic definitions and elements are created in a transaction rolled back at the end,
+every operation is measured in wall time, database queries and peak python memory.
+"""
+
+import datetime
+import platform
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+import django
+import swapper
+from django import forms
+from django.db import connections, models, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .cache import definition_cache, type_registries
+from .forms import MetadataFormMixin
+from .views import MetadataElementsJsonView
+
+BENCHMARK_META_TYPES = (
+    "CharField",
+    "IntegerField",
+    "DecimalField",
+    "DateField",
+    "DateTimeField",
+    "ChoiceField",
+    "ForeignKey",
+)
+BENCHMARK_CHOICES = [["a", "A"], ["b", "B"], ["c", "C"]]
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_required_values(model, exclude=()):
+    """Dummy values for the model fields the database requires"""
+    values = {}
+    for field in model._meta.concrete_fields:
+        if field.primary_key or field.null or field.has_default() or field.name in exclude:
+            continue
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+            continue
+
+        if isinstance(field, (models.CharField, models.TextField)):
+            values[field.name] = "benchmark"[: field.max_length or None]
+        elif isinstance(field, models.BooleanField):
+            values[field.name] = False
+        elif isinstance(field, (models.IntegerField, models.FloatField, models.DecimalField)):
+            values[field.name] = 0
+        elif isinstance(field, models.DateTimeField):
+            values[field.name] = timezone.now()
+        elif isinstance(field, models.DateField):
+            values[field.name] = datetime.date.today()
+        elif isinstance(field, models.JSONField):
+            values[field.name] = {}
+        else:
+            raise ValueError(f"Can not fill the required field {model._meta.label}.{field.name}")
+    return values
+
+
+def get_definition_values(meta_type, index):
+    """The field values of the synthetic definition ``index`` of the meta type"""
+    field_name = f"bench_{meta_type.lower()}_{index}"
+    widget_attrs = {}
+    if meta_type == "CharField":
+        widget_attrs = {"max_length": 50}
+    elif meta_type == "DecimalField":
+        widget_attrs = {"max_digits": 12, "decimal_places": 2}
+    elif meta_type == "ChoiceField":
+        widget_attrs = {"choices": BENCHMARK_CHOICES}
+    elif meta_type == "ForeignKey":
+        widget_attrs = {"model": swapper.get_model_name("django_model_metadata", "ModelGeneralMetaData")}
+    return {"name": field_name, "field_name": field_name, "meta_type": meta_type, "widget_attrs": widget_attrs}
+
+
+def get_metadata_value(definition, row, related_pks):
+    """A valid value of the definition for the element ``row``"""
+    meta_type = definition.meta_type
+    if meta_type == "CharField":
+        return f"value {row}"
+    elif meta_type == "IntegerField":
+        return row * 1000
+    elif meta_type == "DecimalField":
+        return str(Decimal(row) / 4)
+    elif meta_type == "DateField":
+        return (datetime.date(2020, 1, 1) + datetime.timedelta(days=row % 1000)).isoformat()
+    elif meta_type == "DateTimeField":
+        return f"{datetime.date(2020, 1, 1) + datetime.timedelta(days=row % 1000)} 10:30:00"
+    elif meta_type == "ChoiceField":
+        return BENCHMARK_CHOICES[row % len(BENCHMARK_CHOICES)][0]
+    return related_pks[row % len(related_pks)]
+
+
+class MetadataBenchmark:
+    def __init__(self, type_model, element_model, using="default", repeat=3, sample=200, stdout=None):
+        self.type_model = type_model
+        self.element_model = element_model
+        self.type_field = element_model.get_element_type_fields()[0]
+        self.metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+        self.using = using
+        self.repeat = repeat
+        self.sample = sample
+        self.stdout = stdout
+        self.results = []
+
+    def log(self, message):
+        if self.stdout:
+            self.stdout.write(message)
+
+    def measure(self, operation, func, context):
+        walls = []
+        queries = 0
+        peak = 0
+        for _ in range(self.repeat):
+            tracemalloc.start()
+            with CaptureQueriesContext(connections[self.using]) as captured:
+                start = time.perf_counter()
+                func()
+                walls.append((time.perf_counter() - start) * 1000)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            queries = len(captured.captured_queries)
+
+        result = {
+            **context,
+            "operation": operation,
+            "wall_ms": {"min": min(walls), "median": statistics.median(walls), "max": max(walls)},
+            "queries": queries,
+            "peak_kb": round(peak / 1024, 1),
+        }
+        self.results.append(result)
+        self.log(
+            f"{context} {operation} : {result['wall_ms']['median']:.3f}ms, {queries} queries, {result['peak_kb']}KB"
+        )
+
+    def create_dataset(self, definitions_count, rows_count):
+        definitions = []
+        for index in range(definitions_count):
+            meta_type = BENCHMARK_META_TYPES[index % len(BENCHMARK_META_TYPES)]
+            definitions.append(self.metadata_model(**get_definition_values(meta_type, index)))
+        definitions = self.metadata_model._default_manager.using(self.using).bulk_create(definitions)
+        related_pks = [definition.pk for definition in definitions]
+
+        element_type = self.type_model._default_manager.using(self.using).create(
+            **get_required_values(self.type_model, exclude=("metadata",))
+        )
+        element_type.metadata.add(*definitions)
+
+        element_values = get_required_values(self.element_model, exclude=(self.type_field.name, "element_metadata"))
+        batch = []
+        for row in range(rows_count):
+            element_metadata = {
+                definition.field_name: get_metadata_value(definition, row, related_pks) for definition in definitions
+            }
+            batch.append(
+                self.element_model(
+                    **element_values, **{self.type_field.name: element_type}, element_metadata=element_metadata
+                )
+            )
+            if len(batch) == 5000:
+                self.element_model._default_manager.using(self.using).bulk_create(batch)
+                batch = []
+        self.element_model._default_manager.using(self.using).bulk_create(batch)
+
+        return element_type
+
+    def run_case(self, definitions_count, rows_count):
+        context = {"definitions": definitions_count, "rows": rows_count}
+        element_type = self.create_dataset(definitions_count, rows_count)
+        queryset = (
+            self.element_model._default_manager.using(self.using)
+            .filter(**{self.type_field.name: element_type})
+            .select_related(self.type_field.name)
+        )
+        sample = list(queryset[: self.sample])
+
+        def cold_form_class():
+            for registry in type_registries:
+                registry.clear()
+            definition_cache.bump(element_type._meta.label_lower, element_type.pk)
+            element_type.get_form_class()
+
+        self.measure("get_form_class (cold)", cold_form_class, context)
+        self.measure("get_form_class", element_type.get_form_class, context)
+        self.measure("get_fields_schema", element_type.get_fields_schema, context)
+        # The loaded samples did not change, all their keys are validated
+        self.measure(
+            f"clean x{len(sample)}", lambda: [instance.clean_metadata(full=True) for instance in sample], context
+        )
+        self.measure(
+            f"validate_metadata_bulk x{len(sample)}",
+            lambda: self.element_model.validate_metadata_bulk(sample, full=True),
+            context,
+        )
+        self.measure(
+            f"get_formatted_metadata x{len(sample)}",
+            lambda: [instance.get_formatted_metadata(get_string=True) for instance in sample],
+            context,
+        )
+        self.measure(
+            f"format_metadata_bulk x{len(sample)}",
+            lambda: self.element_model.format_metadata_bulk(sample, get_string=True),
+            context,
+        )
+
+        form_class = forms.modelform_factory(
+            self.element_model,
+            form=type("BenchmarkMetadataForm", (MetadataFormMixin, forms.ModelForm), {}),
+            fields=["element_metadata"],
+        )
+        self.measure(
+            f"MetadataFormMixin form x{len(sample)}",
+            lambda: [form_class(instance=instance) for instance in sample],
+            context,
+        )
+
+        view = MetadataElementsJsonView.as_view()
+        request = RequestFactory().get("/", {"query": "a"})
+        self.measure("autocomplete view", lambda: view(request, el_type="models"), context)
+
+    def run(self, definitions_counts, rows_counts):
+        try:
+            with transaction.atomic(using=self.using):
+                for definitions_count in definitions_counts:
+                    for rows_count in rows_counts:
+                        self.run_case(definitions_count, rows_count)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            for registry in type_registries:
+                registry.clear()
+
+        return {
+            "meta": {
+                "created_at": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connections[self.using].vendor,
+                "repeat": self.repeat,
+                "sample": self.sample,
+            },
+            "results": self.results,
+        }
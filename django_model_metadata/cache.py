@@ -0,0 +1,351 @@
+"""
+Process-wide caches for the compiled metadata objects
+and the two tiers cache of the definitions shared by the processes through the Django cache
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.core.cache import caches
+
+from .conf import get_setting
+from .instrumentation import instrumentation
+
+MISSING = object()
+
+
+class LRUCache:
+    """A bounded in-process mapping dropping the least recently used entries"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DefinitionCache:
+    """
+    Caches the serialized definitions of the element types in a process LRU, then in the Django cache
+    ``DJANGO_MODEL_METADATA_CACHE`` ("default" by default) shared by the processes.
+    The keys hold a version made of a global counter, bumped when a definition changes,
+    and a counter per type, bumped when its metadata relation changes. A process reads the versions
+    again after ``DJANGO_MODEL_METADATA_CACHE_VERSION_TTL`` seconds (1 by default), so every process
+    drops its entries together. One process at a time refills a missing entry.
+    """
+
+    PREFIX = "dmm"
+    GLOBAL = "global"
+    LOCK_TIMEOUT = 10
+    LOCK_WAIT = 2
+
+    def __init__(self):
+        self.local = None
+        self._versions = {}
+        # One lock per key being built, a build can build other keys (the schema reads the definitions)
+        self._key_locks = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[get_setting("CACHE", "default")]
+
+    def get_local(self):
+        if self.local is None:
+            self.local = LRUCache(get_setting("CACHE_SIZE", 1024))
+        return self.local
+
+    def get_version_key(self, label, pk=None):
+        return f"{self.PREFIX}:version:{self.GLOBAL if pk is None else f'{label}:{pk}'}"
+
+    def read_version(self, version_key):
+        now = time.monotonic()
+        memo = self._versions.get(version_key)
+        if memo and memo[1] > now:
+            return memo[0]
+
+        version = self.shared.get(version_key)
+        if version is None:
+            # A counter lost by the cache restarts from the clock, above the versions it had
+            self.shared.add(version_key, time.time_ns() // 1000, timeout=None)
+            version = self.shared.get(version_key) or time.time_ns() // 1000
+        self._versions[version_key] = (version, now + get_setting("CACHE_VERSION_TTL", 1))
+        return version
+
+    async def aread_version(self, version_key):
+        now = time.monotonic()
+        memo = self._versions.get(version_key)
+        if memo and memo[1] > now:
+            return memo[0]
+
+        version = await self.shared.aget(version_key)
+        if version is None:
+            await self.shared.aadd(version_key, time.time_ns() // 1000, timeout=None)
+            version = await self.shared.aget(version_key) or time.time_ns() // 1000
+        self._versions[version_key] = (version, now + get_setting("CACHE_VERSION_TTL", 1))
+        return version
+
+    def peek_version(self, version_key):
+        """
+        The version of the key held by the shared cache, None if it has none. Unlike ``read_version()``,
+        nothing is written, e.g. for the pks of types that may not exist.
+        """
+        memo = self._versions.get(version_key)
+        if memo and memo[1] > time.monotonic():
+            return memo[0]
+        return self.shared.get(version_key)
+
+    def get_version(self, element_type):
+        label = element_type._meta.label_lower
+        return (
+            self.read_version(self.get_version_key(label)),
+            self.read_version(self.get_version_key(label, element_type.pk)),
+        )
+
+    async def aget_version(self, element_type):
+        label = element_type._meta.label_lower
+        return (
+            await self.aread_version(self.get_version_key(label)),
+            await self.aread_version(self.get_version_key(label, element_type.pk)),
+        )
+
+    def bump(self, label=None, pk=None):
+        """Bumps the version of a type, or the global version without a type"""
+        version_key = self.get_version_key(label, pk)
+        try:
+            self.shared.incr(version_key)
+        except ValueError:
+            self.shared.set(version_key, time.time_ns() // 1000, timeout=None)
+        self._versions.pop(version_key, None)
+
+    def get_key(self, element_type, name, version):
+        global_version, type_version = version
+        return (
+            f"{self.PREFIX}:{element_type._meta.label_lower}:{element_type.pk}:{name}:{global_version}:{type_version}"
+        )
+
+    def get_or_build(self, element_type, name, builder):
+        # Unsaved types can not be tracked by the signals, we don't cache them
+        if element_type.pk is None:
+            return builder()
+
+        key = self.get_key(element_type, name, self.get_version(element_type))
+        local = self.get_local()
+
+        value = local.get(key, MISSING)
+        if instrumentation.enabled:
+            instrumentation.record_cache(value is not MISSING)
+        if value is not MISSING:
+            return value
+
+        # Single flight in the process, then between the processes
+        with self.get_key_lock(key):
+            value = local.get(key, MISSING)
+            if value is MISSING:
+                value = self.shared.get(key, MISSING)
+                if value is MISSING:
+                    value = self.refill(key, builder)
+                local.set(key, value)
+        return value
+
+    def get_key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def refill(self, key, builder):
+        lock_key = f"{key}:lock"
+        if not self.shared.add(lock_key, 1, timeout=self.LOCK_TIMEOUT):
+            deadline = time.monotonic() + self.LOCK_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                value = self.shared.get(key, MISSING)
+                if value is not MISSING:
+                    return value
+
+        try:
+            value = builder()
+            self.shared.set(key, value, timeout=get_setting("CACHE_TIMEOUT", None))
+        finally:
+            self.shared.delete(lock_key)
+        return value
+
+    async def aget_or_build(self, element_type, name, abuilder):
+        """
+        Async counterpart of ``get_or_build()`` with a coroutine function building the value.
+        The builds are single flight between the processes only.
+        """
+        if element_type.pk is None:
+            return await abuilder()
+
+        key = self.get_key(element_type, name, await self.aget_version(element_type))
+        local = self.get_local()
+
+        value = local.get(key, MISSING)
+        if instrumentation.enabled:
+            instrumentation.record_cache(value is not MISSING)
+        if value is MISSING:
+            value = await self.shared.aget(key, MISSING)
+            if value is MISSING:
+                value = await self.arefill(key, abuilder)
+            local.set(key, value)
+        return value
+
+    async def arefill(self, key, abuilder):
+        lock_key = f"{key}:lock"
+        if not await self.shared.aadd(lock_key, 1, timeout=self.LOCK_TIMEOUT):
+            deadline = time.monotonic() + self.LOCK_WAIT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                value = await self.shared.aget(key, MISSING)
+                if value is not MISSING:
+                    return value
+
+        try:
+            value = await abuilder()
+            await self.shared.aset(key, value, timeout=get_setting("CACHE_TIMEOUT", None))
+        finally:
+            await self.shared.adelete(lock_key)
+        return value
+
+    def clear(self):
+        """Drops the entries of this process"""
+        self.get_local().clear()
+        self._versions.clear()
+
+
+definition_cache = DefinitionCache()
+
+
+class ElementTypeRegistry:
+    """
+    Keeps one compiled object (form class, validator...) per (type model, pk, metadata field name).
+    The entries are dropped by the receivers in ``receivers.py`` whenever a
+    metadata definition or the metadata relation of a type changes, and by the other processes
+    when the version of the type in the ``definition_cache`` changes.
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_type_key(element_type):
+        return (element_type._meta.label_lower, element_type.pk)
+
+    def get_objects(self, element_type):
+        """The objects of the type, dropped when the definition cache version of the type changed"""
+        return self.get_versioned_objects(element_type, definition_cache.get_version(element_type))
+
+    async def aget_objects(self, element_type):
+        """Async counterpart of ``get_objects()``, the version is read with the async cache API"""
+        return self.get_versioned_objects(element_type, await definition_cache.aget_version(element_type))
+
+    def get_versioned_objects(self, element_type, version):
+        entry = self._objects.get(self.get_type_key(element_type))
+        if entry is None or entry[0] != version:
+            return version, None
+        return version, entry[1]
+
+    def get(self, element_type, metadata_field_name):
+        if element_type.pk is None:
+            return None
+        return self.get_compiled(self.get_objects(element_type)[1], metadata_field_name)
+
+    async def aget(self, element_type, metadata_field_name):
+        if element_type.pk is None:
+            return None
+        return self.get_compiled((await self.aget_objects(element_type))[1], metadata_field_name)
+
+    @staticmethod
+    def get_compiled(objects, metadata_field_name):
+        compiled = (objects or {}).get(metadata_field_name)
+        if instrumentation.enabled:
+            instrumentation.record_cache(compiled is not None)
+        return compiled
+
+    def get_or_build(self, element_type, metadata_field_name, builder):
+        # Unsaved types can not be tracked by the signals, we don't cache them
+        if element_type.pk is None:
+            return builder()
+
+        version, objects = self.get_objects(element_type)
+        compiled = self.get_compiled(objects, metadata_field_name)
+        if compiled is None:
+            compiled = self.store(element_type, version, metadata_field_name, builder())
+        return compiled
+
+    async def aget_or_build(self, element_type, metadata_field_name, abuilder):
+        """Async counterpart of ``get_or_build()`` with a coroutine function building the object"""
+        if element_type.pk is None:
+            return await abuilder()
+
+        version, objects = await self.aget_objects(element_type)
+        compiled = self.get_compiled(objects, metadata_field_name)
+        if compiled is None:
+            compiled = self.store(element_type, version, metadata_field_name, await abuilder())
+        return compiled
+
+    def store(self, element_type, version, metadata_field_name, compiled):
+        """Keeps the object built for a version of the type, or returns the one kept meanwhile"""
+        type_key = self.get_type_key(element_type)
+        with self._lock:
+            entry = self._objects.get(type_key)
+            if entry is None or entry[0] != version:
+                entry = self._objects[type_key] = (version, {})
+            return entry[1].setdefault(metadata_field_name, compiled)
+
+    def invalidate(self, model, pk):
+        with self._lock:
+            self._objects.pop((model._meta.label_lower, pk), None)
+
+    def invalidate_model(self, model):
+        label = model._meta.label_lower
+        with self._lock:
+            for type_key in [key for key in self._objects if key[0] == label]:
+                del self._objects[type_key]
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+form_class_registry = ElementTypeRegistry()
+validator_registry = ElementTypeRegistry()
+# {field_name: definition pk} of the compact metadata
+definition_keys_registry = ElementTypeRegistry()
+# The definitions and their schema changes
+schema_changes_registry = ElementTypeRegistry()
+# {field_name: decoder} of the ``metadata_values``
+decoder_registry = ElementTypeRegistry()
+
+type_registries = (
+    form_class_registry,
+    validator_registry,
+    definition_keys_registry,
+    schema_changes_registry,
+    decoder_registry,
+)
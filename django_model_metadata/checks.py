@@ -0,0 +1,26 @@
+"""System checks of the metadata settings"""
+
+from django.conf import settings
+from django.core import checks
+
+from .conf import get_setting
+
+PROCESS_LOCAL_BACKENDS = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+def check_definition_cache(app_configs=None, **kwargs):
+    """Warns when the definitions cache is not shared, the definition changes would not reach the other processes"""
+    alias = get_setting("CACHE", "default")
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend not in PROCESS_LOCAL_BACKENDS:
+        return []
+
+    return [
+        checks.Warning(
+            f"The metadata definitions cache '{alias}' ({backend}) is local to each process, "
+            "the other processes keep their definitions, forms and validators after a change.",
+            hint="Set DJANGO_MODEL_METADATA_CACHE to a cache shared by the processes (Redis, Memcached, database...), "
+            "or ignore this warning when the project runs in a single process.",
+            id="django_model_metadata.W001",
+        )
+    ]
@@ -0,0 +1,167 @@
+"""
+Compact storage of ``element_metadata``
+The models declaring ``compact_metadata = True`` store their metadata keyed by definition pk,
+``{"#": 1, "#12": "red", "#15": 10}``, so the keys take a few bytes and a ``field_name`` rename keeps the values.
+The keys are not plain numbers, the json paths of the ORM would read them as array indexes.
+The instances always present the metadata keyed by ``field_name``, the stored rows are decoded
+by the model field whatever their format, so a table can be converted progressively.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.db import connections
+import swapper
+
+from .cache import definition_cache, definition_keys_registry
+from .schema import SCHEMA_VERSION_KEY, stamp_metadata
+
+COMPACT_MARKER = "#"
+COMPACT_VERSION = 1
+
+
+def get_compact_key(pk):
+    """The compact key of the definition pk, e.g. ``#12``"""
+    return f"{COMPACT_MARKER}{pk}"
+
+
+class DefinitionNames:
+    """
+    The ``field_name`` of every definition by pk, reloaded when the global definitions version changes
+    and, once per version, when a compact key is unknown (a definition created by another process meanwhile)
+    """
+
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self, key=None):
+        version = definition_cache.read_version(definition_cache.get_version_key(None))
+        entry = self._entry
+        if self.is_current(entry, version, key):
+            return entry[1]
+
+        with self._lock:
+            entry = self._entry
+            if not self.is_current(entry, version, key):
+                missed = entry[2] if entry is not None and entry[0] == version else set()
+                entry = self._entry = (version, self.load(), missed)
+                if key is not None:
+                    missed.add(key)
+        return entry[1]
+
+    @staticmethod
+    def is_current(entry, version, key):
+        return entry is not None and entry[0] == version and (key is None or key in entry[1] or key in entry[2])
+
+    @staticmethod
+    def load():
+        metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+        return {
+            get_compact_key(pk): field_name
+            for pk, field_name in metadata_model.objects.exclude(field_name__isnull=True).values_list(
+                "pk", "field_name"
+            )
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+
+
+definition_names = DefinitionNames()
+
+
+def is_compact(element_metadata):
+    """Whether the stored metadata are keyed by definition pk"""
+    return isinstance(element_metadata, dict) and COMPACT_MARKER in element_metadata
+
+
+def get_definition_keys(element_type):
+    """The compact key of every field name of the element type, cached with its definitions"""
+
+    def build():
+        return {
+            definition.get_form_field_name(): get_compact_key(definition.pk)
+            for definition in element_type.get_metadata_definitions()
+        }
+
+    return definition_keys_registry.get_or_build(element_type, "metadata", build)
+
+
+def encode_metadata(element_type, element_metadata):
+    """Returns the compact form of named metadata, the keys unknown to the element type are kept as they are"""
+    if not element_metadata or is_compact(element_metadata) or element_type is None:
+        return element_metadata
+
+    keys = get_definition_keys(element_type)
+    encoded = {COMPACT_MARKER: COMPACT_VERSION}
+    for field_name, value in element_metadata.items():
+        encoded[keys.get(field_name, field_name)] = value
+    return encoded
+
+
+def decode_metadata(element_metadata):
+    """Returns the named form of compact metadata, the other values are returned as they are"""
+    if not is_compact(element_metadata):
+        return element_metadata
+
+    names = definition_names.get()
+    for key in element_metadata.keys() - names.keys() - {COMPACT_MARKER, SCHEMA_VERSION_KEY}:
+        if key.startswith(COMPACT_MARKER):
+            names = definition_names.get(key)
+    return {names.get(key, key): value for key, value in element_metadata.items() if key != COMPACT_MARKER}
+
+
+def get_stored_metadata(instance):
+    """
+    The ``element_metadata`` of an instance as its model stores it,
+    with the schema version of the versioned models
+    """
+    instance.upgrade_metadata()
+    element_metadata = instance.element_metadata
+    if getattr(instance, "compact_metadata", False):
+        element_metadata = encode_metadata(instance.get_element_type(), element_metadata)
+    if getattr(instance, "versioned_metadata", False):
+        element_metadata = stamp_metadata(element_metadata)
+    return element_metadata
+
+
+@contextmanager
+def stored_metadata(instances):
+    """
+    Sets the stored form of the metadata on the instances for the writes bypassing ``pre_save()``,
+    like ``bulk_update()``, and restores the named form afterwards
+    """
+    for instance in instances:
+        instance.upgrade_metadata()
+    named = [instance.element_metadata for instance in instances]
+    try:
+        for instance in instances:
+            instance.element_metadata = get_stored_metadata(instance)
+        yield instances
+    finally:
+        for instance, element_metadata in zip(instances, named):
+            instance.element_metadata = element_metadata
+
+
+def get_storage_size(model, using="default"):
+    """Returns (bytes of the stored metadata, bytes of the whole table or None) where the database can tell"""
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.get_field("element_metadata").column)
+
+    # The table and the column are names of the model quoted by the backend, the values are parameters
+    if connection.vendor == "postgresql":
+        size = f"COALESCE(SUM(pg_column_size({column})), 0), pg_total_relation_size(%s)"
+        sql = f"SELECT {size} FROM {table}"  # nosec B608
+        params = [model._meta.db_table]
+    elif connection.vendor in ("sqlite", "mysql"):
+        sql = f"SELECT COALESCE(SUM(LENGTH({column})), 0), NULL FROM {table}"  # nosec B608
+        params = []
+    else:
+        return None, None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def get_setting(name, default=None):
+    """Returns the setting ``DJANGO_MODEL_METADATA_<name>`` of the project"""
+    return getattr(settings, f"DJANGO_MODEL_METADATA_{name}", default)
@@ -0,0 +1,181 @@
+"""
+PostgreSQL indexes on the searchable keys of ``element_metadata``
+An alternative to the ``MetadataSearchIndex`` table : the keys are indexed directly in the element table.
+"""
+
+import hashlib
+import logging
+
+from django.db import models
+from django.db.migrations.operations.base import Operation
+import swapper
+
+from .expressions import (
+    get_metadata_cast_expression,
+    get_metadata_json_key,
+    get_metadata_key_expression,
+    get_metadata_output_field,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_PREFIX = "dmmx_"
+EXPRESSION = "expression"
+GIN = "gin"
+INDEX_METHODS = (EXPRESSION, GIN)
+# The text to date casts are not immutable in PostgreSQL, they can not be indexed
+MUTABLE_CASTS = (models.DateField, models.TimeField)
+
+
+def get_index_name(model, kind, key=""):
+    """The name of an index of the model, unique by kind and key"""
+    digest = hashlib.md5(f"{model._meta.db_table}:{key}".encode(), usedforsecurity=False).hexdigest()[:12]
+    return f"{INDEX_PREFIX}{kind}_{digest}"
+
+
+def is_cast_indexed(definition):
+    """Whether the values of the definition get an index on their cast to the ``get_output_field()`` of their type"""
+    output_field = get_metadata_output_field(definition)
+    return output_field is not None and not isinstance(output_field, MUTABLE_CASTS)
+
+
+def get_model_searchable_definitions(model):
+    """
+    Returns the searchable definitions of the types linked to the model,
+    all the searchable definitions if the model has no foreign key to a type model
+    """
+    metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+    definitions = metadata_model.objects.filter(searchable=True).exclude(field_name__isnull=True).order_by("pk")
+
+    type_filter = models.Q()
+    for type_field in model.get_element_type_fields():
+        for m2m_field in type_field.related_model._meta.many_to_many:
+            if m2m_field.related_model is metadata_model:
+                through = m2m_field.remote_field.through
+                type_filter |= models.Q(pk__in=through.objects.values(m2m_field.m2m_reverse_field_name()))
+
+    if type_filter:
+        definitions = definitions.filter(type_filter)
+
+    return list(definitions)
+
+
+def get_metadata_indexes(model, methods=(EXPRESSION,)):
+    """
+    Returns the wanted indexes of the model by name
+
+    - ``expression`` : a btree index on ``element_metadata -> 'key'`` for every searchable key, used by
+      the lookups ``element_metadata__key__gte=...``. The keys whose type has an output field (integer, decimal,
+      relation...) also get an index on the value cast to it, used by the typed expressions.
+      Date keys are not cast, the text to date casts are not immutable in PostgreSQL.
+    - ``gin`` : one ``jsonb_path_ops`` GIN index on the whole json, used by ``element_metadata__contains``.
+    """
+    indexes = {}
+
+    if EXPRESSION in methods:
+        for definition in get_model_searchable_definitions(model):
+            # Named after the indexed json key, the index is replaced when the storage of the key changes
+            json_key = get_metadata_json_key(definition, model)
+            name = get_index_name(model, "k", json_key)
+            indexes[name] = models.Index(get_metadata_key_expression(definition, model=model), name=name)
+
+            if is_cast_indexed(definition):
+                name = get_index_name(model, "c", f"{json_key}:{definition.meta_type}")
+                indexes[name] = models.Index(get_metadata_cast_expression(definition, model=model), name=name)
+
+    if GIN in methods:
+        from django.contrib.postgres.indexes import GinIndex
+
+        name = get_index_name(model, "gin")
+        indexes[name] = GinIndex(fields=["element_metadata"], opclasses=["jsonb_path_ops"], name=name)
+
+    return indexes
+
+
+def get_existing_indexes(model, connection):
+    """The names of the metadata indexes of the model table in the database"""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return {name for name, constraint in constraints.items() if constraint["index"] and name.startswith(INDEX_PREFIX)}
+
+
+def sync_metadata_indexes(model, schema_editor, methods=(EXPRESSION,), concurrently=True, dry_run=False):
+    """
+    Creates the missing indexes of the model and drops the stale ones, returns (created, dropped) names.
+    ``concurrently`` needs a schema editor outside of a transaction.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        raise NotImplementedError("The metadata expression indexes are only available on PostgreSQL")
+
+    wanted = get_metadata_indexes(model, methods)
+    existing = get_existing_indexes(model, schema_editor.connection)
+
+    dropped = sorted(existing - wanted.keys())
+    created = sorted(wanted.keys() - existing)
+
+    if dry_run:
+        return created, dropped
+
+    for name in dropped:
+        logger.info(f"Dropping the stale metadata index {name} on {model._meta.db_table}")
+        schema_editor.remove_index(
+            model, models.Index(fields=["element_metadata"], name=name), concurrently=concurrently
+        )
+
+    for name in created:
+        logger.info(f"Creating the metadata index {name} on {model._meta.db_table}")
+        schema_editor.add_index(model, wanted[name], concurrently=concurrently)
+
+    return created, dropped
+
+
+class SyncMetadataIndexes(Operation):
+    """
+    Migration operation synchronizing the metadata indexes of a model with the current searchable definitions.
+    The migration must declare ``atomic = False`` when ``concurrently`` is used.
+
+        operations = [SyncMetadataIndexes("shop.Material")]
+    """
+
+    reversible = True
+    reduces_to_sql = False
+
+    def __init__(self, model, methods=(EXPRESSION,), concurrently=True):
+        self.model = model
+        self.methods = tuple(methods)
+        self.concurrently = concurrently
+
+    def deconstruct(self):
+        kwargs = {"model": self.model}
+        if self.methods != (EXPRESSION,):
+            kwargs["methods"] = self.methods
+        if not self.concurrently:
+            kwargs["concurrently"] = self.concurrently
+        return self.__class__.__qualname__, [], kwargs
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def get_model(self):
+        # The definitions are read from the live models, not the historical ones
+        from django.apps import apps
+
+        return apps.get_model(self.model)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            logger.debug("Metadata indexes skipped, the database is not PostgreSQL")
+            return
+        sync_metadata_indexes(self.get_model(), schema_editor, self.methods, concurrently=self.concurrently)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        sync_metadata_indexes(self.get_model(), schema_editor, methods=(), concurrently=self.concurrently)
+
+    def describe(self):
+        return f"Synchronize the metadata indexes of {self.model}"
+
+    @property
+    def migration_name_fragment(self):
+        return f"sync_metadata_indexes_{self.model.replace('.', '_').lower()}"
@@ -0,0 +1,154 @@
+"""
+Staleness of the materialized metadata displays
+The displays of ``MaterializedMetadataMixin`` models are reset to NULL, with one update per model,
+when a definition or the metadata of a type change, or when a relation target is deleted or its description changes.
+``refresh_metadata_display`` computes them again in batches.
+"""
+
+import threading
+
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+import swapper
+
+from .autocomplete import get_object_title
+from .cache import definition_cache
+from .expressions import get_metadata_json_key
+from .meta_types import meta_types
+from .search import get_index_value, get_search_index_model
+
+
+def get_materialized_models():
+    """The installed models storing their formatted metadata"""
+    from .model_mixins import MaterializedMetadataMixin
+
+    return [model for model in apps.get_models() if issubclass(model, MaterializedMetadataMixin)]
+
+
+def mark_display_stale(queryset):
+    """Clears the stored display of the elements, it is formatted again on the next read"""
+    return queryset.exclude(element_metadata_display__isnull=True).update(element_metadata_display=None)
+
+
+class RelationDefinitions:
+    """The relation definitions by label of their target model, reloaded when the global definitions version changes"""
+
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = definition_cache.read_version(definition_cache.get_version_key(None))
+        entry = self._entry
+        if entry is None or entry[0] != version:
+            metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+            by_target = {}
+            relation_types = [name for name, meta_type in meta_types.items() if meta_type.is_relation]
+            for definition in metadata_model.objects.filter(meta_type__in=relation_types):
+                target = definition.get_metadata_model()
+                if target is not None:
+                    by_target.setdefault(target._meta.label_lower, []).append(definition)
+            entry = (version, by_target)
+            with self._lock:
+                self._entry = entry
+        return entry[1]
+
+
+relation_definitions = RelationDefinitions()
+
+
+def definition_display_changed(sender, instance, raw=False, **kwargs):
+    """Resets the displays of the elements whose type uses the definition"""
+    if raw:
+        return
+
+    for model in get_materialized_models():
+        condition = Q()
+        for type_field in model.get_element_type_fields():
+            for field in type_field.related_model._meta.many_to_many:
+                if field.related_model is sender:
+                    condition |= Q(**{f"{type_field.name}__{field.name}": instance.pk})
+        if condition:
+            mark_display_stale(model._default_manager.filter(condition))
+
+
+def type_display_changed(type_model, pks=None):
+    """Resets the displays of the elements of the types, of all the types of the model without ``pks``"""
+    for model in get_materialized_models():
+        for type_field in model.get_element_type_fields():
+            if type_field.related_model is not type_model:
+                continue
+            queryset = model._default_manager.all()
+            if pks is not None:
+                queryset = queryset.filter(**{f"{type_field.attname}__in": pks})
+            mark_display_stale(queryset)
+
+
+def relation_target_pre_save(sender, instance, raw=False, **kwargs):
+    """Keeps the description of a relation target before it is saved, the displays only change with it"""
+    instance._metadata_display_title = None
+    if raw or instance._state.adding or not relation_definitions.get().get(sender._meta.label_lower):
+        return
+
+    previous = sender._default_manager.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._metadata_display_title = get_object_title(previous)
+
+
+def relation_target_saved(sender, instance, raw=False, created=False, **kwargs):
+    """Marks the displays stale when the title of a related row changes"""
+    previous_title = getattr(instance, "_metadata_display_title", None)
+    instance._metadata_display_title = None
+    if raw or created or previous_title is None or previous_title == get_object_title(instance):
+        return
+    mark_relation_displays_stale(sender, instance.pk)
+
+
+def relation_target_deleted(sender, instance, **kwargs):
+    """Marks stale the displays showing a deleted related row"""
+    mark_relation_displays_stale(sender, instance.pk)
+
+
+def get_relation_condition(model, definitions, pk):
+    """
+    The elements of the model whose relation metadata point to the pk. The searchable definitions are looked up
+    in the ``MetadataSearchIndex`` table on the (metadata, column) index of their type, the others in the json.
+    """
+    from .receivers import INTEGER_PK_TYPES
+
+    condition = Q()
+    json_definitions = definitions
+    if model._meta.pk.get_internal_type() in INTEGER_PK_TYPES:
+        index_model = get_search_index_model()
+        indexed = {}
+        json_definitions = []
+        for definition in definitions:
+            column = index_model.VALUE_COLUMNS.get(definition.meta_type)
+            value = get_index_value(index_model, column, pk) if definition.searchable and column else None
+            if value is None:
+                json_definitions.append(definition)
+            else:
+                indexed.setdefault((column, value), []).append(definition)
+
+        for (column, value), searchable in indexed.items():
+            condition |= Q(
+                pk__in=index_model.objects.filter(
+                    content_type=ContentType.objects.get_for_model(model), metadata__in=searchable, **{column: value}
+                ).values("object_id")
+            )
+
+    for definition in json_definitions:
+        lookup = f"element_metadata__{get_metadata_json_key(definition, model)}"
+        condition |= Q(**{lookup: pk}) | Q(**{lookup: str(pk)})
+    return condition
+
+
+def mark_relation_displays_stale(target_model, pk):
+    """Resets the displays of the elements whose relation metadata point to the pk of the target model"""
+    definitions = relation_definitions.get().get(target_model._meta.label_lower)
+    if not definitions:
+        return
+
+    for model in get_materialized_models():
+        mark_display_stale(model._default_manager.filter(get_relation_condition(model, definitions, pk)))
@@ -0,0 +1,105 @@
+"""
+Streaming exports of the element metadata
+The rows are read with ``iterator()`` and formatted chunk by chunk, so the memory
+stays constant whatever the size of the table. The generators can be given to a
+``StreamingHttpResponse`` :
+
+    rows = iter_metadata_rows(Material.objects.all())
+    return StreamingHttpResponse(stream_csv(rows, columns), content_type="text/csv")
+"""
+
+import csv
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+CSV = "csv"
+NDJSON = "ndjson"
+EXPORT_FORMATS = (CSV, NDJSON)
+
+
+class Echo:
+    """Pseudo buffer returning what is written, for the csv writer"""
+
+    def write(self, value):
+        return value
+
+
+def get_metadata_columns(queryset):
+    """
+    Returns the metadata field names of the element types used by the queryset,
+    from their ``get_fields_schema()``
+    """
+    columns = {}
+    for type_field in queryset.model.get_element_type_fields():
+        type_model = type_field.related_model
+        element_types = type_model._default_manager.filter(
+            pk__in=queryset.order_by().values(type_field.attname)
+        ).order_by("pk")
+        for element_type in element_types:
+            for field_name in element_type.get_fields_schema()["keys"]:
+                columns.setdefault(field_name, None)
+
+    return list(columns)
+
+
+def iter_chunks(queryset, chunk_size):
+    """Yields the rows of the queryset by lists of ``chunk_size``"""
+    iterator = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_metadata_rows(queryset, fields=("pk",), columns=None, chunk_size=2000, formatted=False):
+    """
+    Yields a dict per element with the ``fields`` of the model and the metadata ``columns``.
+    The metadata are exported as stored, the relation metadata as pks, so ``import_metadata`` can read them back.
+    With ``formatted``, the relation metadata are resolved in bulk for every chunk into their description
+    and the numbers are formatted like ``get_formatted_metadata(get_string=True)``, for display only.
+    """
+    model = queryset.model
+    if columns is None:
+        columns = get_metadata_columns(queryset)
+
+    type_fields = [type_field.name for type_field in model.get_element_type_fields()]
+    # The element types also upgrade the metadata of an older schema version
+    if type_fields:
+        queryset = queryset.select_related(*type_fields)
+
+    for chunk in iter_chunks(queryset, chunk_size):
+        if formatted:
+            chunk_metadata = model.format_metadata_bulk(chunk, get_string=True)
+        else:
+            chunk_metadata = [instance.element_metadata for instance in chunk]
+
+        for instance, element_metadata in zip(chunk, chunk_metadata):
+            element_metadata = element_metadata or {}
+            row = {field: getattr(instance, field) for field in fields}
+            for column in columns:
+                row.setdefault(column, element_metadata.get(column))
+            yield row
+
+
+def stream_ndjson(rows):
+    """Yields one json line by row"""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + "\n"
+
+
+def get_csv_value(value):
+    """The csv cell of a value, the json of the lists and dicts"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+def stream_csv(rows, columns):
+    """Yields the csv lines of ``rows``, ``columns`` being the model fields followed by the metadata columns"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([get_csv_value(row.get(column)) for column in columns])
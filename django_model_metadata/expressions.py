@@ -0,0 +1,79 @@
+"""Database expressions over the values stored in ``element_metadata``"""
+
+from django.core.exceptions import FieldError
+from django.db.models import F, Q
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+from django.db.models.functions import Cast
+import swapper
+
+from .compact import get_compact_key
+
+
+def get_metadata_output_field(definition):
+    """Returns the model field used to cast a metadata value in the database, None for text values"""
+    return definition.get_meta_type().get_output_field(definition)
+
+
+def get_metadata_json_key(definition, model=None):
+    """The key of the definition in the stored json, its pk for the models with ``compact_metadata``"""
+    if getattr(model, "compact_metadata", False):
+        return get_compact_key(definition.pk)
+    return definition.field_name
+
+
+def get_metadata_key_expression(definition, json_field="element_metadata", model=None):
+    """The json value of the key, like the ORM lookups ``element_metadata__<field_name>__...`` use it"""
+    return KeyTransform(get_metadata_json_key(definition, model), json_field)
+
+
+def get_metadata_cast_expression(definition, json_field="element_metadata", model=None):
+    """The value of the key cast to the database type of the definition"""
+    output_field = get_metadata_output_field(definition)
+    expression = KeyTextTransform(get_metadata_json_key(definition, model), json_field)
+    if output_field is None:
+        return expression
+    return Cast(expression, output_field=output_field)
+
+
+def get_metadata_definitions_by_name(model, field_names):
+    """Returns ``{field_name: definition}`` for the definitions linked to the element types of ``model``"""
+    metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+
+    linked = Q()
+    for type_field in model.get_element_type_fields():
+        for field in type_field.related_model._meta.many_to_many:
+            if field.related_model is metadata_model:
+                linked |= Q(**{f"{field.related_query_name()}__isnull": False})
+
+    definitions = {}
+    for definition in metadata_model.objects.filter(linked, field_name__in=field_names).distinct():
+        known = definitions.setdefault(definition.field_name, definition)
+        if known.meta_type != definition.meta_type:
+            raise FieldError(
+                f"The metadata '{definition.field_name}' of {model._meta.label} has conflicting types "
+                f"({known.meta_type}, {definition.meta_type})"
+            )
+    return definitions
+
+
+def get_referenced_names(expression):
+    """Yields the names of the ``F()`` references of an expression tree"""
+    if isinstance(expression, F):
+        yield expression.name
+    elif hasattr(expression, "get_source_expressions"):
+        for source in expression.get_source_expressions():
+            yield from get_referenced_names(source)
+
+
+def replace_references(expression, replacements):
+    """Returns a copy of the expression where the ``F()`` references found in ``replacements`` are replaced"""
+    if isinstance(expression, F):
+        return replacements.get(expression.name, expression)
+    if not hasattr(expression, "get_source_expressions"):
+        return expression
+
+    expression = expression.copy()
+    expression.set_source_expressions(
+        [replace_references(source, replacements) for source in expression.get_source_expressions()]
+    )
+    return expression
@@ -0,0 +1,103 @@
+"""Fields of the metadata"""
+
+from django import forms
+from django.db import models
+from django.urls import NoReverseMatch, reverse
+
+from django.db.models.query_utils import DeferredAttribute
+
+from .compact import decode_metadata, get_stored_metadata
+from .schema import upgrade_on_read
+
+
+class MetadataAutocompleteSelect(forms.Select):
+    """
+    Renders only the selected option of a relation metadata,
+    the other options are searched through the ``metadata-autocomplete-objects`` view
+    """
+
+    def get_autocomplete_url(self):
+        queryset = getattr(self.choices, "queryset", None)
+        if queryset is None:
+            return None
+        try:
+            return reverse(
+                "metadata-autocomplete-objects",
+                kwargs={"el_type": "objects", "model_label": queryset.model._meta.label},
+            )
+        except NoReverseMatch:
+            return None
+
+    def get_context(self, name, value, attrs):
+        attrs = dict(attrs or {})
+        url = self.get_autocomplete_url()
+        if url:
+            attrs["data-autocomplete-url"] = url
+        return super().get_context(name, value, attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        model_choices = self.choices
+        queryset = getattr(model_choices, "queryset", None)
+        if queryset is None:
+            return super().optgroups(name, value, attrs)
+
+        choices = []
+        if model_choices.field.empty_label is not None:
+            choices.append(("", model_choices.field.empty_label))
+
+        selected = [selected_value for selected_value in value if selected_value not in (None, "")]
+        if selected:
+            key = model_choices.field.to_field_name or "pk"
+            choices.extend(model_choices.choice(obj) for obj in queryset.filter(**{f"{key}__in": selected}))
+
+        self.choices = choices
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = model_choices
+
+
+class MetadataModelChoiceField(forms.ModelChoiceField):
+    """
+    Relation metadata field : the related table is never listed,
+    the submitted value is checked with a single pk lookup.
+    """
+
+    widget = MetadataAutocompleteSelect
+
+
+class MetadataDescriptor(DeferredAttribute):
+    """
+    Upgrades the metadata of an older schema version when they are first read with the element type loaded
+    It is a data descriptor, the loaded value in the instance ``__dict__`` does not bypass it.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is not None and "_metadata_upgrade_from" in instance.__dict__:
+            upgrade_on_read(instance)
+        return super().__get__(instance, cls)
+
+    def __set__(self, instance, value):
+        # New metadata follow the current schema
+        instance.__dict__.pop("_metadata_upgrade_from", None)
+        instance.__dict__[self.field.attname] = value
+
+
+class MetadataJSONField(models.JSONField):
+    """
+    The ``element_metadata`` field, it decodes the compact rows and encodes the metadata
+    of the models declaring ``compact_metadata = True``
+    """
+
+    descriptor_class = MetadataDescriptor
+
+    def from_db_value(self, value, expression, connection):
+        return decode_metadata(super().from_db_value(value, expression, connection))
+
+    def pre_save(self, model_instance, add):
+        return get_stored_metadata(model_instance)
+
+    def deconstruct(self):
+        # The migrations keep a plain JSONField, the encoding does not change the column
+        name, path, args, kwargs = super().deconstruct()
+        return name, "django.db.models.JSONField", args, kwargs
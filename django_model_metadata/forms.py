@@ -2,6 +2,8 @@ import logging
 from django import forms
 from django_jsonform.widgets import JSONFormWidget
 
+from .meta_types import meta_types
+
 
 logger = logging.getLogger(__name__)
 
@@ -50,3 +52,10 @@ class JsonElementFormMixin:
 
 class GeneralMetadataForm(JsonElementFormMixin, forms.ModelForm):
     _metadata_field = "widget_attrs"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # The registered metadata types are selectable with the built-in ones
+        if "meta_type" in self.fields:
+            self.fields["meta_type"].choices = [("", "---------"), *meta_types.get_choices()]
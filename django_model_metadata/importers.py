@@ -0,0 +1,153 @@
+"""
+Chunked imports of metadata bearing elements
+The records are read from the file in a streaming way, validated by chunk with
+``validate_metadata_bulk()`` and written with ``bulk_create()``/``bulk_update()``.
+"""
+
+import csv
+import json
+import logging
+from itertools import islice
+
+from django.db import transaction
+
+from .compact import stored_metadata
+from .exporters import CSV, NDJSON
+from .search import update_search_index
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = (CSV, NDJSON)
+
+
+def iter_records(path, file_format):
+    """Yields the records of a csv or ndjson file as dicts"""
+    with open(path, newline="") as source:
+        if file_format == CSV:
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_chunks(records, chunk_size):
+    """Yields the records by lists of ``chunk_size``"""
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class MetadataImporter:
+    """
+    Maps the records on an element model : the columns matching a model field fill the field,
+    the ones matching a ``field_name`` of the element type fill ``element_metadata``.
+    With a ``key`` field, the existing elements are updated instead of created.
+    """
+
+    def __init__(self, model, element_type, type_field, key=None, using="default"):
+        self.model = model
+        self.element_type = element_type
+        self.type_field = type_field
+        self.key = key
+        self.using = using
+
+        self.metadata_fields = {
+            definition.field_name for definition in element_type.get_metadata_definitions() if definition.field_name
+        }
+        self.model_fields = {
+            field.attname: field
+            for field in model._meta.concrete_fields
+            if field.name not in ("element_metadata", type_field.name)
+        }
+        self.model_fields.update({field.name: field for field in self.model_fields.values()})
+        self.ignored_columns = set()
+
+    def split_record(self, record):
+        values = {}
+        element_metadata = {}
+        for column, value in record.items():
+            if column in self.metadata_fields:
+                # Empty cells are missing values
+                if value is not None and value != "":
+                    element_metadata[column] = value
+            elif column in self.model_fields:
+                values[self.model_fields[column].attname] = value
+            else:
+                self.ignored_columns.add(column)
+        return values, element_metadata
+
+    def get_existing(self, records):
+        if not self.key:
+            return {}
+        keys = [record[self.key] for record in records if record.get(self.key) not in (None, "")]
+        key_field = self.model_fields[self.key]
+        keys = [key_field.to_python(key) for key in keys]
+        # The element types upgrade the metadata of an older schema version
+        return (
+            self.model._default_manager.using(self.using)
+            .select_related(self.type_field.name)
+            .in_bulk(keys, field_name=key_field.name)
+        )
+
+    def build_instances(self, records):
+        existing = self.get_existing(records)
+        key_field = self.model_fields[self.key] if self.key else None
+
+        instances = []
+        for record in records:
+            values, element_metadata = self.split_record(record)
+            instance = None
+            if key_field and record.get(self.key) not in (None, ""):
+                instance = existing.get(key_field.to_python(record[self.key]))
+
+            if instance is None:
+                instance = self.model(**values)
+                instance.element_metadata = element_metadata
+            else:
+                instance.upgrade_metadata()
+                for attname, value in values.items():
+                    setattr(instance, attname, value)
+                instance.element_metadata = {**(instance.element_metadata or {}), **element_metadata}
+
+            setattr(instance, self.type_field.name, self.element_type)
+            instances.append(instance)
+
+        return instances
+
+    def import_chunk(self, records):
+        """
+        Validates and writes a chunk in its own transaction,
+        returns (created, updated, errors by record position)
+        """
+        instances = self.build_instances(records)
+        errors = self.model.validate_metadata_bulk(instances)
+
+        to_create = []
+        to_update = []
+        for index, instance in enumerate(instances):
+            if index in errors:
+                continue
+            if instance._state.adding:
+                to_create.append(instance)
+            else:
+                to_update.append(instance)
+
+        update_fields = {"element_metadata", self.type_field.name}
+        for record in records:
+            update_fields.update(
+                self.model_fields[column].name
+                for column in record
+                if column in self.model_fields and column != self.key and not self.model_fields[column].primary_key
+            )
+
+        with transaction.atomic(using=self.using):
+            created = self.model._default_manager.using(self.using).bulk_create(to_create)
+            if to_update:
+                with stored_metadata(to_update):
+                    self.model._default_manager.using(self.using).bulk_update(to_update, sorted(update_fields))
+            update_search_index(created + to_update, using=self.using)
+
+        return len(created), len(to_update), errors
@@ -0,0 +1,222 @@
+"""
+Opt-in instrumentation of the metadata entry points
+Enabled with ``DJANGO_MODEL_METADATA_INSTRUMENTATION = True``, every instrumented call measures its duration,
+the queries it issued, the rows reported by the database cursors and the compiled objects cache hits.
+The measures are sent with the ``metadata_operation_finished`` signal and forwarded to the
+sinks of ``DJANGO_MODEL_METADATA_INSTRUMENTATION_SINKS``.
+"""
+
+import functools
+import logging
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from .conf import get_setting
+from .signals import metadata_operation_finished
+
+DEFAULT_SINKS = ["django_model_metadata.instrumentation.LoggingSink"]
+
+
+class Measure:
+    __slots__ = ("operation", "model", "queries", "rows", "cache_hits", "cache_misses")
+
+    def __init__(self, operation, model):
+        self.operation = operation
+        self.model = model
+        self.queries = 0
+        self.rows = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Instrumentation:
+    """The settings are read once, and again when they are overridden"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @cached_property
+    def enabled(self):
+        return bool(get_setting("INSTRUMENTATION", False))
+
+    @cached_property
+    def sinks(self):
+        sinks = []
+        for sink in get_setting("INSTRUMENTATION_SINKS", DEFAULT_SINKS):
+            if isinstance(sink, str):
+                sink = import_string(sink)()
+            sinks.append(sink)
+        return sinks
+
+    def reset(self):
+        self.__dict__.pop("enabled", None)
+        self.__dict__.pop("sinks", None)
+
+    @property
+    def stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        rowcount = getattr(context["cursor"], "rowcount", -1)
+        for measure in self.stack:
+            measure.queries += 1
+            if rowcount and rowcount > 0:
+                measure.rows += rowcount
+        return result
+
+    def record_cache(self, hit):
+        for measure in self.stack:
+            if hit:
+                measure.cache_hits += 1
+            else:
+                measure.cache_misses += 1
+
+    def call(self, operation, func, args, kwargs):
+        owner = args[0] if args else None
+        model = owner if isinstance(owner, type) else type(owner)
+        measure = Measure(operation, getattr(getattr(model, "_meta", None), "label", model.__name__))
+
+        stack = self.stack
+        with ExitStack() as wrappers:
+            # The query counter is installed once, by the outermost operation
+            if not stack:
+                for connection in connections.all():
+                    wrappers.enter_context(connection.execute_wrapper(self.execute_wrapper))
+            stack.append(measure)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                stack.pop()
+                metadata_operation_finished.send(
+                    sender=model,
+                    operation=operation,
+                    model=measure.model,
+                    duration=duration,
+                    queries=measure.queries,
+                    rows=measure.rows,
+                    cache_hits=measure.cache_hits,
+                    cache_misses=measure.cache_misses,
+                )
+
+
+instrumentation = Instrumentation()
+
+
+def instrumented(operation):
+    """Decorates a metadata entry point, the disabled cost is one attribute lookup"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not instrumentation.enabled:
+                return func(*args, **kwargs)
+            return instrumentation.call(operation, func, args, kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@receiver(setting_changed)
+def reset_instrumentation(setting, **kwargs):
+    """Reloads the instrumentation settings when the tests override them"""
+    if setting.startswith("DJANGO_MODEL_METADATA_INSTRUMENTATION"):
+        instrumentation.reset()
+
+
+@receiver(metadata_operation_finished, dispatch_uid="dmm_instrumentation_sinks")
+def dispatch_to_sinks(sender, **kwargs):
+    """Sends the measures of a finished operation to the configured sinks"""
+    for sink in instrumentation.sinks:
+        sink.record(**kwargs)
+
+
+class LoggingSink:
+    def __init__(self, logger="django_model_metadata.instrumentation", level=logging.DEBUG):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def record(self, operation, model, duration, queries, rows, cache_hits, cache_misses, **kwargs):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level,
+                f"{model}.{operation} : {duration * 1000:.3f}ms, {queries} queries, {rows} rows, "
+                f"cache {cache_hits} hits / {cache_misses} misses",
+            )
+
+
+class StatsdSink:
+    """Sends the measures to a statsd compatible daemon over UDP, losing them silently when it is down"""
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (
+            host or get_setting("STATSD_HOST", "127.0.0.1"),
+            int(port or get_setting("STATSD_PORT", 8125)),
+        )
+        self.prefix = prefix or get_setting("STATSD_PREFIX", "metadata")
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_lines(self, operation, duration, queries, rows, cache_hits, cache_misses):
+        name = f"{self.prefix}.{operation}"
+        return [
+            f"{name}.duration:{duration * 1000:.3f}|ms",
+            f"{name}.calls:1|c",
+            f"{name}.queries:{queries}|c",
+            f"{name}.rows:{rows}|c",
+            f"{name}.cache_hits:{cache_hits}|c",
+            f"{name}.cache_misses:{cache_misses}|c",
+        ]
+
+    def record(self, operation, duration, queries, rows, cache_hits, cache_misses, **kwargs):
+        payload = "\n".join(self.get_lines(operation, duration, queries, rows, cache_hits, cache_misses))
+        try:
+            self.socket.sendto(payload.encode(), self.address)
+        except OSError:
+            pass
+
+
+class PrometheusSink:
+    """Accumulates the measures in process, ``render()`` returns them in the Prometheus text format"""
+
+    COUNTERS = ("calls", "duration_seconds", "queries", "rows", "cache_hits", "cache_misses")
+
+    def __init__(self, prefix="django_model_metadata"):
+        self.prefix = prefix
+        self.values = defaultdict(lambda: dict.fromkeys(self.COUNTERS, 0))
+        self._lock = threading.Lock()
+
+    def record(self, operation, model, duration, queries, rows, cache_hits, cache_misses, **kwargs):
+        with self._lock:
+            values = self.values[(operation, model)]
+            values["calls"] += 1
+            values["duration_seconds"] += duration
+            values["queries"] += queries
+            values["rows"] += rows
+            values["cache_hits"] += cache_hits
+            values["cache_misses"] += cache_misses
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for counter in self.COUNTERS:
+                name = f"{self.prefix}_{counter}_total"
+                lines.append(f"# TYPE {name} counter")
+                for (operation, model), values in sorted(self.values.items()):
+                    lines.append(f'{name}{{operation="{operation}",model="{model}"}} {values[counter]}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,71 @@
+import json
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_model_metadata.benchmarks import MetadataBenchmark
+from django_model_metadata.model_mixins import CustomMetadataMixin, GeneralMetadataTypeMixin
+
+
+def int_list(value):
+    """Parses a comma separated list of integers, e.g. ``10,100``"""
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the metadata hot paths on synthetic element types and elements "
+        "created in a rolled back transaction, and writes the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("type_model", help="The element type model as 'app_label.ModelName'")
+        parser.add_argument("element_model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument(
+            "--definitions",
+            type=int_list,
+            default=[5, 50, 200],
+            help="Comma separated definition counts, spread over every meta type",
+        )
+        parser.add_argument("--rows", type=int_list, default=[10000], help="Comma separated element counts")
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--sample", type=int, default=200, help="The elements used by the per element operations")
+        parser.add_argument("--label", help="A label stored with the results, e.g. the commit")
+        parser.add_argument("--output", help="The JSON file to write, the standard output by default")
+        parser.add_argument("--database", default="default")
+
+    def get_model(self, label, mixin):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+        if not issubclass(model, mixin):
+            raise CommandError(f"{model._meta.label} does not inherit from {mixin.__name__}")
+        return model
+
+    def handle(self, *args, **options):
+        type_model = self.get_model(options["type_model"], GeneralMetadataTypeMixin)
+        element_model = self.get_model(options["element_model"], CustomMetadataMixin)
+        if not [field for field in element_model.get_element_type_fields() if field.related_model is type_model]:
+            raise CommandError(f"{element_model._meta.label} has no foreign key to {type_model._meta.label}")
+
+        benchmark = MetadataBenchmark(
+            type_model,
+            element_model,
+            using=options["database"],
+            repeat=options["repeat"],
+            sample=options["sample"],
+            stdout=self.stderr,
+        )
+        try:
+            report = benchmark.run(options["definitions"], options["rows"])
+        except ValueError as e:
+            raise CommandError(e)
+        report["meta"]["label"] = options["label"]
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
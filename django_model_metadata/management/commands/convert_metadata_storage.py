@@ -0,0 +1,101 @@
+import json
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from django_model_metadata.compact import encode_metadata, get_storage_size
+from django_model_metadata.model_mixins import CustomMetadataMixin
+from django_model_metadata.schema import stamp_metadata
+
+COMPACT = "compact"
+NAMED = "named"
+
+
+def get_json_size(value):
+    """The size in bytes of the stored json"""
+    return len(json.dumps(value, cls=DjangoJSONEncoder).encode()) if value else 0
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites the stored metadata of a model keyed by definition pk (compact) or by field name (named), "
+        "and reports the storage sizes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("--to", choices=[COMPACT, NAMED], required=True)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only measure the sizes")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, CustomMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+
+        to_compact = options["to"] == COMPACT
+        if to_compact != model.compact_metadata:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"{model._meta.label}.compact_metadata is {model.compact_metadata}, "
+                    f"the next saves will store the metadata {'compact' if model.compact_metadata else 'named'}"
+                )
+            )
+
+        using = options["database"]
+        batch_size = options["batch_size"]
+        column_size, table_size = get_storage_size(model, using)
+
+        queryset = model._default_manager.using(using).order_by("pk")
+        type_fields = [type_field.name for type_field in model.get_element_type_fields()]
+        if type_fields:
+            queryset = queryset.select_related(*type_fields)
+
+        last_pk = None
+        total = 0
+        named_size = 0
+        compact_size = 0
+
+        while True:
+            batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_queryset[:batch_size])
+            if not batch:
+                break
+
+            for instance in batch:
+                instance.upgrade_metadata()
+                # The instances are always loaded named
+                encoded = encode_metadata(instance.get_element_type(), instance.element_metadata)
+                named_size += get_json_size(instance.element_metadata)
+                compact_size += get_json_size(encoded)
+                stored = encoded if to_compact else instance.element_metadata
+                if model.versioned_metadata:
+                    stored = stamp_metadata(stored)
+                instance.element_metadata = stored
+
+            # bulk_update() writes the values as they are, without encoding them again
+            if not options["dry_run"]:
+                model._default_manager.using(using).bulk_update(batch, ["element_metadata"])
+
+            total += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"{total} elements {'measured' if options['dry_run'] else 'converted'}")
+
+        saving = (1 - compact_size / named_size) * 100 if named_size else 0
+        self.stdout.write(
+            f"JSON payload : {named_size} bytes named, {compact_size} bytes compact ({saving:.1f}% smaller compact)"
+        )
+        if column_size is not None:
+            new_column_size, new_table_size = get_storage_size(model, using)
+            self.stdout.write(f"Stored column : {column_size} bytes before, {new_column_size} bytes after")
+            if table_size is not None:
+                self.stdout.write(
+                    f"Table : {table_size} bytes before, {new_table_size} bytes after (the space is reclaimed by VACUUM)"
+                )
+        self.stdout.write(self.style.SUCCESS(f"{total} {model._meta.verbose_name_plural} processed"))
@@ -0,0 +1,70 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_model_metadata.exporters import (
+    CSV,
+    EXPORT_FORMATS,
+    NDJSON,
+    get_metadata_columns,
+    iter_metadata_rows,
+    stream_csv,
+    stream_ndjson,
+)
+from django_model_metadata.model_mixins import CustomMetadataMixin
+
+
+class Command(BaseCommand):
+    help = "Exports the elements of a model with their metadata flattened into columns, in a streaming way"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("--format", choices=EXPORT_FORMATS, default=CSV)
+        parser.add_argument("--output", help="The file to write, the standard output by default")
+        parser.add_argument("--fields", default="pk", help="Comma separated model fields to export, 'pk' by default")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument(
+            "--formatted",
+            action="store_true",
+            help="Export the metadata formatted for display, with the relation descriptions. "
+            "The formatted exports can not be imported back.",
+        )
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, CustomMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+
+        queryset = model._default_manager.using(options["database"]).order_by("pk")
+        fields = [field.strip() for field in options["fields"].split(",") if field.strip()]
+        columns = get_metadata_columns(queryset)
+
+        rows = iter_metadata_rows(
+            queryset, fields=fields, columns=columns, chunk_size=options["chunk_size"], formatted=options["formatted"]
+        )
+        if options["format"] == NDJSON:
+            lines = stream_ndjson(rows)
+        else:
+            lines = stream_csv(rows, fields + [column for column in columns if column not in fields])
+
+        start = time.perf_counter()
+        # The csv header is not an element
+        count = -1 if options["format"] == CSV else 0
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as output:
+                for line in lines:
+                    output.write(line)
+                    count += 1
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
+                count += 1
+
+        self.stderr.write(f"{count} elements exported in {time.perf_counter() - start:.2f}s")
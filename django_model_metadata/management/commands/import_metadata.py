@@ -0,0 +1,131 @@
+import json
+import os
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_model_metadata.exporters import CSV
+from django_model_metadata.importers import IMPORT_FORMATS, MetadataImporter, iter_chunks, iter_records
+from django_model_metadata.model_mixins import CustomMetadataMixin
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports elements with their metadata from a CSV or NDJSON file, by chunks validated in bulk "
+        "and written in their own transactions. An interrupted import can be resumed from its checkpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("path", help="The file to import")
+        parser.add_argument("--element-type", required=True, help="The pk of the element type of the records")
+        parser.add_argument("--type-field", help="The foreign key to the element type, guessed by default")
+        parser.add_argument("--format", choices=IMPORT_FORMATS, help="Guessed from the file extension by default")
+        parser.add_argument("--key", help="A unique model field identifying the elements to update")
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--checkpoint", help="The checkpoint file, '<path>.checkpoint.json' by default")
+        parser.add_argument("--resume", action="store_true", help="Skip the records imported before the checkpoint")
+        parser.add_argument("--errors", help="A NDJSON file receiving the invalid records and their errors")
+        parser.add_argument("--database", default="default")
+
+    def get_model(self, label):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, CustomMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+        return model
+
+    def get_type_field(self, model, name):
+        type_fields = model.get_element_type_fields()
+        if name:
+            type_fields = [field for field in type_fields if field.name == name]
+        if len(type_fields) != 1:
+            raise CommandError("Can not guess the element type field, use --type-field")
+        return type_fields[0]
+
+    def read_checkpoint(self, path, source):
+        if not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get("source") != os.path.abspath(source):
+            raise CommandError(f"The checkpoint {path} belongs to another file")
+        return checkpoint["records"]
+
+    def write_checkpoint(self, path, source, records):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump({"source": os.path.abspath(source), "records": records}, checkpoint_file)
+        os.replace(tmp_path, path)
+
+    def handle(self, *args, **options):
+        model = self.get_model(options["model"])
+        type_field = self.get_type_field(model, options["type_field"])
+        try:
+            element_type = type_field.related_model._default_manager.using(options["database"]).get(
+                pk=options["element_type"]
+            )
+        except (type_field.related_model.DoesNotExist, ValueError):
+            raise CommandError(
+                f"No {type_field.related_model._meta.verbose_name} with the pk {options['element_type']}"
+            )
+
+        path = options["path"]
+        file_format = options["format"] or (CSV if path.lower().endswith(".csv") else "ndjson")
+        checkpoint_path = options["checkpoint"] or f"{path}.checkpoint.json"
+        done = self.read_checkpoint(checkpoint_path, path) if options["resume"] else 0
+
+        importer = MetadataImporter(model, element_type, type_field, key=options["key"], using=options["database"])
+        if options["key"]:
+            key_field = importer.model_fields.get(options["key"])
+            if not key_field or not key_field.unique:
+                raise CommandError(f"{options['key']} is not a unique field of {model._meta.label}")
+
+        records = iter_records(path, file_format)
+        for _ in range(done):
+            next(records, None)
+        if done:
+            self.stdout.write(f"Resuming after {done} records")
+
+        errors_file = open(options["errors"], "a") if options["errors"] else None
+        totals = {"created": 0, "updated": 0, "invalid": 0}
+        start = time.perf_counter()
+        try:
+            for chunk in iter_chunks(records, options["chunk_size"]):
+                chunk_start = time.perf_counter()
+                created, updated, errors = importer.import_chunk(chunk)
+                if errors_file:
+                    for index, record_errors in errors.items():
+                        errors_file.write(
+                            json.dumps({"record": done + index + 1, "errors": record_errors.get_json_data()}) + "\n"
+                        )
+
+                done += len(chunk)
+                self.write_checkpoint(checkpoint_path, path, done)
+                totals["created"] += created
+                totals["updated"] += updated
+                totals["invalid"] += len(errors)
+
+                elapsed = time.perf_counter() - chunk_start
+                self.stdout.write(
+                    f"{done} records : {created} created, {updated} updated, {len(errors)} invalid "
+                    f"in {elapsed:.2f}s ({len(chunk) / elapsed:.0f} records/s)"
+                )
+        finally:
+            if errors_file:
+                errors_file.close()
+
+        if importer.ignored_columns:
+            self.stdout.write(self.style.WARNING(f"Ignored columns : {', '.join(sorted(importer.ignored_columns))}"))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{totals['created']} created, {totals['updated']} updated, {totals['invalid']} invalid "
+                f"in {elapsed:.2f}s"
+            )
+        )
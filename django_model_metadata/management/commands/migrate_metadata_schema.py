@@ -0,0 +1,84 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from django_model_metadata.compact import stored_metadata
+from django_model_metadata.model_mixins import CustomMetadataMixin
+from django_model_metadata.schema import SCHEMA_VERSION_KEY, schema_version
+from django_model_metadata.search import update_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites the elements stored with an older metadata schema version, "
+        "in small transactions paginated on the pk"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--sleep", type=float, default=0.1, help="Seconds to wait between two batches")
+        parser.add_argument("--max-batches", type=int, help="Stop after this number of batches")
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, CustomMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+        if not model.versioned_metadata:
+            raise CommandError(f"{model._meta.label} does not declare versioned_metadata = True")
+
+        schema_version.clear()
+        version = schema_version.get()
+        if not version:
+            self.stdout.write("No metadata schema change recorded")
+            return
+
+        using = options["database"]
+        queryset = (
+            model._default_manager.using(using)
+            .filter(
+                ~Q(**{"element_metadata__has_key": SCHEMA_VERSION_KEY})
+                | Q(**{f"element_metadata__{SCHEMA_VERSION_KEY}__lt": version})
+            )
+            .exclude(element_metadata__isnull=True)
+            .exclude(element_metadata={})
+            .order_by("pk")
+        )
+        type_fields = [type_field.name for type_field in model.get_element_type_fields()]
+        if type_fields:
+            queryset = queryset.select_related(*type_fields)
+
+        last_pk = None
+        batches = 0
+        total = 0
+
+        while options["max_batches"] is None or batches < options["max_batches"]:
+            with transaction.atomic(using=using):
+                batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+                # The rows are locked until they are written back, where the database supports it
+                batch = list(batch_queryset.select_for_update(of=("self",))[: options["batch_size"]])
+                if not batch:
+                    break
+
+                for instance in batch:
+                    instance.upgrade_metadata()
+
+                with stored_metadata(batch):
+                    model._default_manager.using(using).bulk_update(batch, ["element_metadata"])
+                update_search_index(batch, using=using)
+
+            batches += 1
+            total += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"{total} elements migrated to the schema version {version}")
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"{total} {model._meta.verbose_name_plural} migrated"))
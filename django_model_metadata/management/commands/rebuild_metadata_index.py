@@ -0,0 +1,41 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_model_metadata.model_mixins import CustomMetadataMixin
+from django_model_metadata.search import update_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the searchable metadata index of a model, e.g. after changing the 'searchable' flags"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, CustomMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+
+        batch_size = options["batch_size"]
+        queryset = model._default_manager.using(options["database"]).order_by("pk")
+        last_pk = None
+        total = 0
+
+        while True:
+            batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_queryset[:batch_size])
+            if not batch:
+                break
+
+            update_search_index(batch, using=options["database"])
+            total += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"{total} elements indexed")
+
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt for {total} {model._meta.verbose_name_plural}"))
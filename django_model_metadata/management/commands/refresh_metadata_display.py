@@ -0,0 +1,50 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_model_metadata.model_mixins import MaterializedMetadataMixin
+
+
+class Command(BaseCommand):
+    help = "Computes the stale metadata displays of a model, or all of them with --all"
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("--all", action="store_true", help="Compute every display, not only the stale ones")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model(options["model"])
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, MaterializedMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from MaterializedMetadataMixin")
+
+        using = options["database"]
+        batch_size = options["batch_size"]
+        queryset = model._default_manager.using(using).order_by("pk")
+        if not options["all"]:
+            queryset = queryset.filter(element_metadata_display__isnull=True)
+        type_fields = [type_field.name for type_field in model.get_element_type_fields()]
+        if type_fields:
+            queryset = queryset.select_related(*type_fields)
+
+        last_pk = None
+        total = 0
+
+        while True:
+            batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_queryset[:batch_size])
+            if not batch:
+                break
+
+            model.refresh_metadata_display(batch, using=using)
+            total += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f"{total} displays computed")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Metadata display computed for {total} {model._meta.verbose_name_plural}")
+        )
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from django_model_metadata.model_mixins import CustomMetadataMixin
+from django_model_metadata.receivers import INTEGER_PK_TYPES
+from django_model_metadata.revalidation import get_shards, init_worker, validate_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Validates the stored metadata of a model against the current definitions, by pk shards "
+        "spread over worker processes, and writes the failing elements to a NDJSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The element model as 'app_label.ModelName'")
+        parser.add_argument("--report", required=True, help="The NDJSON file receiving the failing pks and errors")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--shard-size", type=int, default=50000, help="The number of pks of a shard")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--checkpoint", help="The checkpoint file, '<report>.checkpoint.json' by default")
+        parser.add_argument("--resume", action="store_true", help="Skip the shards validated before the checkpoint")
+        parser.add_argument("--database", default="default")
+
+    def get_model(self, label):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(e)
+
+        if not issubclass(model, CustomMetadataMixin):
+            raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+        if model._meta.pk.get_internal_type() not in INTEGER_PK_TYPES:
+            raise CommandError(f"{model._meta.label} has a non integer pk, it can not be sharded")
+        return model
+
+    def read_checkpoint(self, path, model, shard_size):
+        if not os.path.exists(path):
+            return set()
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if checkpoint.get("model") != model._meta.label or checkpoint.get("shard_size") != shard_size:
+            raise CommandError(f"The checkpoint {path} belongs to another model or shard size")
+        return set(checkpoint["done"])
+
+    def write_checkpoint(self, path, model, shard_size, done):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as checkpoint_file:
+            json.dump({"model": model._meta.label, "shard_size": shard_size, "done": sorted(done)}, checkpoint_file)
+        os.replace(tmp_path, path)
+
+    def handle(self, *args, **options):
+        model = self.get_model(options["model"])
+        using = options["database"]
+        shard_size = options["shard_size"]
+        checkpoint_path = options["checkpoint"] or f"{options['report']}.checkpoint.json"
+
+        done = self.read_checkpoint(checkpoint_path, model, shard_size) if options["resume"] else set()
+        shards = [shard for shard in get_shards(model, shard_size, using) if shard[0] not in done]
+        if done:
+            self.stdout.write(f"Resuming after {len(done)} shards")
+        self.stdout.write(f"{len(shards)} shards to validate with {options['workers']} workers")
+
+        # The workers must not share the connections of this process
+        connections.close_all()
+
+        totals = {"checked": 0, "invalid": 0}
+        start_time = time.perf_counter()
+        with (
+            open(options["report"], "a" if options["resume"] else "w") as report,
+            ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as executor,
+        ):
+            futures = [
+                executor.submit(validate_shard, model._meta.label, start, end, using, options["batch_size"])
+                for start, end in shards
+            ]
+            for future in as_completed(futures):
+                start, end, checked, failures = future.result()
+                for pk, errors in failures:
+                    report.write(json.dumps({"pk": pk, "errors": errors}) + "\n")
+                report.flush()
+
+                # A shard is checkpointed once its failures are written
+                done.add(start)
+                self.write_checkpoint(checkpoint_path, model, shard_size, done)
+                totals["checked"] += checked
+                totals["invalid"] += len(failures)
+
+                elapsed = time.perf_counter() - start_time
+                self.stdout.write(
+                    f"pks {start}-{end - 1} : {checked} checked, {len(failures)} invalid "
+                    f"({totals['checked'] / elapsed:.0f} elements/s overall)"
+                )
+
+        elapsed = time.perf_counter() - start_time
+        self.stdout.write(
+            self.style.SUCCESS(f"{totals['checked']} checked, {totals['invalid']} invalid in {elapsed:.2f}s")
+        )
@@ -0,0 +1,59 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from django_model_metadata.db_indexes import EXPRESSION, INDEX_METHODS, sync_metadata_indexes
+from django_model_metadata.model_mixins import CustomMetadataMixin
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates concurrently the PostgreSQL indexes on the searchable metadata keys "
+        "of the element models and drops the stale ones"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("models", nargs="*", help="The element models as 'app_label.ModelName', all by default")
+        parser.add_argument(
+            "--method",
+            action="append",
+            choices=INDEX_METHODS,
+            dest="methods",
+            help=f"The kind of indexes to keep, can be repeated ('{EXPRESSION}' by default)",
+        )
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--dry-run", action="store_true", help="Only show the indexes to create and drop")
+
+    def get_models(self, labels):
+        if not labels:
+            return [model for model in apps.get_models() if issubclass(model, CustomMetadataMixin)]
+
+        models = []
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+            if not issubclass(model, CustomMetadataMixin):
+                raise CommandError(f"{model._meta.label} does not inherit from CustomMetadataMixin")
+            models.append(model)
+        return models
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "postgresql":
+            raise CommandError("The metadata expression indexes are only available on PostgreSQL")
+
+        methods = tuple(options["methods"] or (EXPRESSION,))
+
+        # Concurrent index operations can not run inside a transaction
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for model in self.get_models(options["models"]):
+                created, dropped = sync_metadata_indexes(model, schema_editor, methods, dry_run=options["dry_run"])
+                for name in created:
+                    self.stdout.write(f"+ {model._meta.label} {name}")
+                for name in dropped:
+                    self.stdout.write(f"- {model._meta.label} {name}")
+                self.stdout.write(
+                    self.style.SUCCESS(f"{model._meta.label} : {len(created)} created, {len(dropped)} dropped")
+                )
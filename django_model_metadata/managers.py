@@ -0,0 +1,112 @@
+from django.core.exceptions import FieldDoesNotExist, FieldError
+from django.db import models
+from django.db.models.constants import LOOKUP_SEP
+
+from .expressions import (
+    get_metadata_cast_expression,
+    get_metadata_definitions_by_name,
+    get_referenced_names,
+    replace_references,
+)
+from .search import get_metadata_filters
+
+
+class CustomMetadataQuerySet(models.QuerySet):
+    def filter_metadata(self, **lookups):
+        """
+        Filters the elements on their searchable metadata,
+        e.g. ``filter_metadata(color="red", weight__gte=10)``
+        """
+        if not lookups:
+            return self._chain()
+        return self.filter(*get_metadata_filters(self.model, lookups))
+
+    def with_metadata_definitions(self, metadata_field_name="metadata"):
+        """
+        Loads the element types with ``select_related()`` and their definitions with one prefetch query,
+        the formatting, forms and validators of the elements then read them without query
+        """
+        type_fields = self.model.get_element_type_fields()
+        lookups = [
+            f"{type_field.name}{LOOKUP_SEP}{metadata_field_name}"
+            for type_field in type_fields
+            if hasattr(type_field.related_model, metadata_field_name)
+        ]
+        return self.select_related(*[type_field.name for type_field in type_fields]).prefetch_related(*lookups)
+
+    def _is_metadata_name(self, name):
+        if LOOKUP_SEP in name or name == "pk" or name in self.query.annotations:
+            return False
+        try:
+            self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return True
+        return False
+
+    def _get_metadata_expressions(self, names, required=()):
+        """Returns ``{field_name: Cast(...)}`` for the metadata among ``names``"""
+        names = {name for name in names if self._is_metadata_name(name)}
+        if not names:
+            return {}
+
+        definitions = get_metadata_definitions_by_name(self.model, names)
+        for name in required:
+            if name not in definitions:
+                raise FieldError(f"'{name}' is not a metadata of {self.model._meta.label}")
+
+        return {
+            name: get_metadata_cast_expression(definition, model=self.model)
+            for name, definition in definitions.items()
+        }
+
+    def _resolve_metadata_references(self, expressions):
+        """Replaces the ``F()`` references to metadata names in ``{alias: expression}``"""
+        names = {name for expression in expressions.values() for name in get_referenced_names(expression)}
+        replacements = self._get_metadata_expressions(names)
+        return {alias: replace_references(expression, replacements) for alias, expression in expressions.items()}
+
+    def annotate_metadata(self, *field_names, **expressions):
+        """
+        Annotates the metadata values cast to their database type,
+        ``annotate_metadata("weight")``, ``annotate_metadata(total=Sum("weight"))``
+        """
+        named = {alias: value for alias, value in expressions.items() if isinstance(value, str)}
+        metadata_expressions = self._get_metadata_expressions(
+            [*field_names, *named.values()], required=[*field_names, *named.values()]
+        )
+
+        annotations = {name: metadata_expressions[name] for name in field_names}
+        annotations.update({alias: metadata_expressions[name] for alias, name in named.items()})
+        annotations.update(
+            self._resolve_metadata_references(
+                {alias: value for alias, value in expressions.items() if not isinstance(value, str)}
+            )
+        )
+        return self.annotate(**annotations)
+
+    def aggregate_metadata(self, *args, **kwargs):
+        """
+        Aggregates the metadata in the database,
+        e.g. ``aggregate_metadata(Sum("weight"), average=Avg("price"))``
+        """
+        for arg in args:
+            # The alias must be computed before the references become casts
+            try:
+                kwargs[arg.default_alias] = arg
+            except (AttributeError, TypeError):
+                raise TypeError("Complex aggregates require an alias")
+        return self.aggregate(**self._resolve_metadata_references(kwargs))
+
+    def values_metadata(self, *fields, **expressions):
+        """
+        ``values()`` accepting metadata names,
+        e.g. ``values_metadata("color").annotate_metadata(total=Sum("weight"))``
+        """
+        metadata_expressions = self._get_metadata_expressions(fields)
+        fields = [field for field in fields if field not in metadata_expressions]
+        expressions.update(metadata_expressions)
+        return self.values(*fields, **self._resolve_metadata_references(expressions))
+
+
+class CustomMetadataManager(models.Manager.from_queryset(CustomMetadataQuerySet)):
+    pass
@@ -0,0 +1,445 @@
+"""
+The metadata types
+Every ``meta_type`` of a definition is handled by a ``MetaType`` building its form field, its compiled check,
+its JSON schema, its display and its database cast. The registry is filled on first use with the built-in types,
+then the classes of the ``django_model_metadata.meta_types`` entry points and of the ``DJANGO_MODEL_METADATA_META_TYPES``
+setting (dotted paths), then the types given to ``meta_types.register()``. A later type replaces an earlier one of
+the same name.
+"""
+
+import threading
+from collections.abc import Mapping
+from functools import lru_cache
+from importlib.metadata import entry_points
+
+from django import forms
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.signals import setting_changed
+from django.db import models
+from django.dispatch import receiver
+from django.urls import get_script_prefix, get_urlconf, reverse
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext as _
+
+from .autocomplete import get_fk_model_choices
+from .conf import get_setting
+from .fields import MetadataModelChoiceField
+from .schema import to_json_value
+from .validators import (
+    RelationChecker,
+    compile_char_checker,
+    compile_choice_checker,
+    compile_date_checker,
+    compile_decimal_checker,
+    compile_field_checker,
+    compile_integer_checker,
+)
+from .values import RelationDecoder, decode_date, decode_datetime, decode_decimal, decode_integer
+
+ENTRY_POINT_GROUP = "django_model_metadata.meta_types"
+
+ON_DELETE_CHOICES = (
+    ("CASCADE", _("Cascade")),
+    ("DO_NOTHING", _("Do Nothing")),
+    ("SET_NULL", _("Set Null")),
+    ("PROTECT", _("Protect")),
+)
+
+# The attributes of the other types, dropped by ``populate_default_attrs()``
+TYPED_ATTRS = ("max_length", "max_digits", "decimal_places", "on_delete")
+
+
+@lru_cache(maxsize=256)
+def _reverse(viewname, kwargs, urlconf, prefix):
+    return reverse(viewname, urlconf=urlconf, kwargs=dict(kwargs))
+
+
+def reverse_handler(viewname, **kwargs):
+    """
+    ``reverse()`` of the autocomplete handlers of the schemas,
+    resolved once per url configuration and script prefix
+    """
+    return _reverse(viewname, tuple(sorted(kwargs.items())), get_urlconf(), get_script_prefix())
+
+
+class MetaType:
+    """The behaviour of a metadata type, subclass it and register it to add a type"""
+
+    name = None
+    label = None
+    form_field_class = forms.CharField
+    # The input type of the frontend forms
+    frontend_type = "text"
+    # The type of the ``django-jsonform`` schema
+    json_type = "string"
+    # The relation metadata store a pk formatted with the related instance
+    is_relation = False
+    # Whether ``format_value()`` changes the values
+    formats_values = False
+    # The column of ``MetadataSearchIndex`` holding the searchable values, None to not index them
+    index_column = "value_text"
+
+    def get_attrs_fields(self):
+        """Returns the ``(name, form field, json type)`` of the widget attributes of the definitions"""
+        return []
+
+    @cached_property
+    def attrs_fields(self):
+        return self.get_attrs_fields()
+
+    def populate_default_attrs(self, definition):
+        """Fills the default widget attributes of the definition and drops the attributes of the other types"""
+        for attr in TYPED_ATTRS:
+            definition.widget_attrs.pop(attr, None)
+
+    def get_form_field_attrs(self, definition):
+        return dict(definition.widget_attrs or {})
+
+    def get_form_field(self, definition, initial=None):
+        return self.form_field_class(**self.get_form_field_attrs(definition), label=definition.name, initial=initial)
+
+    def get_checker(self, field, definition):
+        """Returns the compiled check of the values, see ``validators.py``"""
+        return compile_field_checker(field)
+
+    def get_field_schema(self, definition):
+        return {"type": self.json_type, "title": definition.name}
+
+    def get_attr_schema(self, attr_name, field, json_type):
+        return {"type": json_type, "title": field.label}
+
+    def get_related_model(self, definition):
+        return None
+
+    def format_value(self, value):
+        """The display of a stored value, used when ``formats_values`` is set"""
+        return value
+
+    def get_output_field(self, definition):
+        """Returns the model field used to cast a value in the database, None for text values"""
+        return None
+
+    def get_decoder(self, definition):
+        """Returns the function decoding a stored value to its python type, None to keep the json value"""
+        return None
+
+    def convert_value(self, definition, value):
+        """
+        Converts a value stored for another type or other attributes,
+        the values that can not be converted are kept
+        """
+        try:
+            return to_json_value(definition.get_form_field_object().clean(value))
+        except (ValidationError, TypeError, ValueError):
+            return value
+
+
+class CharMetaType(MetaType):
+    name = "CharField"
+    label = _("Text")
+
+    def get_attrs_fields(self):
+        return [("max_length", forms.IntegerField(label=_("Max length")), "number")]
+
+    def populate_default_attrs(self, definition):
+        if "max_length" not in definition.widget_attrs:
+            definition.widget_attrs = {"max_length": 255}
+        definition.widget_attrs.pop("max_digits", None)
+        definition.widget_attrs.pop("decimal_places", None)
+
+    def get_checker(self, field, definition):
+        return compile_char_checker(field)
+
+    def convert_value(self, definition, value):
+        max_length = (definition.widget_attrs or {}).get("max_length")
+        value = str(value)
+        return value[:max_length] if max_length else value
+
+
+class NumberMetaType(MetaType):
+    formats_values = True
+
+    def format_value(self, value):
+        # The template tags are only needed to format
+        from django.contrib.humanize.templatetags.humanize import intcomma
+
+        return intcomma(value)
+
+
+class IntegerMetaType(NumberMetaType):
+    name = "IntegerField"
+    label = _("Integer")
+    form_field_class = forms.IntegerField
+    frontend_type = "number"
+    json_type = "number"
+    index_column = "value_integer"
+
+    def get_checker(self, field, definition):
+        return compile_integer_checker(field)
+
+    def get_output_field(self, definition):
+        return models.BigIntegerField()
+
+    def get_decoder(self, definition):
+        return decode_integer
+
+
+class DecimalMetaType(NumberMetaType):
+    name = "DecimalField"
+    label = _("Decimal Number")
+    form_field_class = forms.DecimalField
+    index_column = "value_decimal"
+
+    def get_attrs_fields(self):
+        return [
+            ("max_digits", forms.IntegerField(label=_("Max digits")), "number"),
+            ("decimal_places", forms.IntegerField(label=_("Decimal places")), "number"),
+        ]
+
+    def populate_default_attrs(self, definition):
+        definition.widget_attrs = {"max_digits": 30, "decimal_places": 2}
+
+    def get_checker(self, field, definition):
+        return compile_decimal_checker(field)
+
+    def get_output_field(self, definition):
+        widget_attrs = definition.widget_attrs or {}
+        return models.DecimalField(
+            max_digits=widget_attrs.get("max_digits", 30), decimal_places=widget_attrs.get("decimal_places", 2)
+        )
+
+    def get_decoder(self, definition):
+        return decode_decimal
+
+
+class DateMetaType(MetaType):
+    name = "DateField"
+    label = _("Date")
+    form_field_class = forms.DateField
+    frontend_type = "date"
+    index_column = "value_date"
+
+    def get_checker(self, field, definition):
+        return compile_date_checker(field)
+
+    def get_output_field(self, definition):
+        return models.DateField()
+
+    def get_decoder(self, definition):
+        return decode_date
+
+
+class DateTimeMetaType(MetaType):
+    name = "DateTimeField"
+    label = _("DateTime")
+    form_field_class = forms.DateTimeField
+    frontend_type = "datetime"
+    index_column = "value_datetime"
+
+    def get_output_field(self, definition):
+        return models.DateTimeField()
+
+    def get_decoder(self, definition):
+        return decode_datetime
+
+
+class RelationMetaType(MetaType):
+    name = "ForeignKey"
+    label = _("Relation")
+    form_field_class = MetadataModelChoiceField
+    frontend_type = "select"
+    json_type = "integer"
+    is_relation = True
+    index_column = "value_fk"
+
+    def get_attrs_fields(self):
+        return [
+            ("model", forms.ChoiceField(choices=get_fk_model_choices, label=_("Relation"), required=False), "string"),
+            (
+                "on_delete",
+                forms.ChoiceField(choices=ON_DELETE_CHOICES, label=_("Action on delete"), required=False),
+                "string",
+            ),
+        ]
+
+    def get_form_field_attrs(self, definition):
+        field_attrs = super().get_form_field_attrs(definition)
+        field_attrs.pop("on_delete", None)
+        field_attrs.pop("model", None)
+        model_class = self.get_related_model(definition)
+        if model_class:
+            field_attrs["queryset"] = model_class.objects.all()
+        else:
+            field_attrs["queryset"] = definition.__class__.objects.none()
+        return field_attrs
+
+    def get_checker(self, field, definition):
+        model_class = self.get_related_model(definition)
+        if model_class:
+            return RelationChecker(field, model_class)
+        return compile_field_checker(field)
+
+    def get_field_schema(self, definition):
+        schema = super().get_field_schema(definition)
+
+        # The related rows are searched on the server instead of being listed
+        model_class = self.get_related_model(definition)
+        if model_class:
+            schema["widget"] = "autocomplete"
+            schema["handler"] = reverse_handler(
+                "metadata-autocomplete-objects", el_type="objects", model_label=model_class._meta.label
+            )
+        return schema
+
+    def get_attr_schema(self, attr_name, field, json_type):
+        schema = super().get_attr_schema(attr_name, field, json_type)
+        if attr_name == "model":
+            schema["widget"] = "autocomplete"
+            schema["handler"] = reverse_handler("metadata-autocomplete", el_type="models")
+        elif attr_name == "on_delete":
+            schema["widget"] = "autocomplete"
+            schema["handler"] = reverse_handler("metadata-autocomplete", el_type="on_delete")
+        return schema
+
+    def get_related_model(self, definition):
+        model_name = (definition.widget_attrs or {}).get("model", None)
+        if model_name:
+            try:
+                return apps.get_model(model_name)
+            except Exception:
+                ...
+
+    def get_output_field(self, definition):
+        return models.BigIntegerField()
+
+    def get_decoder(self, definition):
+        model_class = self.get_related_model(definition)
+        if model_class:
+            return RelationDecoder(model_class)
+
+    def convert_value(self, definition, value):
+        return value
+
+
+class JSONMetaType(MetaType):
+    name = "JSONField"
+    label = _("JSON Data")
+    form_field_class = forms.JSONField
+    index_column = None
+
+    def convert_value(self, definition, value):
+        return value
+
+
+class ChoiceMetaType(MetaType):
+    name = "ChoiceField"
+    label = _("Normal Select")
+    form_field_class = forms.ChoiceField
+    frontend_type = "select"
+    json_type = "list"
+
+    def get_form_field_attrs(self, definition):
+        field_attrs = super().get_form_field_attrs(definition)
+        field_attrs.pop("values", None)
+        return field_attrs
+
+    def get_checker(self, field, definition):
+        return compile_choice_checker(field)
+
+
+BUILTIN_META_TYPES = (
+    CharMetaType,
+    DateMetaType,
+    DateTimeMetaType,
+    IntegerMetaType,
+    DecimalMetaType,
+    RelationMetaType,
+    JSONMetaType,
+    ChoiceMetaType,
+)
+
+
+class MetaTypeRegistry(Mapping):
+    """The metadata types by name, loaded on first use"""
+
+    def __init__(self):
+        self._meta_types = None
+        self._registered = {}
+        self._lock = threading.Lock()
+
+    def register(self, meta_type):
+        """Registers a ``MetaType`` class or instance, can decorate the class"""
+        instance = meta_type() if isinstance(meta_type, type) else meta_type
+        with self._lock:
+            self._registered[instance.name] = instance
+            if self._meta_types is not None:
+                self._meta_types[instance.name] = instance
+        return meta_type
+
+    def load(self):
+        meta_types = {}
+        for meta_type_class in BUILTIN_META_TYPES:
+            meta_types[meta_type_class.name] = meta_type_class()
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            meta_type = entry_point.load()()
+            meta_types[meta_type.name] = meta_type
+        for path in get_setting("META_TYPES", []):
+            meta_type = import_string(path)()
+            meta_types[meta_type.name] = meta_type
+        meta_types.update(self._registered)
+        return meta_types
+
+    def get_meta_types(self):
+        meta_types = self._meta_types
+        if meta_types is None:
+            with self._lock:
+                if self._meta_types is None:
+                    self._meta_types = self.load()
+                meta_types = self._meta_types
+        return meta_types
+
+    def __getitem__(self, name):
+        return self.get_meta_types()[name]
+
+    def __iter__(self):
+        return iter(self.get_meta_types())
+
+    def __len__(self):
+        return len(self.get_meta_types())
+
+    def get_choices(self):
+        return [(name, meta_type.label or name) for name, meta_type in self.get_meta_types().items()]
+
+    def reset(self):
+        with self._lock:
+            self._meta_types = None
+
+
+meta_types = MetaTypeRegistry()
+
+
+class MetaTypeMap(Mapping):
+    """A read only ``{meta_type: value}`` view of the registry, for the former ``GENERAL_*`` mappings"""
+
+    def __init__(self, getter):
+        self.getter = getter
+
+    def __getitem__(self, name):
+        return self.getter(meta_types[name])
+
+    def __iter__(self):
+        return iter(meta_types)
+
+    def __len__(self):
+        return len(meta_types)
+
+
+@receiver(setting_changed)
+def reset_meta_types(setting, **kwargs):
+    """Reloads the registered meta types and the cached urls when the tests override them"""
+    if setting == "DJANGO_MODEL_METADATA_META_TYPES":
+        meta_types.reset()
+    elif setting == "ROOT_URLCONF":
+        _reverse.cache_clear()
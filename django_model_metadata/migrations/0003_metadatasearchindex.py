@@ -0,0 +1,55 @@
+# Generated by Django 5.2 on 2026-10-17 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+import swapper
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contenttypes", "0002_remove_content_type_name"),
+        ("django_model_metadata", "0002_modelgeneralmetadata_created_at_and_more"),
+        swapper.dependency("django_model_metadata", "ModelGeneralMetaData"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetadataSearchIndex",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("object_id", models.PositiveBigIntegerField()),
+                ("value_text", models.CharField(blank=True, max_length=255, null=True)),
+                ("value_integer", models.BigIntegerField(blank=True, null=True)),
+                ("value_decimal", models.DecimalField(blank=True, decimal_places=10, max_digits=30, null=True)),
+                ("value_date", models.DateField(blank=True, null=True)),
+                ("value_datetime", models.DateTimeField(blank=True, null=True)),
+                ("value_fk", models.BigIntegerField(blank=True, null=True)),
+                (
+                    "content_type",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="contenttypes.contenttype"),
+                ),
+                (
+                    "metadata",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="search_index_entries",
+                        to=swapper.get_model_name("django_model_metadata", "ModelGeneralMetaData"),
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Metadata search index",
+                "verbose_name_plural": "Metadata search indexes",
+                "indexes": [
+                    models.Index(fields=["content_type", "object_id"], name="dmm_index_object_idx"),
+                    models.Index(fields=["metadata", "value_text"], name="dmm_index_text_idx"),
+                    models.Index(fields=["metadata", "value_integer"], name="dmm_index_integer_idx"),
+                    models.Index(fields=["metadata", "value_decimal"], name="dmm_index_decimal_idx"),
+                    models.Index(fields=["metadata", "value_date"], name="dmm_index_date_idx"),
+                    models.Index(fields=["metadata", "value_datetime"], name="dmm_index_datetime_idx"),
+                    models.Index(fields=["metadata", "value_fk"], name="dmm_index_fk_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-17 18:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+import swapper
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_model_metadata", "0003_metadatasearchindex"),
+        swapper.dependency("django_model_metadata", "ModelGeneralMetaData"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetadataSchemaChange",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("old_field_name", models.CharField(blank=True, max_length=200, null=True)),
+                ("new_field_name", models.CharField(blank=True, max_length=200, null=True)),
+                ("old_meta_type", models.CharField(max_length=20)),
+                ("new_meta_type", models.CharField(max_length=20)),
+                ("old_widget_attrs", models.JSONField(blank=True, null=True)),
+                ("new_widget_attrs", models.JSONField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "metadata",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="schema_changes",
+                        to=swapper.get_model_name("django_model_metadata", "ModelGeneralMetaData"),
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Metadata schema change",
+                "verbose_name_plural": "Metadata schema changes",
+            },
+        ),
+    ]
@@ -1,16 +1,27 @@
+import asyncio
+import copy
 import logging
+from collections import defaultdict
 
+from asgiref.sync import sync_to_async
 from django import forms
-from django.apps import apps
-from django.urls import reverse
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import JSONField
+from django.db.models import JSONField, prefetch_related_objects
 from django.utils.text import slugify
 from django.utils.translation import gettext as _
-from django.contrib.humanize.templatetags.humanize import intcomma
 import swapper
 
+from .cache import decoder_registry, definition_cache, form_class_registry, validator_registry
+from .conf import get_setting
+from .fields import MetadataJSONField
+from .instrumentation import instrumented
+from .managers import CustomMetadataManager
+from .meta_types import ON_DELETE_CHOICES, MetaTypeMap, meta_types
+from .schema import check_loaded_metadata, get_type_schema_changes, upgrade_loaded_metadata
+from .validators import COMPILED, FORM, MetadataValidator, aget_existing_pks, get_existing_pks
+from .values import MetadataValues, prefetch_metadata_values
+
 logger = logging.getLogger(__name__)
 
 
@@ -58,6 +69,12 @@ class GeneralMetadataMixin(models.Model):
     def __str__(self):
         return f"{self.name} ({self.meta_type})"
 
+    def clean_fields(self, exclude=None):
+        # The registered types extend the choices of the field
+        if self.meta_type in meta_types:
+            exclude = {*(exclude or ()), "meta_type"}
+        super().clean_fields(exclude=exclude)
+
     def clean(self):
         if not self.widget_attrs:
             self.widget_attrs = {}
@@ -76,22 +93,15 @@ class GeneralMetadataMixin(models.Model):
 
         self.field_name = self.field_name.strip().replace("-", "_").replace(" ", "_")
 
-    def get_form_field_object(self, initial=None):
-        field_attrs = self.widget_attrs
-
-        if self.meta_type == self.FK:
-            model_class = self.get_metadata_model()
-            field_attrs.pop("on_delete", None)
-            field_attrs.pop("model", None)
-            if model_class:
-                field_attrs["queryset"] = model_class.objects.all()
-            else:
-                field_attrs["queryset"] = self.__class__.objects.none()
-        elif self.meta_type == self.CHOICEFIELD:
-            field_attrs.pop("values", None)
-        field = GENERAL_FIELDS_MAP[self.meta_type](**field_attrs, label=self.name, initial=initial)
+    def get_meta_type(self):
+        """
+        The handler of the metadata type, see ``meta_types.py``
+        """
+        return meta_types[self.meta_type]
 
-        return field
+    @instrumented("get_form_field_object")
+    def get_form_field_object(self, initial=None):
+        return self.get_meta_type().get_form_field(self, initial=initial)
 
     def get_form_field_name(self):
         if not self.field_name:
@@ -100,6 +110,13 @@ class GeneralMetadataMixin(models.Model):
             self.save()
         return self.field_name
 
+    async def aget_form_field_name(self):
+        if not self.field_name:
+            name = slugify(self.name)
+            self.field_name = "_".join(name.split("-"))
+            await self.asave()
+        return self.field_name
+
     def get_form_field(self, form):
         field = self.get_form_field_object()
         field_name = self.get_form_field_name()
@@ -107,44 +124,19 @@ class GeneralMetadataMixin(models.Model):
             return field.get_bound_field(form, field_name)
 
     def get_field_schema(self):
-        return {"type": GENERAL_JSON_FORM_FIELDS_MAP[self.meta_type], "title": self.name}
+        return self.get_meta_type().get_field_schema(self)
 
     def populate_default_attrs(self, commit=False):
         # We reinitialize the attributes if they don't match the object
-        if self.meta_type == self.CHARFIELD and (not "max_length" in self.widget_attrs):
-            self.widget_attrs = {"max_length": 255}
-
-        elif self.meta_type == self.DECIMALFIELD:
-            self.widget_attrs = {}
-            if not "max_digits" in self.widget_attrs:
-                self.widget_attrs["max_digits"] = 30
-            if not "decimal_places" in self.widget_attrs:
-                self.widget_attrs["decimal_places"] = 2
-
-        # Remove these attrs
-        if self.meta_type == self.CHARFIELD:
-            self.widget_attrs.pop("max_digits", None)
-            self.widget_attrs.pop("decimal_places", None)
-        elif self.meta_type == self.DECIMALFIELD:
-            self.widget_attrs.pop("max_length", None)
-        else:
-            self.widget_attrs.pop("max_length", None)
-            self.widget_attrs.pop("max_digits", None)
-            self.widget_attrs.pop("decimal_places", None)
-            self.widget_attrs.pop("on_delete", None)
+        self.get_meta_type().populate_default_attrs(self)
 
         if commit:
             self.save()
 
     def get_metadata_model(self):
-        if self.meta_type == self.FK:
-            model_name = self.widget_attrs.get("model", None)
-            if model_name:
-                try:
-                    ModelClass = apps.get_model(model_name)
-                    return ModelClass
-                except Exception:
-                    ...
+        meta_type = meta_types.get(self.meta_type)
+        if meta_type:
+            return meta_type.get_related_model(self)
 
     def get_attrs_form(self):
         if self.widget_attrs:
@@ -154,7 +146,7 @@ class GeneralMetadataMixin(models.Model):
             return self.get_attrs_form_class()()
 
     def get_attrs_form_class(self):
-        fields_list = GENERAL_FIELDS_DEFAULT_ATTRS[self.meta_type]
+        fields_list = self.get_meta_type().attrs_fields
 
         class AttrsForm(forms.Form):
             """
@@ -171,20 +163,9 @@ class GeneralMetadataMixin(models.Model):
 
     def get_widget_attrs_schema(self):
         schema = {"type": "dict", "keys": {}}
-        fields_list = GENERAL_FIELDS_DEFAULT_ATTRS[self.meta_type]
-        for attr in fields_list:
-            attr_json_data = {"type": attr[2], "title": attr[1].label}
-
-            # Do stuff here if any
-            if self.meta_type == self.FK:
-                if attr[0] == "model":
-                    attr_json_data["widget"] = "autocomplete"
-                    attr_json_data["handler"] = reverse("metadata-autocomplete", kwargs={"el_type": "models"})
-                elif attr[0] == "on_delete":
-                    attr_json_data["widget"] = "autocomplete"
-                    attr_json_data["handler"] = reverse("metadata-autocomplete", kwargs={"el_type": "on_delete"})
-
-            schema["keys"][attr[0]] = attr_json_data
+        meta_type = self.get_meta_type()
+        for attr in meta_type.attrs_fields:
+            schema["keys"][attr[0]] = meta_type.get_attr_schema(*attr)
 
         schema["additionalProperties"] = {"type": "string"}
 
@@ -202,72 +183,84 @@ OLD_ON_DELETE_CHOICES = (
     (models.SET_NULL, _("Set Null")),
     (models.PROTECT, _("Protect")),
 )
-ON_DELETE_CHOICES = (
-    ("CASCADE", _("Cascade")),
-    ("DO_NOTHING", _("Do Nothing")),
-    ("SET_NULL", _("Set Null")),
-    ("PROTECT", _("Protect")),
-)
 
 
-GENERAL_FIELDS_MAP = {
-    GeneralMetadataMixin.CHARFIELD: forms.CharField,
-    GeneralMetadataMixin.DECIMALFIELD: forms.DecimalField,
-    GeneralMetadataMixin.DATEFIELD: forms.DateField,
-    GeneralMetadataMixin.DATETIMEFIELD: forms.DateTimeField,
-    GeneralMetadataMixin.INTEGERFIELD: forms.IntegerField,
-    GeneralMetadataMixin.FK: forms.ModelChoiceField,
-    GeneralMetadataMixin.JSON: JSONField,
-    GeneralMetadataMixin.CHOICEFIELD: forms.ChoiceField,
-}
-
-GENERAL_FRONTEND_FIELDS_MAP = {
-    GeneralMetadataMixin.CHARFIELD: "text",
-    GeneralMetadataMixin.DECIMALFIELD: "text",
-    GeneralMetadataMixin.DATEFIELD: "date",
-    GeneralMetadataMixin.DATETIMEFIELD: "datetime",
-    GeneralMetadataMixin.INTEGERFIELD: "number",
-    GeneralMetadataMixin.FK: "select",
-    GeneralMetadataMixin.JSON: "text",
-    GeneralMetadataMixin.CHOICEFIELD: "select",
-}
-
-GENERAL_JSON_FORM_FIELDS_MAP = {
-    GeneralMetadataMixin.CHARFIELD: "string",
-    GeneralMetadataMixin.DECIMALFIELD: "string",
-    GeneralMetadataMixin.DATEFIELD: "string",
-    GeneralMetadataMixin.DATETIMEFIELD: "string",
-    GeneralMetadataMixin.INTEGERFIELD: "number",
-    GeneralMetadataMixin.FK: "integer",
-    GeneralMetadataMixin.JSON: "string",
-    GeneralMetadataMixin.CHOICEFIELD: "list",
-}
-
-
-GENERAL_FIELDS_DEFAULT_ATTRS = {
-    GeneralMetadataMixin.CHARFIELD: [("max_length", forms.IntegerField(label=_("Max length")), "number")],
-    GeneralMetadataMixin.DECIMALFIELD: [
-        ("max_digits", forms.IntegerField(label=_("Max digits")), "number"),
-        ("decimal_places", forms.IntegerField(label=_("Decimal places")), "number"),
-    ],
-    GeneralMetadataMixin.DATEFIELD: [],
-    GeneralMetadataMixin.DATETIMEFIELD: [],
-    GeneralMetadataMixin.INTEGERFIELD: [],
-    GeneralMetadataMixin.FK: [
-        (
-            "model",
-            forms.ChoiceField(choices=GENERAL_FK_MODELS, label=_("Relation"), required=False),
-            "string",
-        ),
-        (
-            "on_delete",
-            forms.ChoiceField(choices=ON_DELETE_CHOICES, label=_("Action on delete"), required=False),
-            "string",
-        ),
-    ],
-    GeneralMetadataMixin.JSON: [],
-    GeneralMetadataMixin.CHOICEFIELD: [],
-}
+# The former mappings by meta type, read from the registry of ``meta_types.py``
+GENERAL_FIELDS_MAP = MetaTypeMap(lambda meta_type: meta_type.form_field_class)
+GENERAL_FRONTEND_FIELDS_MAP = MetaTypeMap(lambda meta_type: meta_type.frontend_type)
+GENERAL_JSON_FORM_FIELDS_MAP = MetaTypeMap(lambda meta_type: meta_type.json_type)
+GENERAL_FIELDS_DEFAULT_ATTRS = MetaTypeMap(lambda meta_type: meta_type.attrs_fields)
+
+
+def build_metadata_form_class(definitions):
+    """
+    Compiles the form class with the metadata fields declared once,
+    the form instances only deep copy them like any declared form.
+    """
+    form_attrs = {"__doc__": "The General type form filled with the metadata fields"}
+    for data in definitions:
+        form_attrs[data.get_form_field_name()] = data.get_form_field_object()
+
+    return type("GeneralTypeForm", (forms.Form,), form_attrs)
+
+
+def serialize_definitions(definitions):
+    """
+    Returns the field names and the values of the definitions, to cache them as plain data
+    """
+    definitions = list(definitions)
+    if not definitions:
+        return [], []
+
+    # The cached definitions must not have to save a missing field name
+    for definition in definitions:
+        definition.get_form_field_name()
+
+    attnames = [field.attname for field in definitions[0]._meta.concrete_fields]
+    return attnames, [tuple(getattr(definition, attname) for attname in attnames) for definition in definitions]
+
+
+async def aserialize_definitions(queryset):
+    definitions = [definition async for definition in queryset]
+    for definition in definitions:
+        await definition.aget_form_field_name()
+    return serialize_definitions(definitions)
+
+
+def load_definitions(model, db, attnames, rows):
+    """
+    Returns the definition instances of serialized rows
+    """
+    # The json attributes of the cached rows must not be shared by the instances
+    return [
+        model.from_db(
+            db, attnames, [copy.deepcopy(value) if isinstance(value, (dict, list)) else value for value in row]
+        )
+        for row in rows
+    ]
+
+
+def copy_metadata(element_metadata):
+    """
+    A copy of the metadata whose json values can not be changed through the original
+    """
+    return {
+        key: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+        for key, value in element_metadata.items()
+    }
+
+
+def get_fk_metadata_pk(model_class, value):
+    """
+    Returns the primary key stored in a relation metadata as the python type of the model pk
+    """
+    if value is None or value == "":
+        return None
+
+    try:
+        return model_class._meta.pk.to_python(value)
+    except ValidationError:
+        return None
 
 
 class GeneralMetadataTypeMixin(models.Model):
@@ -282,33 +275,108 @@ class GeneralMetadataTypeMixin(models.Model):
     class Meta:
         abstract = True
 
-    def get_form_class(self, metadata_field_name=None):
+    def get_metadata_definitions(self, metadata_field_name=None):
+        """
+        Returns the list of the metadata definitions linked to this type
+        """
         if not metadata_field_name:
             metadata_field_name = "metadata"
 
+        # Prefetched by ``with_metadata_definitions()``
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        if metadata_field_name in prefetched:
+            return list(prefetched[metadata_field_name])
+
         metadata_field = getattr(self, metadata_field_name, "metadata")
-        metadata_ = metadata_field.all()
+        attnames, rows = definition_cache.get_or_build(
+            self, f"definitions:{metadata_field_name}", lambda: serialize_definitions(metadata_field.all())
+        )
+        return load_definitions(metadata_field.model, self._state.db or "default", attnames, rows)
 
-        class GeneralTypeForm(forms.Form):
-            """
-            The General type form to fill dynamically with fields
-            """
+    async def aget_metadata_definitions(self, metadata_field_name=None):
+        if not metadata_field_name:
+            metadata_field_name = "metadata"
 
-            def __init__(self, *args, **kwargs):
-                super().__init__(*args, **kwargs)
+        prefetched = getattr(self, "_prefetched_objects_cache", {})
+        if metadata_field_name in prefetched:
+            return list(prefetched[metadata_field_name])
 
-                for data in metadata_:
-                    self.fields[data.get_form_field_name()] = data.get_form_field_object()
+        metadata_field = getattr(self, metadata_field_name, "metadata")
+        attnames, rows = await definition_cache.aget_or_build(
+            self, f"definitions:{metadata_field_name}", lambda: aserialize_definitions(metadata_field.all())
+        )
+        return load_definitions(metadata_field.model, self._state.db or "default", attnames, rows)
+
+    @instrumented("get_form_class")
+    def get_form_class(self, metadata_field_name=None):
+        if not metadata_field_name:
+            metadata_field_name = "metadata"
+
+        return form_class_registry.get_or_build(
+            self, metadata_field_name, lambda: self.build_form_class(metadata_field_name)
+        )
 
-        return GeneralTypeForm
+    def build_form_class(self, metadata_field_name="metadata"):
+        return build_metadata_form_class(self.get_metadata_definitions(metadata_field_name))
+
+    def get_metadata_validator(self, metadata_field_name=None):
+        if not metadata_field_name:
+            metadata_field_name = "metadata"
+
+        return validator_registry.get_or_build(
+            self, metadata_field_name, lambda: MetadataValidator(self.get_metadata_definitions(metadata_field_name))
+        )
+
+    def get_metadata_decoders(self, metadata_field_name=None):
+        """
+        Returns ``{field_name: decoder}`` for the ``metadata_values`` of the elements
+        """
+        if not metadata_field_name:
+            metadata_field_name = "metadata"
 
+        return decoder_registry.get_or_build(
+            self,
+            metadata_field_name,
+            lambda: {
+                definition.get_form_field_name(): definition.get_meta_type().get_decoder(definition)
+                for definition in self.get_metadata_definitions(metadata_field_name)
+            },
+        )
+
+    async def aget_metadata_validator(self, metadata_field_name=None):
+        if not metadata_field_name:
+            metadata_field_name = "metadata"
+
+        async def build():
+            return MetadataValidator(await self.aget_metadata_definitions(metadata_field_name))
+
+        return await validator_registry.aget_or_build(self, metadata_field_name, build)
+
+    @instrumented("get_fields_schema")
     def get_fields_schema(self, metadata_field_name=None):
         if not metadata_field_name:
             metadata_field_name = "metadata"
 
-        metadata_field = getattr(self, metadata_field_name, "metadata")
-        metadata_ = metadata_field.all()
+        schema = definition_cache.get_or_build(
+            self,
+            f"schema:{metadata_field_name}",
+            lambda: self.build_fields_schema(self.get_metadata_definitions(metadata_field_name)),
+        )
+        # The cached schema is shared, the widgets may change their copy
+        return copy.deepcopy(schema)
 
+    async def aget_fields_schema(self, metadata_field_name=None):
+        if not metadata_field_name:
+            metadata_field_name = "metadata"
+
+        async def build():
+            return self.build_fields_schema(await self.aget_metadata_definitions(metadata_field_name))
+
+        schema = await definition_cache.aget_or_build(self, f"schema:{metadata_field_name}", build)
+        return copy.deepcopy(schema)
+
+    @staticmethod
+    def build_fields_schema(metadata_):
         schema = {"type": "dict", "keys": {}}
         schema_fields = {}
 
@@ -322,6 +390,13 @@ class GeneralMetadataTypeMixin(models.Model):
     def get_form(self):
         return self.get_form_class()()
 
+    def get_schema_version(self):
+        """
+        The last change of the definitions of this type, 0 if they never changed
+        """
+        changes = get_type_schema_changes(self)[1]
+        return changes[-1][0] if changes else 0
+
 
 class CustomMetadataMixin(models.Model):
     """
@@ -329,79 +404,454 @@ class CustomMetadataMixin(models.Model):
     Those json data are validated through the metadata type model using metadata data.
     """
 
-    element_metadata = models.JSONField(null=True, blank=True)
+    element_metadata = MetadataJSONField(null=True, blank=True)
+
+    # Stores the metadata keyed by definition pk, see ``compact.py``
+    compact_metadata = False
+    # Stores the schema version with the metadata and upgrades the older rows, see ``schema.py``
+    versioned_metadata = False
+
+    objects = CustomMetadataManager()
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        check_loaded_metadata(instance)
+        instance.snapshot_metadata()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "element_metadata" in update_fields:
+            self.snapshot_metadata()
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or "element_metadata" in fields:
+            self.snapshot_metadata()
+
+    def snapshot_metadata(self):
+        """
+        Keeps the stored metadata and the state of the element type, to find the keys changed before the next save
+        """
+        element_metadata = self.__dict__.get("element_metadata")
+        if "element_metadata" not in self.__dict__ or not isinstance(element_metadata or {}, dict):
+            self.__dict__["_metadata_snapshot"] = None
+            return
+
+        self.__dict__["_metadata_snapshot"] = (copy_metadata(element_metadata or {}), self.get_metadata_type_state())
+        self.__dict__.pop("_metadata_values", None)
+
+    def get_metadata_type_state(self):
+        """
+        The element type pks and the version of their definitions in the ``definition_cache``
+        """
+        state = []
+        for type_field in self.get_element_type_fields():
+            pk = self.__dict__.get(type_field.attname)
+            label = type_field.related_model._meta.label_lower
+            global_version = definition_cache.read_version(definition_cache.get_version_key(label))
+            type_version = None
+            if pk is not None:
+                type_version = definition_cache.read_version(definition_cache.get_version_key(label, pk))
+            state.append((pk, global_version, type_version))
+        return tuple(state)
+
+    async def aget_metadata_type_state(self):
+        """
+        Async counterpart of ``get_metadata_type_state()``, the versions are read with the async cache API
+        """
+        state = []
+        for type_field in self.get_element_type_fields():
+            pk = self.__dict__.get(type_field.attname)
+            label = type_field.related_model._meta.label_lower
+            global_version = await definition_cache.aread_version(definition_cache.get_version_key(label))
+            type_version = None
+            if pk is not None:
+                type_version = await definition_cache.aread_version(definition_cache.get_version_key(label, pk))
+            state.append((pk, global_version, type_version))
+        return tuple(state)
+
+    def get_changed_metadata_keys(self, type_state=None):
+        """
+        Returns the metadata keys changed since the instance was loaded or saved, or None when all of them
+        must be validated : new instance, deferred metadata, element type or definitions changed.
+        ``type_state`` is the current ``get_metadata_type_state()``, read when not given.
+        """
+        snapshot = self.__dict__.get("_metadata_snapshot")
+        if snapshot is None:
+            return None
+
+        stored_metadata, snapshot_state = snapshot
+        if snapshot_state and type_state is None:
+            type_state = self.get_metadata_type_state()
+        # Without element type foreign key, a change of the type can not be seen
+        if not snapshot_state or snapshot_state != type_state:
+            return None
+
+        element_metadata = self.element_metadata or {}
+        if not isinstance(element_metadata, dict):
+            return None
+        return {
+            key
+            for key in stored_metadata.keys() | element_metadata.keys()
+            if key not in stored_metadata
+            or key not in element_metadata
+            or stored_metadata[key] != element_metadata[key]
+            # 1 == True, the type of a value matters
+            or type(stored_metadata[key]) is not type(element_metadata[key])
+        }
+
+    def upgrade_metadata(self):
+        """
+        Upgrades the loaded metadata of an older schema version, the element type is fetched if needed
+        """
+        if "_metadata_upgrade_from" in self.__dict__:
+            upgrade_loaded_metadata(self, self.get_element_type())
+
+    async def aupgrade_metadata(self):
+        if "_metadata_upgrade_from" in self.__dict__:
+            element_type = await self.aget_element_type()
+            # The changes of the definitions are read with the sync registry
+            await sync_to_async(upgrade_loaded_metadata)(self, element_type)
+
+    @property
+    def metadata_values(self):
+        """
+        The metadata decoded to their python types on access, ``material.metadata_values.weight``.
+        It reads ``element_metadata`` as it was when first used, until the next save or an assignment.
+        """
+        self.upgrade_metadata()
+        element_metadata = self.element_metadata
+        cached = self.__dict__.get("_metadata_values")
+        if cached is not None and cached[0] is element_metadata:
+            return cached[1]
+
+        element_type = self.get_element_type()
+        decoders = element_type.get_metadata_decoders() if element_type else {}
+        values = MetadataValues(element_metadata, decoders)
+        self.__dict__["_metadata_values"] = (element_metadata, values)
+        return values
+
+    @classmethod
+    def prefetch_metadata_values(cls, instances, fields=None):
+        """
+        Fetches the relation metadata of the ``metadata_values`` of many instances with one query per related model
+        """
+        return prefetch_metadata_values(instances, fields=fields)
+
     def get_element_type(self):
         raise NotImplementedError(
             f"Every child to '{self.__class__}' must implement this function to return the element type"
         )
 
-    def get_formatted_metadata(self, get_string=False):
-        element_metadata = self.element_metadata
+    @classmethod
+    def get_element_type_fields(cls):
+        """
+        Returns the foreign keys of the model pointing to a metadata type model
+        """
+        return [
+            field
+            for field in cls._meta.concrete_fields
+            if field.many_to_one
+            and isinstance(field.related_model, type)
+            and issubclass(field.related_model, GeneralMetadataTypeMixin)
+        ]
+
+    @instrumented("get_formatted_metadata")
+    def get_formatted_metadata(self, get_string=False, fields=None):
+        return self.format_metadata_bulk([self], get_string=get_string, fields=fields)[0]
+
+    @classmethod
+    @instrumented("format_metadata_bulk")
+    def format_metadata_bulk(cls, instances, get_string=False, fields=None):
+        """
+        Formats the metadata of many instances at once and returns them in the same order.
+        The definitions are loaded once per element type and the relation metadata
+        are resolved with one ``in_bulk()`` per related model.
+        ``fields`` restricts the formatted metadata to these keys.
+        """
+        instances = list(instances)
+        # The element types not loaded yet are fetched with one query per type model
+        type_fields = [type_field.name for type_field in cls.get_element_type_fields()]
+        if type_fields:
+            prefetch_related_objects(instances, *type_fields)
+        type_definitions = {}
+        fk_ids = defaultdict(set)
+        formatted = []
+
+        for instance in instances:
+            # If there is no metadata, we return None to avoid further executions
+            if not instance.element_metadata:
+                formatted.append(None)
+                continue
+
+            element_type = instance.get_element_type()
+            upgrade_loaded_metadata(instance, element_type)
+            type_key = (element_type.__class__, element_type.pk) if element_type else None
+            if type_key not in type_definitions:
+                definitions = element_type.get_metadata_definitions() if element_type else []
+                type_definitions[type_key] = cls.get_formatting_definitions(definitions)
+            fk_definitions, value_formatters = type_definitions[type_key]
+
+            if fields is None:
+                element_metadata = dict(instance.element_metadata)
+            else:
+                element_metadata = {k: v for k, v in instance.element_metadata.items() if k in fields}
+            for field_name, element_fk_model in fk_definitions:
+                fk_id = get_fk_metadata_pk(element_fk_model, element_metadata.get(field_name, None))
+                if fk_id is not None:
+                    fk_ids[element_fk_model].add(fk_id)
+
+            formatted.append((element_metadata, fk_definitions, value_formatters))
+
+        # FETCHING RELATION METADATA
+        fk_instances = {
+            element_fk_model: element_fk_model.objects.in_bulk(list(ids)) for element_fk_model, ids in fk_ids.items()
+        }
+
+        for index, row in enumerate(formatted):
+            if row is not None:
+                formatted[index] = cls.format_metadata_row(*row, fk_instances, get_string=get_string)
+
+        return formatted
+
+    @staticmethod
+    def format_metadata_row(element_metadata, fk_definitions, value_formatters, fk_instances, get_string=False):
+        """
+        Formats a metadata dict in place with the relation instances already fetched by model and pk
+        """
+        # FORMATTING RELATION METADATA
+        for field_name, element_fk_model in fk_definitions:
+            fk_id = get_fk_metadata_pk(element_fk_model, element_metadata.get(field_name, None))
+            element_fk_instance = fk_instances[element_fk_model].get(fk_id) if fk_id is not None else None
+            if element_fk_instance is None:
+                continue
+
+            if get_string:
+                # If the model has the function 'get_metadata_description'
+                # we use it to show description
+                # else we use the '__str__' function
+                elemt_fk_str_function = getattr(
+                    element_fk_instance, "get_metadata_description", element_fk_instance.__str__
+                )
+                element_metadata[field_name] = elemt_fk_str_function()
+            else:
+                element_metadata[field_name] = element_fk_instance
 
+        # FORMATTING DECIMAL, INTEGER AND THE OTHER FORMATTED METADATA
+        for field_name, format_value in value_formatters:
+            value = element_metadata.get(field_name, None)
+            if value:
+                element_metadata[field_name] = format_value(value)
+
+        return element_metadata
+
+    @staticmethod
+    def get_formatting_definitions(definitions):
+        """
+        Returns the relation definitions as (field name, model) and the (field name, formatter) of the formatted types
+        """
+        fk_definitions = []
+        value_formatters = []
+
+        for definition in definitions:
+            meta_type = definition.get_meta_type()
+            if meta_type.is_relation:
+                element_fk_model = definition.get_metadata_model()
+                if element_fk_model:
+                    fk_definitions.append((definition.field_name, element_fk_model))
+            elif meta_type.formats_values:
+                value_formatters.append((definition.field_name, meta_type.format_value))
+
+        return fk_definitions, value_formatters
+
+    async def aget_element_type(self):
+        """
+        Async counterpart of ``get_element_type()``. The element type is fetched with the async ORM
+        when the model has a single foreign key to a type model, override it for other cases.
+        """
+        type_fields = self.get_element_type_fields()
+        if len(type_fields) == 1:
+            type_field = type_fields[0]
+            if not type_field.is_cached(self):
+                type_pk = getattr(self, type_field.attname)
+                element_type = None
+                if type_pk is not None:
+                    element_type = await type_field.related_model._default_manager.filter(pk=type_pk).afirst()
+                type_field.set_cached_value(self, element_type)
+            return self.get_element_type()
+
+        return await sync_to_async(self.get_element_type)()
+
+    async def aget_formatted_metadata(self, get_string=False):
+        await self.aupgrade_metadata()
         # If there is no metadata, we return None to avoid further executions
-        if not element_metadata:
+        if not self.element_metadata:
             return None
 
-        # FORMATTING RELATION METADATA
-        element_type = self.get_element_type()
-        element_fks = element_type.metadata.filter(meta_type=GeneralMetadataMixin.FK)
-        if element_fks.exists():
-            for element_fk in element_fks:
-                element_fk_model = element_fk.get_metadata_model()
-                if element_fk_model:
-                    try:
-                        element_fk_instance = element_fk_model.objects.get(
-                            id=element_metadata.get(element_fk.field_name, None)
-                        )
-                        if get_string:
-                            # If the model has the function 'get_metadata_description'
-                            # we use it to show description
-                            # else we use the '__str__' function
-                            elemt_fk_str_function = getattr(
-                                element_fk_instance, f"get_metadata_description", element_fk_instance.__str__
-                            )
-                            element_metadata[element_fk.field_name] = elemt_fk_str_function()
-                        else:
-                            element_metadata[element_fk.field_name] = element_fk_instance
-                    except element_fk_model.DoesNotExist:
-                        pass
-
-        # FORMATTING DECIMAL AND INTEGER METADATA
-        element_numbers = element_type.metadata.filter(
-            meta_type__in=[GeneralMetadataMixin.INTEGERFIELD, GeneralMetadataMixin.DECIMALFIELD]
+        element_type = await self.aget_element_type()
+        definitions = await element_type.aget_metadata_definitions() if element_type else []
+        fk_definitions, value_formatters = self.get_formatting_definitions(definitions)
+
+        element_metadata = dict(self.element_metadata)
+        fk_ids = defaultdict(set)
+        for field_name, element_fk_model in fk_definitions:
+            fk_id = get_fk_metadata_pk(element_fk_model, element_metadata.get(field_name, None))
+            if fk_id is not None:
+                fk_ids[element_fk_model].add(fk_id)
+
+        # FETCHING RELATION METADATA, the models are independent
+        fk_results = await asyncio.gather(
+            *[element_fk_model.objects.ain_bulk(list(ids)) for element_fk_model, ids in fk_ids.items()]
         )
-        if element_numbers.exists():
-            for element_number in element_numbers:
-                number_value = element_metadata.get(element_number.field_name, None)
-                if number_value:
-                    element_metadata[element_number.field_name] = intcomma(number_value)
+        fk_instances = defaultdict(dict, zip(fk_ids, fk_results))
 
-        return element_metadata
+        return self.format_metadata_row(
+            element_metadata, fk_definitions, value_formatters, fk_instances, get_string=get_string
+        )
 
     def get_metadata_form_class(self):
         elmt_type = self.get_element_type()
         if elmt_type:
             return elmt_type.get_form_class()
 
+    @instrumented("get_metadata_form")
     def get_metadata_form(self):
         if self.element_metadata:
             return self.get_metadata_form_class()(self.element_metadata)
         else:
             return self.get_metadata_form_class()
 
-    def clean(self):
+    def get_metadata_validator(self):
+        elmt_type = self.get_element_type()
+        if elmt_type:
+            return elmt_type.get_metadata_validator()
+
+    def convert_metadata_instances(self, keys=None):
         # Converting Models to PK
         if self.element_metadata:
             for k, v in self.element_metadata.items():
+                if keys is not None and k not in keys:
+                    continue
                 try:
                     self.element_metadata[k] = v.pk
                 except BaseException:
                     pass
 
+    @instrumented("clean")
+    def clean(self):
+        return self.clean_metadata()
+
+    def clean_metadata(self, full=False):
+        """
+        Validates the metadata keys changed since the instance was loaded, all of them with ``full``
+        """
+        self.upgrade_metadata()
+        keys = None if full else self.get_changed_metadata_keys()
+        self.convert_metadata_instances(keys)
+
+        if get_setting("VALIDATOR", COMPILED) == FORM:
+            return self.clean_metadata_form()
+
+        # Like the form path, empty metadata are not validated
+        if not self.element_metadata or keys == set():
+            return None
+
+        validator = self.get_metadata_validator()
+        if not validator:
+            logger.debug("No metadata validator implemented")
+            return None
+
+        errors = validator.validate(self.element_metadata, fields=keys)
+        if errors:
+            logger.error(f"GOT ERROR FOR METADATA : {errors.as_json()}")
+            raise ValidationError({"element_metadata": errors.as_json()})
+
+    async def aclean_metadata(self, full=False):
+        """
+        Async validation of the metadata with the compiled validator,
+        the relation metadata of different models are checked concurrently.
+        Like ``clean_metadata()``, only the changed keys are validated without ``full``.
+        """
+        await self.aupgrade_metadata()
+        keys = None if full else self.get_changed_metadata_keys(type_state=await self.aget_metadata_type_state())
+        self.convert_metadata_instances(keys)
+
+        # Like the form path, empty metadata are not validated
+        if not self.element_metadata or keys == set():
+            return None
+
+        element_type = await self.aget_element_type()
+        if not element_type:
+            logger.debug("No metadata validator implemented")
+            return None
+
+        validator = await element_type.aget_metadata_validator()
+        relation_pks = validator.get_relation_pks(self.element_metadata, fields=keys)
+        existing_pks = await asyncio.gather(*[aget_existing_pks(model, pks) for model, pks in relation_pks.items()])
+
+        errors = validator.validate(
+            self.element_metadata, fields=keys, known_pks=dict(zip(relation_pks, existing_pks))
+        )
+        if errors:
+            logger.error(f"GOT ERROR FOR METADATA : {errors.as_json()}")
+            raise ValidationError({"element_metadata": errors.as_json()})
+
+    @classmethod
+    @instrumented("validate_metadata_bulk")
+    def validate_metadata_bulk(cls, instances, full=False):
+        """
+        Validates the metadata of many instances without raising, e.g. before ``bulk_create()``.
+        The instances of an element type share its compiled validator and the relation
+        metadata are checked with one ``filter(pk__in=...)`` per related model.
+        Only the changed keys of the loaded instances are validated, all the keys with ``full``.
+        Returns the errors (like ``form.errors``) by position of the failing instances.
+        """
+        validators = {}
+        rows = []
+        relation_pks = defaultdict(set)
+
+        for index, instance in enumerate(instances):
+            instance.upgrade_metadata()
+            keys = None if full else instance.get_changed_metadata_keys()
+            instance.convert_metadata_instances(keys)
+
+            # Like the single instance validation, empty metadata are not validated
+            if not instance.element_metadata or keys == set():
+                continue
+
+            element_type = instance.get_element_type()
+            if not element_type:
+                continue
+
+            type_key = (element_type.__class__, element_type.pk)
+            if type_key not in validators:
+                validators[type_key] = element_type.get_metadata_validator()
+            validator = validators[type_key]
+
+            for model, pks in validator.get_relation_pks(instance.element_metadata, fields=keys).items():
+                relation_pks[model].update(pks)
+            rows.append((index, validator, instance.element_metadata, keys))
+
+        known_pks = {model: get_existing_pks(model, pks) for model, pks in relation_pks.items()}
+
+        errors = {}
+        for index, validator, element_metadata, keys in rows:
+            instance_errors = validator.validate(element_metadata, fields=keys, known_pks=known_pks)
+            if instance_errors:
+                errors[index] = instance_errors
+
+        return errors
+
+    def clean_metadata_form(self):
+        """
+        Validates the metadata through the form of the element type
+        """
         # Cleaning the element type
         # element_type = self.get_element_type()
         # if not isinstance(getattr(element_type, "metadata", None), GeneralMetaData):
@@ -418,3 +868,51 @@ class CustomMetadataMixin(models.Model):
                 raise ValidationError({"element_metadata": metadata_form.errors.as_json()})
         except TypeError as e:
             logger.error(f"Metadata form error : {e}")
+
+
+class MaterializedMetadataMixin(CustomMetadataMixin):
+    """
+    Keeps the display of the metadata (``get_formatted_metadata(get_string=True)``) in ``element_metadata_display``.
+    It is computed at save, reset to NULL when a definition or a relation target changes,
+    and computed again by ``refresh_metadata_display()`` or the ``refresh_metadata_display`` command.
+    """
+
+    element_metadata_display = models.JSONField(null=True, blank=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "element_metadata" in update_fields:
+            keys = self.get_changed_metadata_keys()
+            if keys is None or self.element_metadata_display is None:
+                self.element_metadata_display = self.get_formatted_metadata(get_string=True) or {}
+            elif keys:
+                # Only the changed keys are formatted again
+                display = dict(self.element_metadata_display)
+                display.update(self.get_formatted_metadata(get_string=True, fields=keys) or {})
+                for key in keys - (self.element_metadata or {}).keys():
+                    display.pop(key, None)
+                self.element_metadata_display = display
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "element_metadata_display"}
+        super().save(*args, **kwargs)
+
+    def get_metadata_display(self):
+        """
+        The stored display of the metadata, computed if it is stale
+        """
+        if self.element_metadata_display is not None:
+            return self.element_metadata_display
+        return self.get_formatted_metadata(get_string=True) or {}
+
+    @classmethod
+    def refresh_metadata_display(cls, instances, using=None):
+        """
+        Computes and writes the display of many instances, with the bulk formatting
+        """
+        instances = list(instances)
+        for instance, display in zip(instances, cls.format_metadata_bulk(instances, get_string=True)):
+            instance.element_metadata_display = display or {}
+        cls._default_manager.db_manager(using).bulk_update(instances, ["element_metadata_display"])
@@ -1,5 +1,7 @@
 from django.db import models
+from django.utils.translation import gettext_lazy as _
 import swapper
+from .meta_types import MetaTypeMap
 from .model_mixins import GeneralMetadataMixin
 
 
@@ -14,3 +16,74 @@ class ModelGeneralMetaData(GeneralMetadataMixin):
 
     class Meta:
         swappable = swapper.swappable_setting("django_model_metadata", "ModelGeneralMetaData")
+
+
+class MetadataSearchIndex(models.Model):
+    """
+    Typed copy of the searchable metadata values
+    Used to filter the elements without scanning their json data
+    """
+
+    # The column of every metadata type, see ``MetaType.index_column``
+    VALUE_COLUMNS = MetaTypeMap(lambda meta_type: meta_type.index_column)
+
+    content_type = models.ForeignKey("contenttypes.ContentType", on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    metadata = models.ForeignKey(
+        swapper.get_model_name("django_model_metadata", "ModelGeneralMetaData"),
+        on_delete=models.CASCADE,
+        related_name="search_index_entries",
+    )
+    value_text = models.CharField(max_length=255, null=True, blank=True)
+    value_integer = models.BigIntegerField(null=True, blank=True)
+    value_decimal = models.DecimalField(max_digits=30, decimal_places=10, null=True, blank=True)
+    value_date = models.DateField(null=True, blank=True)
+    value_datetime = models.DateTimeField(null=True, blank=True)
+    value_fk = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Metadata search index")
+        verbose_name_plural = _("Metadata search indexes")
+        indexes = [
+            models.Index(fields=["content_type", "object_id"], name="dmm_index_object_idx"),
+            models.Index(fields=["metadata", "value_text"], name="dmm_index_text_idx"),
+            models.Index(fields=["metadata", "value_integer"], name="dmm_index_integer_idx"),
+            models.Index(fields=["metadata", "value_decimal"], name="dmm_index_decimal_idx"),
+            models.Index(fields=["metadata", "value_date"], name="dmm_index_date_idx"),
+            models.Index(fields=["metadata", "value_datetime"], name="dmm_index_datetime_idx"),
+            models.Index(fields=["metadata", "value_fk"], name="dmm_index_fk_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.metadata_id} : {self.content_type_id}.{self.object_id}"
+
+
+class MetadataSchemaChange(models.Model):
+    """
+    Change of the ``field_name``, ``meta_type`` or ``widget_attrs`` of a definition
+    Its pk is the schema version stored in the elements, the older rows are upgraded from these changes.
+    """
+
+    metadata = models.ForeignKey(
+        swapper.get_model_name("django_model_metadata", "ModelGeneralMetaData"),
+        on_delete=models.CASCADE,
+        related_name="schema_changes",
+    )
+    old_field_name = models.CharField(max_length=200, null=True, blank=True)
+    new_field_name = models.CharField(max_length=200, null=True, blank=True)
+    old_meta_type = models.CharField(max_length=20)
+    new_meta_type = models.CharField(max_length=20)
+    old_widget_attrs = models.JSONField(null=True, blank=True)
+    new_widget_attrs = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Metadata schema change")
+        verbose_name_plural = _("Metadata schema changes")
+
+    def __str__(self):
+        return f"{self.pk} : {self.metadata_id}"
+
+    @property
+    def converts_values(self):
+        return self.old_meta_type != self.new_meta_type or self.old_widget_attrs != self.new_widget_attrs
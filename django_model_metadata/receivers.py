@@ -0,0 +1,155 @@
+import logging
+
+from django.apps import apps
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+import swapper
+
+from .autocomplete import get_fk_models
+from .cache import definition_cache, type_registries
+from .compact import definition_names
+from .display import (
+    definition_display_changed,
+    get_materialized_models,
+    relation_target_deleted,
+    relation_target_pre_save,
+    relation_target_saved,
+    type_display_changed,
+)
+from .model_mixins import CustomMetadataMixin, GeneralMetadataTypeMixin
+from .schema import definition_post_save, definition_pre_save
+from .search import delete_search_index, get_searchable_field_names, update_search_index
+
+logger = logging.getLogger(__name__)
+
+INTEGER_PK_TYPES = (
+    "AutoField",
+    "BigAutoField",
+    "SmallAutoField",
+    "IntegerField",
+    "BigIntegerField",
+    "PositiveIntegerField",
+    "PositiveBigIntegerField",
+)
+
+
+def definition_changed(sender, **kwargs):
+    """Drops the cached definitions, forms and validators of every type"""
+    # A definition can be shared by many types, we drop everything
+    for registry in type_registries:
+        registry.clear()
+    definition_names.clear()
+    definition_cache.bump()
+
+
+def type_metadata_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Drops the cached definitions of the types whose metadata were added or removed"""
+    if not action.startswith("post_"):
+        return
+
+    for registry in type_registries:
+        if not reverse:
+            registry.invalidate(instance.__class__, instance.pk)
+        elif pk_set:
+            for pk in pk_set:
+                registry.invalidate(model, pk)
+        else:
+            registry.invalidate_model(model)
+
+    if not reverse:
+        definition_cache.bump(instance._meta.label_lower, instance.pk)
+        type_display_changed(instance.__class__, [instance.pk])
+    elif pk_set:
+        for pk in pk_set:
+            definition_cache.bump(model._meta.label_lower, pk)
+        type_display_changed(model, pk_set)
+    else:
+        definition_cache.bump()
+        type_display_changed(model)
+
+
+def element_saved(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Rebuilds the search index of the element when its searchable metadata change"""
+    if raw:
+        return
+
+    # The index only changes with the searchable metadata
+    if update_fields is not None and "element_metadata" not in update_fields:
+        return
+    keys = instance.get_changed_metadata_keys()
+    if keys is not None and not keys & get_searchable_field_names(instance.get_element_type()):
+        return
+
+    update_search_index([instance], using=using)
+
+
+def element_deleted(sender, instance, using=None, **kwargs):
+    """Deletes the search index entries of the element"""
+    delete_search_index(instance, using=using)
+
+
+def get_indexable_element_models():
+    """Returns the element models whose pk can be stored in the search index"""
+    for model in apps.get_models():
+        if not issubclass(model, CustomMetadataMixin):
+            continue
+
+        if model._meta.pk.get_internal_type() not in INTEGER_PK_TYPES:
+            logger.warning(f"{model._meta.label} has a non integer pk, its metadata will not be indexed")
+            continue
+
+        yield model
+
+
+def get_metadata_relations(metadata_model):
+    """Returns the many to many fields linking the metadata types to the definitions"""
+    for model in apps.get_models():
+        if not issubclass(model, GeneralMetadataTypeMixin):
+            continue
+
+        for field in model._meta.many_to_many:
+            if field.related_model is metadata_model:
+                yield field
+
+
+def connect_receivers():
+    """Connects the cache, schema, search index and display receivers to the installed models"""
+    metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+
+    # The schema change is recorded before the caches are dropped
+    pre_save.connect(definition_pre_save, sender=metadata_model, dispatch_uid="dmm_definition_pre_save")
+    post_save.connect(definition_post_save, sender=metadata_model, dispatch_uid="dmm_definition_versioned")
+    post_save.connect(definition_changed, sender=metadata_model, dispatch_uid="dmm_definition_saved")
+    post_delete.connect(definition_changed, sender=metadata_model, dispatch_uid="dmm_definition_deleted")
+
+    for field in get_metadata_relations(metadata_model):
+        m2m_changed.connect(
+            type_metadata_changed,
+            sender=field.remote_field.through,
+            dispatch_uid=f"dmm_metadata_changed_{field.model._meta.label_lower}_{field.name}",
+        )
+
+    if get_materialized_models():
+        post_save.connect(definition_display_changed, sender=metadata_model, dispatch_uid="dmm_definition_display")
+        pre_delete.connect(
+            definition_display_changed, sender=metadata_model, dispatch_uid="dmm_definition_deleted_display"
+        )
+        for label, _ in get_fk_models():
+            try:
+                target_model = apps.get_model(label)
+            except (LookupError, ValueError):
+                continue
+            target_label = target_model._meta.label_lower
+            pre_save.connect(
+                relation_target_pre_save, sender=target_model, dispatch_uid=f"dmm_target_pre_save_{target_label}"
+            )
+            post_save.connect(
+                relation_target_saved, sender=target_model, dispatch_uid=f"dmm_target_saved_{target_label}"
+            )
+            post_delete.connect(
+                relation_target_deleted, sender=target_model, dispatch_uid=f"dmm_target_deleted_{target_label}"
+            )
+
+    for model in get_indexable_element_models():
+        label = model._meta.label_lower
+        post_save.connect(element_saved, sender=model, dispatch_uid=f"dmm_element_saved_{label}")
+        post_delete.connect(element_deleted, sender=model, dispatch_uid=f"dmm_element_deleted_{label}")
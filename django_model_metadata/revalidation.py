@@ -0,0 +1,60 @@
+"""Revalidation of the stored metadata, by pk shards validated in worker processes"""
+
+import django
+from django.apps import apps
+from django.db import connections
+from django.db.models import Max, Min
+
+
+def get_shards(model, shard_size, using="default"):
+    """Splits the pk range of the model into (start, end) ranges, end excluded"""
+    bounds = model._default_manager.using(using).aggregate(start=Min("pk"), end=Max("pk"))
+    if bounds["start"] is None:
+        return []
+    return [
+        (start, min(start + shard_size, bounds["end"] + 1))
+        for start in range(bounds["start"], bounds["end"] + 1, shard_size)
+    ]
+
+
+def init_worker():
+    """Sets Django up in a spawned worker process"""
+    # The spawned workers set Django up, each worker opens its own connection
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def get_compact_errors(errors):
+    """The error messages by field of a form, as plain data sent back by the workers"""
+    return {
+        field: [error["message"] for error in field_errors] for field, field_errors in errors.get_json_data().items()
+    }
+
+
+def validate_shard(model_label, start, end, using="default", batch_size=1000):
+    """
+    Validates all the stored metadata of a pk range,
+    returns (start, end, number of checked elements, [(pk, errors)])
+    """
+    model = apps.get_model(model_label)
+    queryset = model._default_manager.using(using).filter(pk__gte=start, pk__lt=end).order_by("pk")
+    type_fields = [type_field.name for type_field in model.get_element_type_fields()]
+    if type_fields:
+        queryset = queryset.select_related(*type_fields)
+
+    checked = 0
+    failures = []
+    last_pk = None
+    while True:
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_queryset[:batch_size])
+        if not batch:
+            break
+
+        for index, errors in model.validate_metadata_bulk(batch, full=True).items():
+            failures.append((batch[index].pk, get_compact_errors(errors)))
+        checked += len(batch)
+        last_pk = batch[-1].pk
+
+    return start, end, checked, failures
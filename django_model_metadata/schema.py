@@ -0,0 +1,214 @@
+"""
+Versioning of the metadata definitions
+Every change of ``field_name``, ``meta_type`` or ``widget_attrs`` is recorded as a ``MetadataSchemaChange``,
+the elements of the models declaring ``versioned_metadata = True`` store the last change they follow under ``"#v"``.
+Older rows are upgraded when they are loaded, and written back on their next save or by the ``migrate_metadata_schema``
+command.
+"""
+
+import asyncio
+import datetime
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import models
+
+from .cache import schema_changes_registry
+from .conf import get_setting
+
+SCHEMA_VERSION_KEY = "#v"
+
+VERSIONED_FIELDS = ("field_name", "meta_type", "widget_attrs")
+
+
+def get_schema_change_model():
+    """The model recording the changes of the definitions"""
+    return apps.get_model("django_model_metadata", "MetadataSchemaChange")
+
+
+class SchemaVersion:
+    """
+    The last recorded change, read again after ``DJANGO_MODEL_METADATA_SCHEMA_VERSION_TTL`` seconds
+    so the changes recorded by other processes are seen
+    """
+
+    def __init__(self):
+        self._version = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._version is None or time.monotonic() > self._expires:
+            version = get_schema_change_model().objects.aggregate(version=models.Max("pk"))["version"] or 0
+            with self._lock:
+                self._version = version
+                self._expires = time.monotonic() + get_setting("SCHEMA_VERSION_TTL", 30)
+        return self._version
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+
+
+schema_version = SchemaVersion()
+
+
+def get_type_schema_changes(element_type):
+    """
+    Returns the definitions of the type by pk
+    and their changes as (version, definition pk, old field name, converts)
+    """
+
+    def build():
+        definitions = {definition.pk: definition for definition in element_type.get_metadata_definitions()}
+        changes = [
+            (change.pk, change.metadata_id, change.old_field_name, change.converts_values)
+            for change in get_schema_change_model().objects.filter(metadata__in=list(definitions)).order_by("pk")
+        ]
+        return definitions, changes
+
+    return schema_changes_registry.get_or_build(element_type, "metadata", build)
+
+
+def to_json_value(value):
+    """The json value stored for a python value of a metadata"""
+    if isinstance(value, Decimal):
+        return str(value)
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    elif isinstance(value, models.Model):
+        return value.pk
+    return value
+
+
+def convert_metadata_value(definition, value):
+    """
+    Converts a value to the current type and attributes of its definition,
+    the values that can not be converted are kept
+    """
+    if value is None or value == "":
+        return value
+    return definition.get_meta_type().convert_value(definition, value)
+
+
+def upgrade_metadata(element_type, element_metadata, version):
+    """Applies to named metadata the changes of the type definitions recorded after ``version``"""
+    definitions, changes = get_type_schema_changes(element_type)
+
+    pending = defaultdict(list)
+    for change_version, metadata_id, old_field_name, converts in changes:
+        if change_version > version:
+            pending[metadata_id].append((old_field_name, converts))
+
+    upgraded = dict(element_metadata)
+    for metadata_id, metadata_changes in pending.items():
+        definition = definitions[metadata_id]
+        field_name = definition.field_name
+
+        # The most recent name first, for the chained renames
+        if field_name not in upgraded:
+            for old_field_name, _ in reversed(metadata_changes):
+                if old_field_name and old_field_name in upgraded:
+                    upgraded[field_name] = upgraded.pop(old_field_name)
+                    break
+
+        if field_name in upgraded and any(converts for _, converts in metadata_changes):
+            upgraded[field_name] = convert_metadata_value(definition, upgraded[field_name])
+
+    return upgraded
+
+
+def check_loaded_metadata(instance):
+    """
+    Removes the version of a loaded row and marks it for an upgrade if it is older than the last change.
+    The upgrade waits for the first read of ``element_metadata`` with the element type loaded, e.g. by
+    ``select_related()``, or for ``upgrade_metadata()`` / ``aupgrade_metadata()`` of the instance.
+    """
+    element_metadata = instance.__dict__.get("element_metadata")
+    if not getattr(instance, "versioned_metadata", False) or not isinstance(element_metadata, dict):
+        return
+
+    version = element_metadata.pop(SCHEMA_VERSION_KEY, 0)
+    if element_metadata and version < schema_version.get():
+        instance.__dict__["_metadata_upgrade_from"] = version
+
+
+def upgrade_loaded_metadata(instance, element_type):
+    """Upgrades the metadata of a loaded element once its element type is known"""
+    version = instance.__dict__.pop("_metadata_upgrade_from", None)
+    if version is None or element_type is None:
+        return
+
+    instance.__dict__["element_metadata"] = upgrade_metadata(
+        element_type, instance.__dict__["element_metadata"], version
+    )
+
+
+def in_event_loop():
+    """Whether the current thread runs an event loop, where the sync ORM may not be called"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def upgrade_on_read(instance):
+    """
+    Upgrades the metadata being read with an element type already loaded, nothing is fetched for the upgrade.
+    Not in an event loop, where the definitions and their changes could not be queried.
+    """
+    type_fields = instance.get_element_type_fields()
+    if len(type_fields) != 1 or not type_fields[0].is_cached(instance) or in_event_loop():
+        return
+    upgrade_loaded_metadata(instance, type_fields[0].get_cached_value(instance))
+
+
+def stamp_metadata(element_metadata):
+    """Adds the current version to metadata being stored, once a change has been recorded"""
+    if not element_metadata:
+        return element_metadata
+
+    version = schema_version.get()
+    if not version:
+        return element_metadata
+    return {**element_metadata, SCHEMA_VERSION_KEY: version}
+
+
+def definition_pre_save(sender, instance, raw=False, **kwargs):
+    """Keeps the previous name and type of a changed definition, to record the change after the save"""
+    instance._schema_change = None
+    if raw or instance.pk is None:
+        return
+
+    old = sender._default_manager.filter(pk=instance.pk).values(*VERSIONED_FIELDS).first()
+    if old is None or all(old[field] == getattr(instance, field) for field in VERSIONED_FIELDS):
+        return
+
+    # Naming a definition for the first time is not a rename
+    if old["field_name"] is None and all(old[field] == getattr(instance, field) for field in VERSIONED_FIELDS[1:]):
+        return
+
+    instance._schema_change = old
+
+
+def definition_post_save(sender, instance, raw=False, **kwargs):
+    """Records the change of the definition and drops the cached schema version"""
+    old = getattr(instance, "_schema_change", None)
+    if not old:
+        return
+
+    instance._schema_change = None
+    get_schema_change_model().objects.create(
+        metadata=instance,
+        old_field_name=old["field_name"],
+        new_field_name=instance.field_name,
+        old_meta_type=old["meta_type"],
+        new_meta_type=instance.meta_type,
+        old_widget_attrs=old["widget_attrs"],
+        new_widget_attrs=instance.widget_attrs,
+    )
+    schema_version.clear()
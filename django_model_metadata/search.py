@@ -0,0 +1,152 @@
+"""
+Searchable metadata index
+The values of the searchable definitions are copied into ``MetadataSearchIndex``
+with typed columns so the elements can be filtered with indexed lookups.
+"""
+
+import logging
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldError, ValidationError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
+import swapper
+
+logger = logging.getLogger(__name__)
+
+
+def get_search_index_model():
+    """The model of the search index table"""
+    return apps.get_model("django_model_metadata", "MetadataSearchIndex")
+
+
+def get_searchable_definitions(element_type):
+    """The definitions of the element type flagged ``searchable``"""
+    if not element_type:
+        return []
+    return [definition for definition in element_type.get_metadata_definitions() if definition.searchable]
+
+
+def get_searchable_field_names(element_type):
+    """The field names of the searchable definitions of the element type"""
+    return {definition.field_name for definition in get_searchable_definitions(element_type)}
+
+
+def get_index_value(index_model, column, value):
+    """Converts a metadata value to the python type of its index column, returns None if it does not fit"""
+    if value is None or value == "":
+        return None
+
+    if column == "value_text":
+        return str(value)[:255]
+
+    try:
+        value = index_model._meta.get_field(column).to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+    if column == "value_datetime" and settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+
+    return value
+
+
+def build_index_entries(instance, definitions, content_type, index_model):
+    """The unsaved search index rows of the searchable metadata of the element"""
+    element_metadata = instance.element_metadata or {}
+    entries = []
+
+    for definition in definitions:
+        column = index_model.VALUE_COLUMNS.get(definition.meta_type)
+        if not column:
+            continue
+
+        value = get_index_value(index_model, column, element_metadata.get(definition.field_name))
+        if value is None:
+            logger.debug(f"Metadata '{definition.field_name}' of {instance} not indexed")
+            continue
+
+        entries.append(
+            index_model(
+                content_type=content_type,
+                object_id=instance.pk,
+                metadata_id=definition.pk,
+                **{column: value},
+            )
+        )
+
+    return entries
+
+
+def update_search_index(instances, using=None):
+    """Replaces the search index entries of the given instances (of the same model)"""
+    instances = [instance for instance in instances if instance.pk is not None]
+    if not instances:
+        return
+
+    index_model = get_search_index_model()
+    content_type = ContentType.objects.db_manager(using).get_for_model(instances[0])
+
+    type_definitions = {}
+    entries = []
+    for instance in instances:
+        element_type = instance.get_element_type()
+        type_key = (element_type.__class__, element_type.pk) if element_type else None
+        if type_key not in type_definitions:
+            type_definitions[type_key] = get_searchable_definitions(element_type)
+
+        entries.extend(build_index_entries(instance, type_definitions[type_key], content_type, index_model))
+
+    with transaction.atomic(using=using):
+        index_model.objects.using(using).filter(
+            content_type=content_type, object_id__in=[instance.pk for instance in instances]
+        ).delete()
+        index_model.objects.using(using).bulk_create(entries)
+
+
+def delete_search_index(instance, using=None):
+    """Deletes the search index rows of the element"""
+    index_model = get_search_index_model()
+    content_type = ContentType.objects.db_manager(using).get_for_model(instance)
+    index_model.objects.using(using).filter(content_type=content_type, object_id=instance.pk).delete()
+
+
+def get_metadata_filters(model, lookups):
+    """Translates ``{"color": "red", "weight__gte": 10}`` into ``Exists()`` conditions on the search index"""
+    index_model = get_search_index_model()
+    metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+    content_type = ContentType.objects.get_for_model(model)
+
+    field_names = {lookup.split(LOOKUP_SEP, 1)[0] for lookup in lookups}
+    definitions = defaultdict(lambda: defaultdict(list))
+    for pk, field_name, meta_type in metadata_model.objects.filter(
+        field_name__in=field_names, searchable=True
+    ).values_list("pk", "field_name", "meta_type"):
+        column = index_model.VALUE_COLUMNS.get(meta_type)
+        if column:
+            definitions[field_name][column].append(pk)
+
+    filters = []
+    for lookup, value in lookups.items():
+        field_name, _, value_lookup = lookup.partition(LOOKUP_SEP)
+        if field_name not in definitions:
+            raise FieldError(f"'{field_name}' is not a searchable metadata")
+
+        condition = Q()
+        for column, metadata_ids in definitions[field_name].items():
+            condition |= Exists(
+                index_model.objects.filter(
+                    content_type=content_type,
+                    object_id=OuterRef("pk"),
+                    metadata_id__in=metadata_ids,
+                    **{f"{column}__{value_lookup or 'exact'}": value},
+                )
+            )
+        filters.append(condition)
+
+    return filters
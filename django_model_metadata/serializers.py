@@ -1,13 +1,177 @@
+import copy
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from .models import ModelGeneralMetaData
 
+
 class GeneralMetadataSerializer(serializers.ModelSerializer):
     class Meta:
         model = ModelGeneralMetaData
-        fields = ["id", "name", "field_name", "meta_type","widget_attrs"]
+        fields = ["id", "name", "field_name", "meta_type", "widget_attrs"]
 
 
 class GeneralMetadataListSerializer(serializers.ModelSerializer):
     class Meta:
         model = ModelGeneralMetaData
-        fields = ["id", "name", "field_name", "meta_type", "widget_attrs"]
\ No newline at end of file
+        fields = ["id", "name", "field_name", "meta_type", "widget_attrs"]
+
+
+def prefetch_element_types(instances):
+    """Loads the element types of the instances and their metadata definitions with one query each"""
+    if not instances:
+        return
+
+    lookups = []
+    for type_field in instances[0].get_element_type_fields():
+        lookups.append(type_field.name)
+        if hasattr(type_field.related_model, "metadata"):
+            lookups.append(f"{type_field.name}__metadata")
+    prefetch_related_objects(instances, *lookups)
+
+
+class ElementMetadataField(serializers.Field):
+    """
+    Reads the formatted metadata of a ``CustomMetadataMixin`` instance and writes ``element_metadata``.
+    The keys can be restricted with ``?metadata_fields=a,b`` or the ``metadata_fields`` context.
+    """
+
+    default_error_messages = {"invalid": "Expected a dictionary of metadata."}
+
+    def __init__(self, get_string=True, **kwargs):
+        self.get_string = get_string
+        self.preloaded = {}
+        kwargs["source"] = "*"
+        super().__init__(**kwargs)
+
+    def get_requested_fields(self):
+        metadata_fields = self.context.get("metadata_fields")
+        request = self.context.get("request")
+        if metadata_fields is None and request is not None:
+            metadata_fields = getattr(request, "query_params", request.GET).get("metadata_fields")
+
+        if metadata_fields is None:
+            return None
+        if isinstance(metadata_fields, str):
+            metadata_fields = metadata_fields.split(",")
+        return {field.strip() for field in metadata_fields if field.strip()}
+
+    def preload(self, instances):
+        """Formats the metadata of a whole page at once, the relation values are resolved in bulk"""
+        self.preloaded = {}
+        if not instances:
+            return
+
+        formatted = instances[0].format_metadata_bulk(
+            instances, get_string=self.get_string, fields=self.get_requested_fields()
+        )
+        self.preloaded = {id(instance): element_metadata for instance, element_metadata in zip(instances, formatted)}
+
+    def to_representation(self, instance):
+        if id(instance) in self.preloaded:
+            element_metadata = self.preloaded[id(instance)]
+        else:
+            element_metadata = instance.get_formatted_metadata(
+                get_string=self.get_string, fields=self.get_requested_fields()
+            )
+
+        if not element_metadata:
+            return {}
+        return {key: value.pk if isinstance(value, models.Model) else value for key, value in element_metadata.items()}
+
+    def to_internal_value(self, data):
+        if not isinstance(data, dict):
+            self.fail("invalid")
+        return {"element_metadata": data}
+
+
+def get_metadata_errors(error):
+    """The errors of ``clean_metadata()`` by metadata key, as the errors of a serializer"""
+    errors = {}
+    for message in error.message_dict.get("element_metadata", error.messages):
+        try:
+            key_errors = json.loads(message)
+        except (TypeError, ValueError):
+            errors.setdefault(serializers.api_settings.NON_FIELD_ERRORS_KEY, []).append(message)
+            continue
+        for key, details in key_errors.items():
+            errors.setdefault(key, []).extend(
+                serializers.ErrorDetail(detail["message"], code=detail["code"]) for detail in details
+            )
+    return errors
+
+
+class MetadataElementListSerializer(serializers.ListSerializer):
+    """Preloads the element types, the definitions and the relation metadata of the page before serializing it"""
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        instances = list(iterable)
+
+        metadata_fields = [field for field in self.child.fields.values() if isinstance(field, ElementMetadataField)]
+        if metadata_fields:
+            prefetch_element_types(instances)
+        for field in metadata_fields:
+            field.preload(instances)
+
+        try:
+            return super().to_representation(instances)
+        finally:
+            for field in metadata_fields:
+                field.preloaded = {}
+
+
+class MetadataElementSerializer(serializers.ModelSerializer):
+    """
+    Base serializer of the ``CustomMetadataMixin`` models
+
+        class MaterialSerializer(MetadataElementSerializer):
+            class Meta:
+                model = Material
+                fields = ["id", "name", "material_type", "element_metadata"]
+    """
+
+    element_metadata = ElementMetadataField()
+
+    def validate(self, attrs):
+        """Validates the written metadata with the validator of the element type, like ``clean()`` of the model"""
+        attrs = super().validate(attrs)
+        if "element_metadata" not in attrs:
+            return attrs
+
+        instance = self.get_metadata_instance(attrs)
+        try:
+            instance.clean_metadata()
+        except ValidationError as error:
+            raise serializers.ValidationError({"element_metadata": get_metadata_errors(error)})
+
+        # The relation metadata given as instances are stored as pks
+        attrs["element_metadata"] = instance.element_metadata
+        return attrs
+
+    def get_metadata_instance(self, attrs):
+        """
+        An instance with the validated values, a copy of the updated instance keeps its loaded metadata
+        to validate the changed keys only
+        """
+        model = self.Meta.model
+        instance = copy.copy(self.instance) if self.instance is not None else model()
+        for name, value in attrs.items():
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete and not field.many_to_many:
+                setattr(instance, field.name, value)
+        return instance
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_serializer = super().many_init(*args, **kwargs)
+        # A list_serializer_class of the Meta is kept
+        if type(list_serializer) is serializers.ListSerializer:
+            list_serializer.__class__ = MetadataElementListSerializer
+        return list_serializer
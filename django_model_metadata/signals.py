@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent after every instrumented metadata operation when DJANGO_MODEL_METADATA_INSTRUMENTATION is enabled.
+# Arguments : operation, model (label), duration (seconds), queries, rows, cache_hits, cache_misses
+metadata_operation_finished = Signal()
@@ -1,3 +1,1546 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import socket
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django import forms
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldError, ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, models
+from django.db.models import Avg, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import swapper
+
+from .meta_types import IntegerMetaType, MetaType, RelationMetaType, meta_types
+from .autocomplete import autocomplete_indexes
+from .cache import definition_cache
+from .checks import check_definition_cache
+from .compact import get_compact_key
+from .display import relation_definitions
+from .db_indexes import get_index_name, get_metadata_indexes
+from .instrumentation import PrometheusSink, StatsdSink, instrumented
+from .model_mixins import (
+    GENERAL_FIELDS_MAP,
+    CustomMetadataMixin,
+    GeneralMetadataTypeMixin,
+    MaterializedMetadataMixin,
+    build_metadata_form_class,
+)
+from .receivers import connect_receivers, definition_changed
+from .revalidation import get_shards, validate_shard
+from .schema import schema_version
+from .search import update_search_index
+from .serializers import MetadataElementSerializer
+from .signals import metadata_operation_finished
+from .validators import MetadataValidator
+from .values import MetadataValues, RelationDecoder
+
+ModelGeneralMetaData = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+MetadataSearchIndex = apps.get_model("django_model_metadata", "MetadataSearchIndex")
+
+
+class MetadataTestType(GeneralMetadataTypeMixin):
+    name = models.CharField(max_length=50)
+
+    class Meta:
+        app_label = "django_model_metadata"
+
+    def __str__(self):
+        return self.name
+
+
+class MetadataTestElement(CustomMetadataMixin):
+    element_type = models.ForeignKey(MetadataTestType, on_delete=models.CASCADE, null=True, related_name="elements")
+
+    class Meta:
+        app_label = "django_model_metadata"
+
+    def get_element_type(self):
+        return self.element_type
+
+
+class MetadataTestVersionedElement(CustomMetadataMixin):
+    element_type = models.ForeignKey(
+        MetadataTestType, on_delete=models.CASCADE, null=True, related_name="versioned_elements"
+    )
+
+    versioned_metadata = True
+
+    class Meta:
+        app_label = "django_model_metadata"
+
+    def get_element_type(self):
+        return self.element_type
+
+
+class MetadataTestCompactElement(CustomMetadataMixin):
+    element_type = models.ForeignKey(
+        MetadataTestType, on_delete=models.CASCADE, null=True, related_name="compact_elements"
+    )
+
+    compact_metadata = True
+
+    class Meta:
+        app_label = "django_model_metadata"
+
+    def get_element_type(self):
+        return self.element_type
+
+
+class MetadataTestMaterializedElement(MaterializedMetadataMixin):
+    element_type = models.ForeignKey(
+        MetadataTestType, on_delete=models.CASCADE, null=True, related_name="materialized_elements"
+    )
+
+    class Meta:
+        app_label = "django_model_metadata"
+
+    def get_element_type(self):
+        return self.element_type
+
+
+class MetadataTestTarget(models.Model):
+    name = models.CharField(max_length=50)
+
+    class Meta:
+        app_label = "django_model_metadata"
+
+    def __str__(self):
+        return self.name
+
+
+TEST_MODELS = [
+    MetadataTestType,
+    MetadataTestElement,
+    MetadataTestVersionedElement,
+    MetadataTestCompactElement,
+    MetadataTestMaterializedElement,
+    MetadataTestTarget,
+]
+
+
+def setUpModule():
+    # The test models have no migration, their tables are kept until the test database is destroyed
+    existing = connection.introspection.table_names()
+    with connection.schema_editor() as editor:
+        for model in TEST_MODELS:
+            if model._meta.db_table not in existing:
+                editor.create_model(model)
+
+    # They are registered after the app was ready
+    connect_receivers()
+
+
+class MetadataModelsTestCase(TestCase):
+    def setUp(self):
+        # The pks of the rolled back rows are used again
+        definition_changed(None)
+        schema_version.clear()
+        ContentType.objects.clear_cache()
+
+    def create_type(self, *definitions, name="Type"):
+        element_type = MetadataTestType.objects.create(name=name)
+        element_type.metadata.add(*definitions)
+        return element_type
+
+    def create_definition(self, field_name, meta_type="CharField", **widget_attrs):
+        return ModelGeneralMetaData.objects.create(
+            name=field_name.title(), field_name=field_name, meta_type=meta_type, widget_attrs=widget_attrs
+        )
+
+
+class CompiledValidatorParityTests(TestCase):
+    """
+    The compiled validator must give the errors of the form built with ``GENERAL_FIELDS_MAP``
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.related = ModelGeneralMetaData.objects.create(
+            name="Related", field_name="related", meta_type="CharField", widget_attrs={"max_length": 10}
+        )
+        cls.definitions = [
+            ModelGeneralMetaData(
+                name="Color", field_name="color", meta_type="CharField", widget_attrs={"max_length": 5}
+            ),
+            ModelGeneralMetaData(
+                name="Note",
+                field_name="note",
+                meta_type="CharField",
+                widget_attrs={"max_length": 10, "required": False},
+            ),
+            ModelGeneralMetaData(name="Count", field_name="count", meta_type="IntegerField", widget_attrs={}),
+            ModelGeneralMetaData(
+                name="Weight",
+                field_name="weight",
+                meta_type="DecimalField",
+                widget_attrs={"max_digits": 5, "decimal_places": 2},
+            ),
+            ModelGeneralMetaData(name="Day", field_name="day", meta_type="DateField", widget_attrs={}),
+            ModelGeneralMetaData(name="Moment", field_name="moment", meta_type="DateTimeField", widget_attrs={}),
+            ModelGeneralMetaData(
+                name="Size",
+                field_name="size",
+                meta_type="ChoiceField",
+                widget_attrs={"choices": [["s", "Small"], ["l", "Large"]]},
+            ),
+            ModelGeneralMetaData(name="Extra", field_name="extra", meta_type="JSONField", widget_attrs={}),
+            ModelGeneralMetaData(
+                name="Link",
+                field_name="link",
+                meta_type="ForeignKey",
+                widget_attrs={"model": "django_model_metadata.ModelGeneralMetaData"},
+            ),
+        ]
+
+    def assertParity(self, data):
+        form = build_metadata_form_class(self.definitions)(data)
+        form.is_valid()
+        errors = MetadataValidator(self.definitions).validate(data)
+        self.assertEqual(errors.as_json(), form.errors.as_json(), data)
+        return errors
+
+    def get_valid_data(self):
+        return {
+            "color": "red",
+            "note": "",
+            "count": 3,
+            "weight": "123.45",
+            "day": "2024-02-29",
+            "moment": "2024-02-29 10:30",
+            "size": "s",
+            "extra": {"a": 1},
+            "link": self.related.pk,
+        }
+
+    def test_fields_map_covers_all_types(self):
+        self.assertEqual(set(GENERAL_FIELDS_MAP), {choice[0] for choice in ModelGeneralMetaData.METADATA_TYPE_CHOICES})
+
+    def test_valid_data(self):
+        self.assertFalse(self.assertParity(self.get_valid_data()))
+
+    def test_missing_data(self):
+        self.assertEqual(len(self.assertParity({"note": "ok"})), len(self.definitions) - 1)
+
+    def test_invalid_values(self):
+        invalid_values = {
+            "color": ["toolong", " ", 12345678, "a\x00"],
+            "note": ["x" * 11],
+            "count": ["abc", 1.5, True, "", None],
+            "weight": ["1234.5", "1.234", "abc", "NaN", 1e10, True],
+            "day": ["2024-02-30", "20240229", ""],
+            "moment": ["2024-13-01 10:00", "yesterday"],
+            "size": ["m", "", None, 1],
+            "extra": ["{not json"],
+            "link": [0, "abc", self.related.pk + 100, ""],
+        }
+        for field_name, values in invalid_values.items():
+            for value in values:
+                with self.subTest(field_name=field_name, value=value):
+                    data = self.get_valid_data()
+                    data[field_name] = value
+                    self.assertIn(field_name, self.assertParity(data))
+
+    def test_accepted_variants(self):
+        variants = {
+            "color": [" red ", 123],
+            "count": ["12", "12.0", -4],
+            "weight": [Decimal("1.5"), 100, "-999.99", 1.25],
+            "day": ["2024-1-5"],
+            "size": ["l"],
+            "link": [str(self.related.pk), self.related],
+        }
+        for field_name, values in variants.items():
+            for value in values:
+                with self.subTest(field_name=field_name, value=value):
+                    data = self.get_valid_data()
+                    data[field_name] = value
+                    self.assertFalse(self.assertParity(data))
+
+    def test_validate_subset_of_fields(self):
+        errors = MetadataValidator(self.definitions).validate({"count": "abc"}, fields={"count"})
+        self.assertEqual(list(errors), ["count"])
+
+    def test_known_pks_skip_queries(self):
+        validator = MetadataValidator(self.definitions)
+        data = self.get_valid_data()
+        known_pks = validator.get_relation_pks(data)
+        with self.assertNumQueries(0):
+            self.assertFalse(validator.validate(data, known_pks=known_pks))
+        with self.assertNumQueries(0):
+            self.assertIn("link", validator.validate(data, known_pks={ModelGeneralMetaData: set()}))
+
+    @override_settings(DJANGO_MODEL_METADATA_VALIDATOR="form")
+    def test_form_fallback_setting(self):
+        from .conf import get_setting
+
+        self.assertEqual(get_setting("VALIDATOR"), "form")
+
+
+class BooleanMetaType(MetaType):
+    name = "BooleanField"
+    label = "Yes / No"
+    form_field_class = forms.NullBooleanField
+
+
+@override_settings(DJANGO_MODEL_METADATA_META_TYPES=["django_model_metadata.tests.BooleanMetaType"])
+class MetaTypeRegistryTests(TestCase):
+    def test_setting_registers_type(self):
+        self.assertIsInstance(meta_types["BooleanField"], BooleanMetaType)
+        self.assertIs(GENERAL_FIELDS_MAP["BooleanField"], forms.NullBooleanField)
+
+    def test_registered_type_definition(self):
+        definition = ModelGeneralMetaData(
+            name="Active", field_name="active", meta_type="BooleanField", widget_attrs={}
+        )
+        definition.full_clean()
+        self.assertIsInstance(definition.get_form_field_object(), forms.NullBooleanField)
+        self.assertEqual(definition.get_field_schema(), {"type": "string", "title": "Active"})
+
+        self.assertFalse(MetadataValidator([definition]).validate({"active": True}))
+
+    def test_unknown_type_is_invalid(self):
+        definition = ModelGeneralMetaData(name="Other", field_name="other", meta_type="Other", widget_attrs={})
+        with self.assertRaises(ValidationError) as context:
+            definition.clean_fields()
+        self.assertIn("meta_type", context.exception.message_dict)
+
+
+class MetadataValuesTests(TestCase):
+    def setUp(self):
+        self.related = ModelGeneralMetaData.objects.create(
+            name="Related", field_name="related", meta_type="CharField", widget_attrs={"max_length": 10}
+        )
+        definitions = [
+            ModelGeneralMetaData(name="Count", field_name="count", meta_type="IntegerField", widget_attrs={}),
+            ModelGeneralMetaData(name="Weight", field_name="weight", meta_type="DecimalField", widget_attrs={}),
+            ModelGeneralMetaData(name="Day", field_name="day", meta_type="DateField", widget_attrs={}),
+            ModelGeneralMetaData(
+                name="Link",
+                field_name="link",
+                meta_type="ForeignKey",
+                widget_attrs={"model": ModelGeneralMetaData._meta.label},
+            ),
+        ]
+        self.decoders = {
+            definition.field_name: definition.get_meta_type().get_decoder(definition) for definition in definitions
+        }
+
+    def test_decoded_values(self):
+        values = MetadataValues(
+            {"count": "12.0", "weight": "1.50", "day": "2024-02-29", "link": self.related.pk, "extra": "x"},
+            self.decoders,
+        )
+        self.assertEqual(values.count, 12)
+        self.assertEqual(values.weight, Decimal("1.50"))
+        self.assertEqual(values.day, datetime.date(2024, 2, 29))
+        self.assertEqual(values["extra"], "x")
+        with self.assertNumQueries(1):
+            self.assertEqual(values.link, self.related)
+            self.assertEqual(values.link, self.related)
+
+    def test_missing_and_invalid_values(self):
+        values = MetadataValues({"count": "abc"}, self.decoders)
+        self.assertEqual(values.count, "abc")
+        self.assertIsNone(values.weight)
+        self.assertIsInstance(self.decoders["link"], RelationDecoder)
+        with self.assertRaises(AttributeError):
+            values.unknown
+        with self.assertRaises(AttributeError):
+            values.count = 1
+
+
+class RevalidationTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.element_type = self.create_type(self.create_definition("count", "IntegerField"))
+
+    def test_loaded_metadata_full_validation(self):
+        element = MetadataTestElement.objects.create(element_type=self.element_type, element_metadata={"count": "abc"})
+        element = MetadataTestElement.objects.get(pk=element.pk)
+
+        # Nothing changed since the load
+        element.full_clean()
+        with self.assertRaises(ValidationError):
+            element.clean_metadata(full=True)
+        self.assertEqual(list(MetadataTestElement.validate_metadata_bulk([element])), [])
+        self.assertEqual(list(MetadataTestElement.validate_metadata_bulk([element], full=True)), [0])
+
+    def test_shards(self):
+        self.assertEqual(get_shards(MetadataTestElement, 2), [])
+        elements = MetadataTestElement.objects.bulk_create(
+            [MetadataTestElement(element_type=self.element_type) for index in range(5)]
+        )
+        first = elements[0].pk
+        self.assertEqual(
+            get_shards(MetadataTestElement, 2), [(first, first + 2), (first + 2, first + 4), (first + 4, first + 5)]
+        )
+
+    def test_stored_invalid_rows_are_reported(self):
+        elements = MetadataTestElement.objects.bulk_create(
+            [
+                MetadataTestElement(element_type=self.element_type, element_metadata={"count": 1}),
+                MetadataTestElement(element_type=self.element_type, element_metadata={"count": "abc"}),
+                MetadataTestElement(element_type=self.element_type, element_metadata={"count": 2}),
+                MetadataTestElement(element_type=self.element_type, element_metadata={"count": "1.5"}),
+            ]
+        )
+
+        start, end, checked, failures = validate_shard(
+            MetadataTestElement._meta.label, elements[0].pk, elements[-1].pk + 1, batch_size=3
+        )
+        self.assertEqual(checked, 4)
+        self.assertEqual([pk for pk, errors in failures], [elements[1].pk, elements[3].pk])
+        self.assertEqual(list(failures[0][1]), ["count"])
+
+
+class SchemaUpgradeTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.definition = self.create_definition("color", max_length=10)
+        self.element_type = self.create_type(self.definition)
+        self.element = MetadataTestVersionedElement.objects.create(
+            element_type=self.element_type, element_metadata={"color": "red"}
+        )
+        self.definition.field_name = "colour"
+        self.definition.save()
+
+    def test_stored_version(self):
+        stored = MetadataTestVersionedElement.objects.values_list("element_metadata", flat=True).get()
+        self.assertEqual(stored, {"color": "red"})
+
+        MetadataTestVersionedElement.objects.get(pk=self.element.pk).save()
+        stored = MetadataTestVersionedElement.objects.values_list("element_metadata", flat=True).get()
+        self.assertEqual(stored, {"colour": "red", "#v": schema_version.get()})
+
+    def test_unversioned_storage(self):
+        element = MetadataTestElement.objects.create(
+            element_type=self.element_type, element_metadata={"colour": "red"}
+        )
+        self.assertTrue(MetadataTestElement.objects.filter(element_metadata={"colour": "red"}).exists())
+
+        # Nothing is upgraded without a version
+        element = MetadataTestElement.objects.select_related("element_type").get(pk=element.pk)
+        self.assertNotIn("_metadata_upgrade_from", element.__dict__)
+
+    def test_chained_changes(self):
+        self.definition.widget_attrs = {"max_length": 2}
+        self.definition.save()
+        element = MetadataTestVersionedElement.objects.select_related("element_type").get(pk=self.element.pk)
+        self.assertEqual(element.element_metadata, {"colour": "re"})
+
+        # Written back, nothing is left to upgrade
+        element.save()
+        element = MetadataTestVersionedElement.objects.get(pk=self.element.pk)
+        self.assertNotIn("_metadata_upgrade_from", element.__dict__)
+        self.assertEqual(element.element_metadata, {"colour": "re"})
+
+    def test_upgrade_with_loaded_type(self):
+        element = MetadataTestVersionedElement.objects.select_related("element_type").get(pk=self.element.pk)
+        with self.assertNumQueries(2):
+            # The definitions and their changes
+            self.assertEqual(element.element_metadata, {"colour": "red"})
+
+    def test_upgrade_waits_for_the_type(self):
+        element = MetadataTestVersionedElement.objects.get(pk=self.element.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(element.element_metadata, {"color": "red"})
+        self.assertEqual(element.get_formatted_metadata(), {"colour": "red"})
+        self.assertEqual(element.element_metadata, {"colour": "red"})
+
+    async def test_async_upgrade(self):
+        element = await MetadataTestVersionedElement.objects.aget(pk=self.element.pk)
+        self.assertEqual(await element.aget_formatted_metadata(), {"colour": "red"})
+
+        element = await MetadataTestVersionedElement.objects.select_related("element_type").aget(pk=self.element.pk)
+        # Not upgraded in the event loop, the changes could be queried
+        self.assertEqual(element.element_metadata, {"color": "red"})
+        await element.aclean_metadata(full=True)
+        self.assertEqual(element.element_metadata, {"colour": "red"})
+
+
+class FormatMetadataBulkTests(MetadataModelsTestCase):
+    def test_queries(self):
+        link = self.create_definition("link", "ForeignKey", model=ModelGeneralMetaData._meta.label)
+        element_types = [
+            self.create_type(self.create_definition("color", max_length=10), link, name=f"Type {index}")
+            for index in range(2)
+        ]
+        MetadataTestElement.objects.bulk_create(
+            [
+                MetadataTestElement(
+                    element_type=element_types[index % 2], element_metadata={"color": f"c{index}", "link": link.pk}
+                )
+                for index in range(20)
+            ]
+        )
+        elements = list(MetadataTestElement.objects.order_by("pk"))
+
+        # The element types, the definitions of each type and the related definitions
+        with self.assertNumQueries(4):
+            formatted = MetadataTestElement.format_metadata_bulk(elements, get_string=True)
+        self.assertEqual(formatted[3], {"color": "c3", "link": str(link)})
+
+
+class DefinitionCacheTests(MetadataModelsTestCase):
+    def test_nested_builds(self):
+        element_type = self.create_type()
+
+        # A build reads other keys, like the schema reads the definitions
+        def build():
+            return sum(
+                definition_cache.get_or_build(element_type, f"inner:{index}", lambda: 1) for index in range(200)
+            )
+
+        self.assertEqual(definition_cache.get_or_build(element_type, "outer", build), 200)
+
+
+class AsyncDefinitionsTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.element_type = self.create_type(self.create_definition("color", max_length=10))
+        self.schema = self.element_type.get_fields_schema()
+        definition_changed(None)
+
+    def test_definitions_and_schema(self):
+        definitions = async_to_sync(self.element_type.aget_metadata_definitions)()
+        self.assertEqual([definition.field_name for definition in definitions], ["color"])
+
+        # Both come from the definition cache afterwards
+        with self.assertNumQueries(0):
+            async_to_sync(self.element_type.aget_metadata_definitions)()
+            self.assertEqual(async_to_sync(self.element_type.aget_fields_schema)(), self.schema)
+
+
+class MetadataIndexesTests(MetadataModelsTestCase):
+    def test_index_names_follow_the_json_key(self):
+        definition = self.create_definition("count", "IntegerField")
+        definition.searchable = True
+        definition.save()
+        self.create_type(definition)
+
+        self.assertEqual(
+            set(get_metadata_indexes(MetadataTestElement)),
+            {
+                get_index_name(MetadataTestElement, "k", "count"),
+                get_index_name(MetadataTestElement, "c", "count:IntegerField"),
+            },
+        )
+
+        # Stored compact, the key is another expression with another name
+        json_key = get_compact_key(definition.pk)
+        self.assertEqual(
+            set(get_metadata_indexes(MetadataTestCompactElement)),
+            {
+                get_index_name(MetadataTestCompactElement, "k", json_key),
+                get_index_name(MetadataTestCompactElement, "c", f"{json_key}:IntegerField"),
+            },
+        )
+
+
+@override_settings(ROOT_URLCONF="django_model_metadata.urls")
+class AsyncAutocompleteTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.settings(DJANGO_MODEL_METADATA_FK_MODELS=[MetadataTestType._meta.label]):
+            autocomplete_indexes.build()
+        self.addCleanup(autocomplete_indexes.build)
+
+        self.metal = MetadataTestType.objects.create(name="Metal")
+        MetadataTestType.objects.create(name="Wood")
+        self.url = reverse("metadata-async-autocomplete-objects", args=["objects", MetadataTestType._meta.label])
+
+    def login(self, *codenames):
+        user = get_user_model().objects.create_user("viewer")
+        content_type = ContentType.objects.get_for_model(MetadataTestType)
+        for codename in codenames:
+            permission, _ = Permission.objects.get_or_create(
+                codename=codename, content_type=content_type, defaults={"name": codename}
+            )
+            user.user_permissions.add(permission)
+        self.async_client.force_login(user)
+
+    async def test_indexed_choices(self):
+        response = await self.async_client.get(
+            reverse("metadata-async-autocomplete", args=["models"]), {"query": "meta"}
+        )
+        self.assertEqual(response.json()["results"][0]["value"], MetadataTestType._meta.label)
+
+    async def test_objects(self):
+        await sync_to_async(self.login)("view_metadatatesttype")
+        response = await self.async_client.get(self.url, {"query": "me"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"], [{"title": "Metal", "value": self.metal.pk}])
+
+    async def test_objects_permission(self):
+        await sync_to_async(self.login)()
+        response = await self.async_client.get(self.url, {"query": "me"})
+        self.assertEqual(response.status_code, 403)
+
+
+class MaterializedDisplayTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.settings(DJANGO_MODEL_METADATA_FK_MODELS=[MetadataTestTarget._meta.label]):
+            connect_receivers()
+
+        self.target = MetadataTestTarget.objects.create(name="Steel")
+        self.link = self.create_definition("link", "ForeignKey", model=MetadataTestTarget._meta.label)
+        self.color = self.create_definition("color", max_length=10)
+        self.element_type = self.create_type(self.color, self.link)
+        self.element = MetadataTestMaterializedElement.objects.create(
+            element_type=self.element_type, element_metadata={"color": "red", "link": self.target.pk}
+        )
+
+    def get_display(self):
+        return MetadataTestMaterializedElement.objects.values_list("element_metadata_display", flat=True).get()
+
+    def test_display_saved(self):
+        self.assertEqual(self.get_display(), {"color": "red", "link": "Steel"})
+
+    def test_relation_target_changes(self):
+        relation_definitions.get()
+        # Its description did not change, the previous row is read
+        with self.assertNumQueries(2):
+            self.target.save()
+        self.assertIsNotNone(self.get_display())
+
+        self.target.name = "Iron"
+        self.target.save()
+        self.assertIsNone(self.get_display())
+        element = MetadataTestMaterializedElement.objects.get()
+        self.assertEqual(element.get_metadata_display(), {"color": "red", "link": "Iron"})
+
+        MetadataTestMaterializedElement.refresh_metadata_display([element])
+        self.target.delete()
+        self.assertIsNone(self.get_display())
+
+    def test_searchable_relation_uses_the_index(self):
+        self.link.searchable = True
+        self.link.save()
+        elements = MetadataTestMaterializedElement.objects.all()
+        update_search_index(elements)
+        MetadataTestMaterializedElement.refresh_metadata_display(elements)
+
+        self.target.name = "Iron"
+        with CaptureQueriesContext(connection) as context:
+            self.target.save()
+        update = next(
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith(f'UPDATE "{MetadataTestMaterializedElement._meta.db_table}"')
+        )
+        self.assertIn(MetadataSearchIndex._meta.db_table, update)
+        self.assertIsNone(self.get_display())
+
+    def test_definition_and_type_changes(self):
+        self.color.widget_attrs = {"max_length": 20}
+        self.color.save()
+        self.assertIsNone(self.get_display())
+
+        MetadataTestMaterializedElement.refresh_metadata_display(MetadataTestMaterializedElement.objects.all())
+        self.assertEqual(self.get_display(), {"color": "red", "link": "Steel"})
+        self.element_type.metadata.remove(self.color)
+        self.assertIsNone(self.get_display())
+
+
+class FormClassCacheTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.color = self.create_definition("color", max_length=10)
+        self.element_type = self.create_type(self.color)
+
+    def test_form_class_cached_per_type(self):
+        form_class = self.element_type.get_form_class()
+        self.assertEqual(list(form_class.base_fields), ["color"])
+        with self.assertNumQueries(0):
+            self.assertIs(MetadataTestType(pk=self.element_type.pk).get_form_class(), form_class)
+
+    def test_definition_change(self):
+        form_class = self.element_type.get_form_class()
+        self.color.widget_attrs = {"max_length": 20}
+        self.color.save()
+
+        new_form_class = self.element_type.get_form_class()
+        self.assertIsNot(new_form_class, form_class)
+        self.assertEqual(new_form_class.base_fields["color"].max_length, 20)
+
+    def test_metadata_relation_change(self):
+        form_class = self.element_type.get_form_class()
+        count = self.create_definition("count", "IntegerField")
+        self.element_type.metadata.add(count)
+        self.assertEqual(list(self.element_type.get_form_class().base_fields), ["color", "count"])
+
+        # From the definition side
+        form_class = self.element_type.get_form_class()
+        count.metadatatesttype_set.remove(self.element_type)
+        self.assertIsNot(self.element_type.get_form_class(), form_class)
+        self.assertEqual(list(self.element_type.get_form_class().base_fields), ["color"])
+
+
+class SearchIndexTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.color = self.create_definition("color", max_length=10)
+        self.count = self.create_definition("count", "IntegerField")
+        for definition in (self.color, self.count):
+            definition.searchable = True
+            definition.save()
+        self.element_type = self.create_type(self.color, self.count, self.create_definition("note", max_length=10))
+        self.element = MetadataTestElement.objects.create(
+            element_type=self.element_type, element_metadata={"color": "red", "count": 3, "note": "x"}
+        )
+
+    def get_entries(self):
+        return set(
+            MetadataSearchIndex.objects.filter(object_id=self.element.pk).values_list(
+                "metadata__field_name", "value_text", "value_integer"
+            )
+        )
+
+    def test_saved_element_is_indexed(self):
+        self.assertEqual(self.get_entries(), {("color", "red", None), ("count", None, 3)})
+        self.assertEqual(list(MetadataTestElement.objects.filter_metadata(color="red", count__gte=2)), [self.element])
+        self.assertFalse(MetadataTestElement.objects.filter_metadata(count__gt=3).exists())
+
+    def test_changed_element_is_indexed_again(self):
+        element = MetadataTestElement.objects.get()
+        element.element_metadata["count"] = 5
+        element.element_metadata.pop("color")
+        element.save()
+        self.assertEqual(self.get_entries(), {("count", None, 5)})
+
+    def test_deleted_element_is_removed(self):
+        self.element.delete()
+        self.assertFalse(MetadataSearchIndex.objects.exists())
+
+
+class ValidateMetadataBulkTests(MetadataModelsTestCase):
+    def test_errors_by_position(self):
+        target = MetadataTestTarget.objects.create(name="Steel")
+        element_type = self.create_type(
+            self.create_definition("count", "IntegerField"),
+            self.create_definition("link", "ForeignKey", model=MetadataTestTarget._meta.label),
+        )
+        instances = [
+            MetadataTestElement(element_type=element_type, element_metadata={"count": 1, "link": target.pk}),
+            MetadataTestElement(element_type=element_type, element_metadata={"count": "x", "link": target.pk}),
+            MetadataTestElement(element_type=element_type, element_metadata={"count": 2, "link": target.pk + 1}),
+            MetadataTestElement(element_type=element_type),
+        ]
+
+        # The definitions of the type, then the pks of the related model at once
+        with self.assertNumQueries(2):
+            errors = MetadataTestElement.validate_metadata_bulk(instances)
+        self.assertEqual(
+            {index: list(instance_errors) for index, instance_errors in errors.items()}, {1: ["count"], 2: ["link"]}
+        )
+
+
+class CompactStorageTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.color = self.create_definition("color", max_length=10)
+        self.element_type = self.create_type(self.color)
+        self.element = MetadataTestCompactElement.objects.create(
+            element_type=self.element_type, element_metadata={"color": "red", "extra": 1}
+        )
+
+    def get_stored(self):
+        # The model field decodes the compact rows
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT element_metadata FROM {MetadataTestCompactElement._meta.db_table}")
+            return json.loads(cursor.fetchone()[0])
+
+    def test_round_trip(self):
+        # The keys without definition are kept named
+        self.assertEqual(self.get_stored(), {"#": 1, get_compact_key(self.color.pk): "red", "extra": 1})
+        self.assertEqual(self.element.element_metadata, {"color": "red", "extra": 1})
+        element = MetadataTestCompactElement.objects.get()
+        self.assertEqual(element.element_metadata, {"color": "red", "extra": 1})
+
+    def test_rename_keeps_the_values(self):
+        self.color.field_name = "colour"
+        self.color.save()
+        stored = self.get_stored()
+
+        element = MetadataTestCompactElement.objects.get()
+        self.assertEqual(element.element_metadata, {"colour": "red", "extra": 1})
+        element.save()
+        self.assertEqual(self.get_stored(), stored)
+
+    def test_named_rows_are_read(self):
+        MetadataTestCompactElement.objects.update(element_metadata={"color": "blue"})
+        self.assertEqual(MetadataTestCompactElement.objects.get().element_metadata, {"color": "blue"})
+
+    def test_definition_created_by_another_process(self):
+        self.assertEqual(MetadataTestCompactElement.objects.get().element_metadata, {"color": "red", "extra": 1})
+        # Without signal in this process
+        (size,) = ModelGeneralMetaData.objects.bulk_create(
+            [ModelGeneralMetaData(name="Size", field_name="size", meta_type="CharField", widget_attrs={})]
+        )
+        MetadataTestCompactElement.objects.update(element_metadata={"#": 1, get_compact_key(size.pk): "xl"})
+        self.assertEqual(MetadataTestCompactElement.objects.get().element_metadata, {"size": "xl"})
+
+        # An unknown key is looked up once per version
+        MetadataTestCompactElement.objects.update(element_metadata={"#": 1, get_compact_key(size.pk + 1): "x"})
+        MetadataTestCompactElement.objects.get()
+        with self.assertNumQueries(1):
+            MetadataTestCompactElement.objects.get()
+
+    def test_definition_renamed_by_another_process(self):
+        self.assertEqual(MetadataTestCompactElement.objects.get().element_metadata, {"color": "red", "extra": 1})
+        ModelGeneralMetaData.objects.filter(pk=self.color.pk).update(field_name="colour")
+        # The other process bumps the global version
+        definition_cache.bump()
+        self.assertEqual(MetadataTestCompactElement.objects.get().element_metadata, {"colour": "red", "extra": 1})
+
+
+class ChangedMetadataKeysTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.count = self.create_definition("count", "IntegerField")
+        self.count.searchable = True
+        self.count.save()
+        self.note = self.create_definition("note", max_length=3)
+        self.element_type = self.create_type(self.count, self.note, self.create_definition("extra", "JSONField"))
+        MetadataTestElement.objects.create(
+            element_type=self.element_type, element_metadata={"count": 1, "note": "abc", "extra": {"a": [1]}}
+        )
+        self.element = MetadataTestElement.objects.select_related("element_type").get()
+
+    def test_changed_keys(self):
+        self.assertIsNone(MetadataTestElement(element_type=self.element_type).get_changed_metadata_keys())
+        self.assertEqual(self.element.get_changed_metadata_keys(), set())
+
+        self.element.element_metadata["count"] = True
+        self.element.element_metadata["extra"]["a"].append(2)
+        self.assertEqual(self.element.get_changed_metadata_keys(), {"count", "extra"})
+
+    def test_type_or_definitions_change(self):
+        self.element.element_type = self.create_type(self.count, name="Other")
+        self.assertIsNone(self.element.get_changed_metadata_keys())
+
+        element = MetadataTestElement.objects.get()
+        self.note.widget_attrs = {"max_length": 2}
+        self.note.save()
+        self.assertIsNone(element.get_changed_metadata_keys())
+
+    def test_only_changed_keys_are_validated(self):
+        MetadataTestElement.objects.update(element_metadata={"count": 1, "note": "too long"})
+        element = MetadataTestElement.objects.get()
+        element.element_metadata["count"] = 2
+        element.full_clean()
+
+        element.element_metadata["note"] = "still too long"
+        with self.assertRaises(ValidationError):
+            element.full_clean()
+
+    def test_unsearchable_change_skips_the_index(self):
+        self.element.element_type.get_metadata_definitions()
+        self.element.element_metadata["note"] = "xyz"
+        with self.assertNumQueries(1):
+            self.element.save(update_fields=["element_metadata"])
+        self.assertEqual(self.element.get_changed_metadata_keys(), set())
+
+
+@override_settings(ROOT_URLCONF="django_model_metadata.urls")
+class SchemaViewTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.color = self.create_definition("color", max_length=10)
+        self.element_type = self.create_type(self.color)
+        self.url = reverse("metadata-schema", args=[MetadataTestType._meta.label, self.element_type.pk])
+
+        self.user = get_user_model().objects.create_user("viewer")
+        self.user.user_permissions.add(
+            Permission.objects.get_or_create(
+                codename="view_metadatatesttype",
+                content_type=ContentType.objects.get_for_model(MetadataTestType),
+                defaults={"name": "Can view"},
+            )[0]
+        )
+        self.client.force_login(self.user)
+
+    def test_schema_and_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), self.element_type.get_fields_schema())
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        self.color.widget_attrs = {"max_length": 20}
+        self.color.save()
+        response = self.client.get(self.url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_permission_and_missing_type(self):
+        self.client.force_login(get_user_model().objects.create_user("other"))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.client.force_login(self.user)
+        # The probed pks get no version in the shared cache
+        version_key = definition_cache.get_version_key(MetadataTestType._meta.label_lower, self.element_type.pk + 1)
+        definition_cache.shared.delete(version_key)
+        url = reverse("metadata-schema", args=[MetadataTestType._meta.label, self.element_type.pk + 1])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertIsNone(definition_cache.shared.get(version_key))
+        url = reverse("metadata-schema", args=[MetadataTestElement._meta.label, self.element_type.pk])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "metadata": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "dmm_test_cache"},
+    },
+    DJANGO_MODEL_METADATA_CACHE="metadata",
+)
+class DatabaseCacheTests(MetadataModelsTestCase):
+    """
+    The async API must not query a database cache from the event loop
+    """
+
+    def setUp(self):
+        call_command("createcachetable", verbosity=0)
+        super().setUp()
+        self.element_type = self.create_type(self.create_definition("count", "IntegerField"))
+        MetadataTestElement.objects.create(element_type=self.element_type, element_metadata={"count": 1})
+
+    async def get_element(self):
+        element = await MetadataTestElement.objects.select_related("element_type").aget()
+        # The versions are read again from the shared cache
+        definition_cache.clear()
+        return element
+
+    async def test_async_changed_keys(self):
+        element = await self.get_element()
+        self.assertIsNone(await element.aclean_metadata())
+
+    async def test_async_full_validation(self):
+        element = await self.get_element()
+        element.element_metadata["count"] = "abc"
+        with self.assertRaises(ValidationError):
+            await element.aclean_metadata(full=True)
+
+        # The validator is compiled once for the version of the type
+        definition_cache.clear()
+        self.assertIs(
+            await self.element_type.aget_metadata_validator(), await self.element_type.aget_metadata_validator()
+        )
+
+
+class DefinitionCacheCheckTests(TestCase):
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_process_local_cache(self):
+        self.assertEqual([warning.id for warning in check_definition_cache()], ["django_model_metadata.W001"])
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "shared": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "dmm_test_cache"},
+        },
+        DJANGO_MODEL_METADATA_CACHE="shared",
+    )
+    def test_shared_cache(self):
+        self.assertEqual(check_definition_cache(), [])
+
+
+class MetadataTestElementSerializer(MetadataElementSerializer):
+    class Meta:
+        model = MetadataTestElement
+        fields = ["id", "element_type", "element_metadata"]
+
+
+class MetadataElementSerializerTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.target = MetadataTestTarget.objects.create(name="Steel")
+        self.element_type = self.create_type(
+            self.create_definition("count", "IntegerField"),
+            self.create_definition("color", max_length=10, required=False),
+            self.create_definition("link", "ForeignKey", model=MetadataTestTarget._meta.label, required=False),
+        )
+
+    def test_invalid_metadata(self):
+        serializer = MetadataTestElementSerializer(
+            data={"element_type": self.element_type.pk, "element_metadata": {"count": "notanumber", "color": "x" * 50}}
+        )
+        self.assertFalse(serializer.is_valid())
+        errors = serializer.errors["element_metadata"]
+        self.assertEqual(set(errors), {"count", "color"})
+        self.assertEqual(errors["color"][0].code, "max_length")
+
+    def test_valid_metadata(self):
+        serializer = MetadataTestElementSerializer(
+            data={"element_type": self.element_type.pk, "element_metadata": {"count": 3, "link": self.target.pk}}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        element = serializer.save()
+        self.assertEqual(MetadataTestElement.objects.get().element_metadata, {"count": 3, "link": self.target.pk})
+        self.assertEqual(
+            MetadataTestElementSerializer(element).data["element_metadata"], {"count": "3", "link": "Steel"}
+        )
+
+    def test_update_validates_the_changed_keys(self):
+        element = MetadataTestElement.objects.create(
+            element_type=self.element_type, element_metadata={"count": 1, "color": "x" * 50}
+        )
+        element = MetadataTestElement.objects.get(pk=element.pk)
+
+        serializer = MetadataTestElementSerializer(
+            element, data={"element_metadata": {"count": 2, "color": "x" * 50}}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer = MetadataTestElementSerializer(element, data={"element_metadata": {"count": "x"}}, partial=True)
+        self.assertFalse(serializer.is_valid())
+        # The instance is not changed by the validation
+        self.assertEqual(element.element_metadata, {"count": 1, "color": "x" * 50})
+
+
+class ExportImportTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.target = MetadataTestTarget.objects.create(name="Steel")
+        self.element_type = self.create_type(
+            self.create_definition("count", "IntegerField"),
+            self.create_definition("weight", "DecimalField", max_digits=8, decimal_places=2),
+            self.create_definition("link", "ForeignKey", model=MetadataTestTarget._meta.label),
+        )
+        self.metadata = [{"count": 1200 + index, "weight": "12.50", "link": self.target.pk} for index in range(3)]
+        MetadataTestElement.objects.bulk_create(
+            [
+                MetadataTestElement(element_type=self.element_type, element_metadata=element_metadata)
+                for element_metadata in self.metadata
+            ]
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def export(self, file_format, *args):
+        path = os.path.join(self.directory, f"export.{file_format}")
+        call_command(
+            "export_metadata",
+            MetadataTestElement._meta.label,
+            "--format",
+            file_format,
+            "--output",
+            path,
+            *args,
+            stderr=io.StringIO(),
+        )
+        return path
+
+    def import_(self, path, *args):
+        call_command(
+            "import_metadata",
+            MetadataTestElement._meta.label,
+            path,
+            "--element-type",
+            self.element_type.pk,
+            *args,
+            stdout=io.StringIO(),
+        )
+
+    def get_metadata(self):
+        return list(MetadataTestElement.objects.order_by("pk").values_list("element_metadata", flat=True))
+
+    def test_ndjson_round_trip(self):
+        path = self.export("ndjson")
+        with open(path) as export_file:
+            self.assertEqual(json.loads(export_file.readline())["link"], self.target.pk)
+
+        MetadataTestElement.objects.all().delete()
+        self.import_(path)
+        self.assertEqual(self.get_metadata(), self.metadata)
+
+    def test_csv_round_trip(self):
+        path = self.export("csv")
+        MetadataTestElement.objects.all().delete()
+        self.import_(path)
+        self.assertEqual(
+            self.get_metadata(), [{key: str(value) for key, value in row.items()} for row in self.metadata]
+        )
+
+    def test_formatted_export(self):
+        with open(self.export("ndjson", "--formatted")) as export_file:
+            row = json.loads(export_file.readline())
+        self.assertEqual((row["count"], row["link"]), ("1,200", "Steel"))
+
+
+class QuantityMetaType(IntegerMetaType):
+    name = "QuantityField"
+    label = "Quantity"
+
+
+class TargetMetaType(RelationMetaType):
+    name = "TargetField"
+    label = "Target"
+
+
+@override_settings(
+    DJANGO_MODEL_METADATA_META_TYPES=[
+        "django_model_metadata.tests.BooleanMetaType",
+        "django_model_metadata.tests.QuantityMetaType",
+        "django_model_metadata.tests.TargetMetaType",
+    ]
+)
+class RegisteredMetaTypeTests(MetadataModelsTestCase):
+    def create_searchable(self, field_name, meta_type, **widget_attrs):
+        definition = self.create_definition(field_name, meta_type, **widget_attrs)
+        definition.searchable = True
+        definition.save()
+        return definition
+
+    def test_search_index(self):
+        element_type = self.create_type(
+            self.create_searchable("active", "BooleanField"), self.create_searchable("quantity", "QuantityField")
+        )
+        element = MetadataTestElement.objects.create(
+            element_type=element_type, element_metadata={"active": True, "quantity": 3}
+        )
+        self.assertEqual(
+            set(MetadataSearchIndex.objects.values_list("metadata__field_name", "value_text", "value_integer")),
+            {("active", "True", None), ("quantity", None, 3)},
+        )
+        self.assertEqual(list(MetadataTestElement.objects.filter_metadata(quantity__gte=2)), [element])
+
+    def test_cast_indexes(self):
+        self.create_type(self.create_searchable("active", "BooleanField"), self.create_searchable("day", "DateField"))
+        self.create_type(self.create_searchable("quantity", "QuantityField"), name="Other")
+        self.assertEqual(
+            set(get_metadata_indexes(MetadataTestElement)),
+            {
+                get_index_name(MetadataTestElement, "k", "active"),
+                get_index_name(MetadataTestElement, "k", "day"),
+                get_index_name(MetadataTestElement, "k", "quantity"),
+                get_index_name(MetadataTestElement, "c", "quantity:QuantityField"),
+            },
+        )
+
+    def test_relation_display(self):
+        with self.settings(DJANGO_MODEL_METADATA_FK_MODELS=[MetadataTestTarget._meta.label]):
+            connect_receivers()
+        target = MetadataTestTarget.objects.create(name="Steel")
+        element_type = self.create_type(
+            self.create_definition("target", "TargetField", model=MetadataTestTarget._meta.label)
+        )
+        MetadataTestMaterializedElement.objects.create(
+            element_type=element_type, element_metadata={"target": target.pk}
+        )
+        get_display = MetadataTestMaterializedElement.objects.values_list("element_metadata_display", flat=True).get
+        self.assertEqual(get_display(), {"target": "Steel"})
+
+        target.name = "Iron"
+        target.save()
+        self.assertIsNone(get_display())
+
+
+class MetadataAggregationTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.weight = self.create_definition("weight", "DecimalField", max_digits=8, decimal_places=2)
+        self.element_type = self.create_type(
+            self.weight,
+            self.create_definition("count", "IntegerField"),
+            self.create_definition("color", max_length=10),
+        )
+        self.rows = [("1.25", 1, "red"), ("2.50", 2, "red"), ("3.00", 3, "blue")]
+        for model in (MetadataTestElement, MetadataTestCompactElement):
+            for weight, count, color in self.rows:
+                model.objects.create(
+                    element_type=self.element_type,
+                    element_metadata={"weight": weight, "count": count, "color": color},
+                )
+
+    def test_annotate_decimal(self):
+        queryset = MetadataTestElement.objects.annotate_metadata("weight")
+        # Cast with the digits of the definition
+        output_field = queryset.query.annotations["weight"].output_field
+        self.assertEqual((output_field.max_digits, output_field.decimal_places), (8, 2))
+        self.assertEqual(
+            list(queryset.order_by("pk").values_list("weight", flat=True)),
+            [Decimal("1.25"), Decimal("2.50"), Decimal("3.00")],
+        )
+        self.assertEqual(queryset.filter(weight__gte=2).count(), 2)
+
+    def test_aggregate(self):
+        totals = MetadataTestElement.objects.aggregate_metadata(Sum("count"), average=Avg("weight"))
+        self.assertEqual(totals["count__sum"], 6)
+        self.assertAlmostEqual(float(totals["average"]), 2.25)
+
+        annotated = MetadataTestElement.objects.values("element_type").annotate_metadata(total=Sum("count"))
+        self.assertEqual(list(annotated), [{"element_type": self.element_type.pk, "total": 6}])
+
+    def test_values_group_by(self):
+        queryset = MetadataTestElement.objects.values_metadata("color").annotate_metadata(total=Sum("count"))
+        self.assertEqual(
+            list(queryset.order_by("color")), [{"color": "blue", "total": 3}, {"color": "red", "total": 3}]
+        )
+
+    def test_compact_keys(self):
+        queryset = MetadataTestCompactElement.objects.annotate_metadata("weight", "count")
+        self.assertEqual(
+            list(queryset.order_by("pk").values_list("weight", "count")),
+            [(Decimal(weight), count) for weight, count, color in self.rows],
+        )
+        self.assertEqual(MetadataTestCompactElement.objects.aggregate_metadata(Sum("count"))["count__sum"], 6)
+
+    def test_unknown_metadata(self):
+        with self.assertRaises(FieldError):
+            MetadataTestElement.objects.annotate_metadata("unknown")
+
+
+class ImportMetadataTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.element_type = self.create_type(
+            self.create_definition("count", "IntegerField"),
+            self.create_definition("color", max_length=10, required=False),
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "records.ndjson")
+
+    def write_records(self, *records):
+        with open(self.path, "w") as records_file:
+            for record in records:
+                records_file.write(json.dumps(record) + "\n")
+
+    def import_(self, *args):
+        stdout = io.StringIO()
+        call_command(
+            "import_metadata",
+            MetadataTestElement._meta.label,
+            self.path,
+            "--element-type",
+            self.element_type.pk,
+            *args,
+            stdout=stdout,
+        )
+        return stdout.getvalue()
+
+    def get_metadata(self):
+        return list(MetadataTestElement.objects.order_by("pk").values_list("element_metadata", flat=True))
+
+    def test_invalid_records(self):
+        self.write_records({"count": 1}, {"count": "abc"}, {"count": 3, "color": "x" * 20}, {"count": 4})
+        errors_path = f"{self.path}.errors"
+        output = self.import_("--chunk-size", "2", "--errors", errors_path)
+
+        # The valid records of every chunk are written
+        self.assertEqual(self.get_metadata(), [{"count": 1}, {"count": 4}])
+        self.assertIn("2 created, 0 updated, 2 invalid", output)
+        with open(errors_path) as errors_file:
+            errors = [json.loads(line) for line in errors_file]
+        self.assertEqual(
+            [(error["record"], list(error["errors"])) for error in errors], [(2, ["count"]), (3, ["color"])]
+        )
+
+    def test_key_updates(self):
+        element = MetadataTestElement.objects.create(
+            element_type=self.element_type, element_metadata={"count": 1, "color": "red"}
+        )
+        self.write_records({"id": element.pk, "count": 5}, {"count": 6})
+        self.import_("--key", "id")
+
+        # The imported keys are merged into the stored metadata
+        self.assertEqual(self.get_metadata(), [{"count": 5, "color": "red"}, {"count": 6}])
+
+    def test_resume(self):
+        self.write_records({"count": 1}, {"count": 2}, {"count": 3})
+        self.import_("--chunk-size", "2")
+        with open(f"{self.path}.checkpoint.json") as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)["records"], 3)
+
+        # Interrupted after the first chunk
+        MetadataTestElement.objects.filter(element_metadata__count=3).delete()
+        with open(f"{self.path}.checkpoint.json", "w") as checkpoint_file:
+            json.dump({"source": os.path.abspath(self.path), "records": 2}, checkpoint_file)
+        self.assertIn("Resuming after 2 records", self.import_("--resume"))
+        self.assertEqual(self.get_metadata(), [{"count": 1}, {"count": 2}, {"count": 3}])
+
+        with open(f"{self.path}.checkpoint.json", "w") as checkpoint_file:
+            json.dump({"source": "other.ndjson", "records": 2}, checkpoint_file)
+        with self.assertRaises(CommandError):
+            self.import_("--resume")
+
+
+class TargetRenamer:
+    @instrumented("rename")
+    def rename(self, pks):
+        return MetadataTestTarget.objects.filter(pk__in=pks).update(name="Renamed")
+
+
+@override_settings(DJANGO_MODEL_METADATA_INSTRUMENTATION=True, DJANGO_MODEL_METADATA_INSTRUMENTATION_SINKS=[])
+class InstrumentationTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.measures = []
+        metadata_operation_finished.connect(self.record)
+        self.addCleanup(metadata_operation_finished.disconnect, self.record)
+        self.element_type = self.create_type(self.create_definition("color", max_length=10))
+
+    def record(self, sender, **kwargs):
+        self.measures.append(kwargs)
+
+    def test_payload_and_cache_counters(self):
+        self.element_type.get_form_class()
+        self.element_type.get_form_class()
+
+        # The form fields built by the first call are nested operations
+        self.assertEqual(
+            [measure["operation"] for measure in self.measures],
+            ["get_form_field_object", "get_form_class", "get_form_class"],
+        )
+        first, second = self.measures[1:]
+        self.assertEqual((first["operation"], first["model"]), ("get_form_class", MetadataTestType._meta.label))
+        self.assertGreater(first["duration"], 0)
+        # The definitions are queried and cached once
+        self.assertEqual((first["queries"], first["cache_hits"]), (1, 0))
+        self.assertGreater(first["cache_misses"], 0)
+        self.assertEqual((second["queries"], second["cache_hits"], second["cache_misses"]), (0, 1, 0))
+
+    def test_rows(self):
+        pks = [MetadataTestTarget.objects.create(name=name).pk for name in ("Steel", "Iron")]
+        self.assertEqual(TargetRenamer().rename(pks), 2)
+        (measure,) = self.measures
+        self.assertEqual((measure["model"], measure["queries"], measure["rows"]), ("TargetRenamer", 1, 2))
+
+    def test_nested_operations(self):
+        element = MetadataTestElement.objects.create(element_type=self.element_type, element_metadata={"color": "red"})
+        element = MetadataTestElement.objects.get(pk=element.pk)
+        self.measures.clear()
+        element.get_formatted_metadata()
+
+        inner, outer = self.measures
+        self.assertEqual((inner["operation"], outer["operation"]), ("format_metadata_bulk", "get_formatted_metadata"))
+        # The queries of the inner operation are counted by both
+        self.assertGreater(inner["queries"], 0)
+        self.assertEqual(outer["queries"], inner["queries"])
+
+    @override_settings(DJANGO_MODEL_METADATA_INSTRUMENTATION=False)
+    def test_disabled(self):
+        self.element_type.get_form_class()
+        self.assertEqual(self.measures, [])
+
+
+class InstrumentationSinksTests(TestCase):
+    measure = {
+        "operation": "clean",
+        "model": "shop.Material",
+        "duration": 0.5,
+        "queries": 2,
+        "rows": 3,
+        "cache_hits": 1,
+        "cache_misses": 0,
+    }
+
+    def test_prometheus_render(self):
+        sink = PrometheusSink()
+        sink.record(**self.measure)
+        sink.record(**self.measure)
+
+        lines = sink.render().splitlines()
+        self.assertIn("# TYPE django_model_metadata_calls_total counter", lines)
+        self.assertIn('django_model_metadata_calls_total{operation="clean",model="shop.Material"} 2', lines)
+        self.assertIn(
+            'django_model_metadata_duration_seconds_total{operation="clean",model="shop.Material"} 1.0', lines
+        )
+        self.assertIn('django_model_metadata_queries_total{operation="clean",model="shop.Material"} 4', lines)
+
+    def test_statsd_lines(self):
+        daemon = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(daemon.close)
+        daemon.bind(("127.0.0.1", 0))
+        daemon.settimeout(5)
+
+        sink = StatsdSink(host="127.0.0.1", port=daemon.getsockname()[1], prefix="dmm")
+        self.addCleanup(sink.socket.close)
+        sink.record(**self.measure)
+        self.assertEqual(
+            daemon.recv(4096).decode().splitlines(),
+            [
+                "dmm.clean.duration:500.000|ms",
+                "dmm.clean.calls:1|c",
+                "dmm.clean.queries:2|c",
+                "dmm.clean.rows:3|c",
+                "dmm.clean.cache_hits:1|c",
+                "dmm.clean.cache_misses:0|c",
+            ],
+        )
+
+
+class WithMetadataDefinitionsTests(MetadataModelsTestCase):
+    def test_prefetched_definitions(self):
+        for name in ("Metal", "Wood"):
+            element_type = self.create_type(
+                self.create_definition("color", max_length=10),
+                self.create_definition("count", "IntegerField"),
+                name=name,
+            )
+            MetadataTestElement.objects.create(
+                element_type=element_type, element_metadata={"color": "red", "count": 1}
+            )
+
+        # The element types, then their definitions
+        with self.assertNumQueries(2):
+            elements = list(MetadataTestElement.objects.with_metadata_definitions())
+        # Nothing comes from the caches
+        definition_changed(None)
+
+        with self.assertNumQueries(0):
+            for element in elements:
+                self.assertEqual(list(element.get_metadata_form_class().base_fields), ["color", "count"])
+                self.assertFalse(element.get_metadata_validator().validate(element.element_metadata))
+            formatted = MetadataTestElement.format_metadata_bulk(elements)
+        self.assertEqual(formatted, [{"color": "red", "count": "1"}] * 2)
+
+
+@override_settings(ROOT_URLCONF="django_model_metadata.urls")
+class RelationWidgetTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.settings(DJANGO_MODEL_METADATA_FK_MODELS=[MetadataTestTarget._meta.label]):
+            autocomplete_indexes.build()
+        self.addCleanup(autocomplete_indexes.build)
+
+        self.targets = [MetadataTestTarget.objects.create(name=name) for name in ("Steel", "Iron", "Wood")]
+        self.form_class = build_metadata_form_class(
+            [self.create_definition("link", "ForeignKey", model=MetadataTestTarget._meta.label)]
+        )
+        self.url = reverse("metadata-autocomplete-objects", args=["objects", MetadataTestTarget._meta.label])
+
+    def test_render_fetches_the_selected_option(self):
+        with self.assertNumQueries(0):
+            html = str(self.form_class()["link"])
+        self.assertIn(f'data-autocomplete-url="{self.url}"', html)
+
+        # The bound form is cleaned first, its errors are rendered with the field
+        iron = self.targets[1]
+        form = self.form_class({"link": iron.pk})
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(1):
+            html = str(form["link"])
+        self.assertIn(f'<option value="{iron.pk}" selected>Iron</option>', html)
+        self.assertNotIn("Steel", html)
+        self.assertNotIn("Wood", html)
+
+    def test_clean_looks_up_the_pk(self):
+        with self.assertNumQueries(1):
+            form = self.form_class({"link": self.targets[0].pk})
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data["link"], self.targets[0])
+        self.assertIn("link", self.form_class({"link": self.targets[-1].pk + 1}).errors)
+
+    def login(self, *codenames):
+        user = get_user_model().objects.create_user(f"viewer-{len(codenames)}")
+        content_type = ContentType.objects.get_for_model(MetadataTestTarget)
+        for codename in codenames:
+            permission, _ = Permission.objects.get_or_create(
+                codename=codename, content_type=content_type, defaults={"name": codename}
+            )
+            user.user_permissions.add(permission)
+        self.client.force_login(user)
+
+    def test_objects_view_pages(self):
+        self.login("view_metadatatesttarget")
+        response = self.client.get(self.url, {"limit": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "results": [
+                    {"title": "Steel", "value": self.targets[0].pk},
+                    {"title": "Iron", "value": self.targets[1].pk},
+                ],
+                "page": 1,
+                "has_more": True,
+            },
+        )
+        self.assertIn("private", response["Cache-Control"])
+
+        response = self.client.get(self.url, {"limit": 2, "page": 2})
+        self.assertEqual(response.json()["results"], [{"title": "Wood", "value": self.targets[2].pk}])
+        self.assertFalse(response.json()["has_more"])
+
+        response = self.client.get(self.url, {"query": "ir"})
+        self.assertEqual(response.json()["results"], [{"title": "Iron", "value": self.targets[1].pk}])
+
+    def test_objects_view_permission(self):
+        self.login()
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        # Only the relation models are searched
+        self.login("view_metadatatesttarget")
+        url = reverse("metadata-autocomplete-objects", args=["objects", MetadataTestElement._meta.label])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(ROOT_URLCONF="django_model_metadata.urls")
+class AutocompleteIndexViewTests(MetadataModelsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("metadata-autocomplete", args=["on_delete"])
+
+    def test_pages(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {"limit": 3})
+        self.assertEqual(
+            response.json(),
+            {
+                "results": [
+                    {"title": "Cascade", "value": "CASCADE"},
+                    {"title": "Do Nothing", "value": "DO_NOTHING"},
+                    {"title": "Set Null", "value": "SET_NULL"},
+                ],
+                "page": 1,
+                "count": 4,
+                "has_more": True,
+            },
+        )
+
+        response = self.client.get(self.url, {"limit": 3, "page": 2})
+        self.assertEqual(response.json()["results"], [{"title": "Protect", "value": "PROTECT"}])
+        self.assertFalse(response.json()["has_more"])
+
+        response = self.client.get(self.url, {"query": "set"})
+        self.assertEqual(response.json()["results"], [{"title": "Set Null", "value": "SET_NULL"}])
+        self.assertEqual(response.json()["count"], 1)
+
+        self.assertEqual(self.client.get(reverse("metadata-autocomplete", args=["unknown"])).json(), {"results": []})
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url, {"query": "set"})
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(self.url, {"query": "SET "}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Another page, or another query, has another tag
+        response = self.client.get(self.url, {"query": "set", "page": 2}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.client.get(self.url, {"query": "do"}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cache_control(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["Cache-Control"], "public, max-age=300")
+
+        with self.settings(DJANGO_MODEL_METADATA_AUTOCOMPLETE_MAX_AGE=60):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
@@ -1,6 +1,23 @@
 from django.urls import path
-from .views import MetadataElementsJsonView
+from .views import AsyncMetadataElementsJsonView, MetadataElementsJsonView, MetadataSchemaJsonView
 
 urlpatterns = [
-    path("metadata/autocomplete/<str:el_type>/", MetadataElementsJsonView.as_view(), name="metadata-autocomplete")
+    path("metadata/autocomplete/<str:el_type>/", MetadataElementsJsonView.as_view(), name="metadata-autocomplete"),
+    path(
+        "metadata/autocomplete/<str:el_type>/<str:model_label>/",
+        MetadataElementsJsonView.as_view(),
+        name="metadata-autocomplete-objects",
+    ),
+    # The same autocomplete for the ASGI deployments
+    path(
+        "metadata/async/autocomplete/<str:el_type>/",
+        AsyncMetadataElementsJsonView.as_view(),
+        name="metadata-async-autocomplete",
+    ),
+    path(
+        "metadata/async/autocomplete/<str:el_type>/<str:model_label>/",
+        AsyncMetadataElementsJsonView.as_view(),
+        name="metadata-async-autocomplete-objects",
+    ),
+    path("metadata/schema/<str:model_label>/<str:pk>/", MetadataSchemaJsonView.as_view(), name="metadata-schema"),
 ]
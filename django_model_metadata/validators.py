@@ -0,0 +1,244 @@
+"""
+Compiled metadata validators
+The definitions of an element type are turned once into plain python checks,
+so validating ``element_metadata`` does not build a form for every instance.
+The values the checks can not accept quickly go through the ``clean()`` of the form field
+built from the definition : the errors are the ones of the metadata form.
+"""
+
+import datetime
+import re
+from collections import defaultdict
+from decimal import Decimal, DecimalException
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.forms.utils import ErrorDict, ErrorList
+
+COMPILED = "compiled"
+FORM = "form"
+
+ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def compile_char_checker(field):
+    """The checker of a CharField, inlining the length checks of the field"""
+    max_length, min_length = field.max_length, field.min_length
+    if len(field.validators) > int(max_length is not None) + int(min_length is not None) + 1:
+        return compile_field_checker(field)
+
+    def check(value, known_pks=None):
+        if isinstance(value, str) and "\x00" not in value:
+            length = len(value.strip() if field.strip else value)
+            if (
+                length
+                and (max_length is None or length <= max_length)
+                and (min_length is None or length >= min_length)
+            ):
+                return
+        field.clean(value)
+
+    return check
+
+
+def compile_integer_checker(field):
+    """The checker of an IntegerField, skipping the cleaning of the ints"""
+    if field.validators or field.localize:
+        return compile_field_checker(field)
+
+    def check(value, known_pks=None):
+        if type(value) is not int:
+            field.clean(value)
+
+    return check
+
+
+def compile_decimal_checker(field):
+    """The checker of a DecimalField, inlining the digits checks of the field"""
+    max_digits, decimal_places = field.max_digits, field.decimal_places
+    if len(field.validators) > 1 or field.localize or max_digits is None or decimal_places is None:
+        return compile_field_checker(field)
+
+    max_whole_digits = max_digits - decimal_places
+
+    def check(value, known_pks=None):
+        if isinstance(value, (int, str, Decimal)) and not isinstance(value, bool):
+            try:
+                number = Decimal(str(value))
+            except DecimalException:
+                number = None
+
+            if number is not None and number.is_finite():
+                digit_tuple, exponent = number.as_tuple()[1:]
+                decimals = max(-exponent, 0)
+                whole_digits = max(len(digit_tuple) + exponent, 0)
+                if decimals <= decimal_places and whole_digits <= max_whole_digits:
+                    return
+        field.clean(value)
+
+    return check
+
+
+def compile_date_checker(field):
+    """The checker of a DateField, skipping the cleaning of the ISO dates"""
+    if field.validators:
+        return compile_field_checker(field)
+
+    def check(value, known_pks=None):
+        if isinstance(value, str) and ISO_DATE_RE.match(value):
+            try:
+                datetime.date.fromisoformat(value)
+                return
+            except ValueError:
+                pass
+        field.clean(value)
+
+    return check
+
+
+def compile_choice_checker(field):
+    """The checker of a ChoiceField, a lookup in the set of the valid values"""
+    if field.validators:
+        return compile_field_checker(field)
+
+    valid_values = set()
+    for key, label in field.choices:
+        if isinstance(label, (list, tuple)):
+            valid_values.update(str(group_key) for group_key, group_label in label)
+        else:
+            valid_values.add(str(key))
+
+    def check(value, known_pks=None):
+        if value not in field.empty_values and str(value) in valid_values:
+            return
+        field.clean(value)
+
+    return check
+
+
+class RelationChecker:
+    """
+    Checks that a relation metadata points to an existing row with a single pk lookup,
+    or against the pks already fetched in bulk (``known_pks``)
+    """
+
+    def __init__(self, field, model):
+        self.field = field
+        self.model = model
+        self.key = field.to_field_name or "pk"
+        self.key_field = model._meta.pk if self.key == "pk" else model._meta.get_field(self.key)
+
+    def get_pk(self, value):
+        if value in self.field.empty_values:
+            return None
+        if isinstance(value, self.model):
+            value = getattr(value, self.key)
+        try:
+            return self.key_field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+
+    def __call__(self, value, known_pks=None):
+        if value in self.field.empty_values:
+            self.field.clean(value)
+            return
+
+        pk = self.get_pk(value)
+        if pk is not None:
+            if known_pks is not None and self.key == "pk" and self.model in known_pks:
+                exists = pk in known_pks[self.model]
+            else:
+                exists = self.field.queryset.filter(**{self.key: pk}).exists()
+            if exists:
+                return
+
+        raise ValidationError(
+            self.field.error_messages["invalid_choice"],
+            code="invalid_choice",
+            params={"value": value},
+        )
+
+
+def get_existing_pks(model, pks):
+    """
+    Returns the pks of ``pks`` existing in the table of ``model``,
+    in batches fitting the database parameters limit
+    """
+    pks = list(pks)
+    manager = model._default_manager
+    batch_size = max(connections[manager.db].ops.bulk_batch_size(["pk"], pks), 1)
+
+    existing = set()
+    for start in range(0, len(pks), batch_size):
+        existing.update(manager.filter(pk__in=pks[start : start + batch_size]).values_list("pk", flat=True))
+    return existing
+
+
+async def aget_existing_pks(model, pks):
+    """The pks of the model found in the database, queried in batches"""
+    pks = list(pks)
+    manager = model._default_manager
+    batch_size = max(connections[manager.db].ops.bulk_batch_size(["pk"], pks), 1)
+
+    existing = set()
+    for start in range(0, len(pks), batch_size):
+        async for pk in manager.filter(pk__in=pks[start : start + batch_size]).values_list("pk", flat=True):
+            existing.add(pk)
+    return existing
+
+
+def compile_field_checker(field):
+    """The default checker, cleaning the value with the form field"""
+
+    def check(value, known_pks=None):
+        field.clean(value)
+
+    return check
+
+
+class MetadataValidator:
+    """The compiled validator of a set of metadata definitions"""
+
+    def __init__(self, definitions):
+        self.checkers = {}
+        self.relations = {}
+
+        for definition in definitions:
+            field_name = definition.get_form_field_name()
+            field = definition.get_form_field_object()
+            checker = definition.get_meta_type().get_checker(field, definition)
+
+            # Like the form fields, a repeated field name replaces the previous one
+            if isinstance(checker, RelationChecker):
+                self.relations[field_name] = checker
+            else:
+                self.relations.pop(field_name, None)
+            self.checkers[field_name] = checker
+
+    def get_relation_pks(self, data, fields=None):
+        """Returns the pks referenced by the relation metadata of ``data`` grouped by model"""
+        relation_pks = defaultdict(set)
+        for field_name, checker in self.relations.items():
+            if checker.key != "pk" or (fields is not None and field_name not in fields):
+                continue
+            pk = checker.get_pk(data.get(field_name))
+            if pk is not None:
+                relation_pks[checker.model].add(pk)
+        return relation_pks
+
+    def validate(self, data, fields=None, known_pks=None):
+        """
+        Validates ``data`` and returns the errors like ``form.errors``.
+        ``fields`` limits the validation to some field names, ``known_pks`` holds the existing pks by model.
+        """
+        errors = ErrorDict()
+        for field_name, checker in self.checkers.items():
+            if fields is not None and field_name not in fields:
+                continue
+
+            try:
+                checker(data.get(field_name), known_pks)
+            except ValidationError as e:
+                errors[field_name] = ErrorList(e.error_list)
+
+        return errors
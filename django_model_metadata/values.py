@@ -0,0 +1,189 @@
+"""
+Typed read only access to the metadata of an element
+``instance.metadata_values.weight`` decodes the stored value to its python type (``Decimal``, ``date``, related instance...)
+with the decoders of the element type, on first access and once. The other keys are not decoded nor copied.
+"""
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal, DecimalException
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+MISSING = object()
+
+
+def decode_integer(value):
+    """The int of a stored integer value, the value itself if it is not one"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    try:
+        number = Decimal(str(value).strip())
+    except DecimalException:
+        return value
+    if number.is_finite() and number == number.to_integral_value():
+        return int(number)
+    return value
+
+
+def decode_decimal(value):
+    """The Decimal of a stored decimal value, the value itself if it is not one"""
+    if isinstance(value, Decimal) or isinstance(value, bool):
+        return value
+    try:
+        return Decimal(str(value).strip())
+    except DecimalException:
+        return value
+
+
+def decode_date(value):
+    """The date of a stored ISO date, the value itself if it is not one"""
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return parse_date(str(value).strip()) or value
+    except ValueError:
+        return value
+
+
+def decode_datetime(value):
+    """The aware datetime of a stored ISO datetime, the value itself if it is not one"""
+    if not isinstance(value, datetime.datetime):
+        try:
+            decoded = parse_datetime(str(value).strip())
+        except ValueError:
+            decoded = None
+        if decoded is None:
+            return value
+        value = decoded
+
+    # Like the form fields, the naive values are in the current time zone
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+class RelationDecoder:
+    """Decodes a relation metadata to the pk of its model, the accessor returns the related instance"""
+
+    __slots__ = ("model",)
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, value):
+        if isinstance(value, self.model):
+            return value.pk
+        try:
+            return self.model._meta.pk.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            return None
+
+
+class MetadataValues:
+    """
+    The metadata of an element decoded on access, by attribute or by key.
+    The metadata of the definitions missing from the element are None.
+    """
+
+    __slots__ = ("_metadata", "_decoders", "_values", "_related")
+
+    def __init__(self, element_metadata, decoders, related=None):
+        object.__setattr__(self, "_metadata", element_metadata or {})
+        object.__setattr__(self, "_decoders", decoders)
+        object.__setattr__(self, "_values", {})
+        object.__setattr__(self, "_related", related if related is not None else {})
+
+    def __getitem__(self, name):
+        value = self._values.get(name, MISSING)
+        if value is MISSING:
+            if name not in self._metadata and name not in self._decoders:
+                raise KeyError(name)
+            value = self._values[name] = self.decode(name, self._metadata.get(name))
+        return value
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f"'{name}' is not a metadata of this element") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("The metadata values are read only, change element_metadata")
+
+    def __reduce__(self):
+        # Copied and pickled with the instances, the decoded values are not kept
+        return self.__class__, (self._metadata, self._decoders, self._related)
+
+    def __contains__(self, name):
+        return name in self._metadata or name in self._decoders
+
+    def __iter__(self):
+        return iter({**dict.fromkeys(self._decoders), **dict.fromkeys(self._metadata)})
+
+    def __len__(self):
+        return len(self._decoders.keys() | self._metadata.keys())
+
+    def __repr__(self):
+        return f"<MetadataValues: {', '.join(self)}>"
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def decode(self, name, value):
+        if value is None or value == "":
+            return None
+
+        decoder = self._decoders.get(name)
+        if decoder is None:
+            return value
+        value = decoder(value)
+        if isinstance(decoder, RelationDecoder):
+            return self.get_related(decoder.model, value)
+        return value
+
+    def get_related(self, model, pk):
+        if pk is None:
+            return None
+
+        related = self._related.get(model)
+        if related is None:
+            # Not prefetched, the instance is fetched alone
+            related = self._related[model] = {}
+        if pk not in related:
+            related[pk] = model._default_manager.filter(pk=pk).first()
+        return related[pk]
+
+
+def prefetch_metadata_values(instances, fields=None):
+    """
+    Fetches the relation metadata of the instances with one ``in_bulk()`` per related model,
+    ``fields`` restricts them
+    """
+    accessors = [instance.metadata_values for instance in instances]
+    related = {}
+    relation_pks = defaultdict(set)
+
+    for accessor in accessors:
+        object.__setattr__(accessor, "_related", related)
+        for name, decoder in accessor._decoders.items():
+            if not isinstance(decoder, RelationDecoder) or (fields is not None and name not in fields):
+                continue
+            value = accessor._metadata.get(name)
+            pk = decoder(value) if value not in (None, "") else None
+            if pk is not None:
+                relation_pks[decoder.model].add(pk)
+
+    for model, pks in relation_pks.items():
+        instances_by_pk = model._default_manager.in_bulk(list(pks))
+        related[model] = {pk: instances_by_pk.get(pk) for pk in pks}
+
+    return accessors
@@ -1,31 +1,196 @@
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.views import View
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+import swapper
 
-from .model_mixins import GENERAL_FK_MODELS, ON_DELETE_CHOICES
+from .autocomplete import autocomplete_indexes, get_object_title, get_objects_queryset, is_fk_model
+from .cache import definition_cache
+from .conf import get_setting
+from .model_mixins import GeneralMetadataTypeMixin
 
 
 class MetadataElementsJsonView(View):
-    def get(self, request, el_type):
+    """
+    Paginated autocomplete over the indexed choices, ``?query=...&page=1&limit=20``.
+    With ``el_type="objects"``, searches the rows of a relation model for the users allowed to view them.
+    """
+
+    default_limit = 20
+    max_limit = 100
+
+    def get_int_param(self, name, default, maximum=None):
+        try:
+            value = max(int(self.request.GET.get(name, default)), 1)
+        except (TypeError, ValueError):
+            value = default
+        return min(value, maximum) if maximum else value
+
+    def get_params(self):
         query = self.request.GET.get("query", "")
-        if el_type == "models":
-            return JsonResponse(
-                {
-                    "results": [
-                        {"title": model[1], "value": model[0]}
-                        for model in GENERAL_FK_MODELS
-                        if query.lower() in model[0].lower()
-                    ]
-                }
-            )
-        elif el_type == "on_delete":
-            return JsonResponse(
-                {
-                    "results": [
-                        {"title": model[1], "value": model[0]}
-                        for model in ON_DELETE_CHOICES
-                        if query.lower() in model[0].lower()
-                    ]
-                }
-            )
-        else:
+        page = self.get_int_param("page", 1)
+        limit = self.get_int_param("limit", self.default_limit, self.max_limit)
+        return query, page, limit
+
+    def get_objects_model(self, model_label):
+        try:
+            model = apps.get_model(model_label)
+        except (LookupError, ValueError):
+            return None
+        if is_fk_model(model):
+            return model
+
+    def get_view_permission(self, model):
+        return f"{model._meta.app_label}.view_{model._meta.model_name}"
+
+    def get_objects_page(self, objects, page, limit):
+        # One more row tells if there is a next page without counting the table
+        response = JsonResponse(
+            {
+                "results": [{"title": get_object_title(obj), "value": obj.pk} for obj in objects[:limit]],
+                "page": page,
+                "has_more": len(objects) > limit,
+            }
+        )
+        patch_cache_control(response, private=True, max_age=0)
+        return response
+
+    def get_objects_response(self, model_label, query, page, limit):
+        model = self.get_objects_model(model_label)
+        if model is None:
+            return JsonResponse({"results": []}, status=404)
+
+        if not self.request.user.has_perm(self.get_view_permission(model)):
+            return JsonResponse({"results": []}, status=403)
+
+        start = (page - 1) * limit
+        objects = list(get_objects_queryset(model, query)[start : start + limit + 1])
+        return self.get_objects_page(objects, page, limit)
+
+    def get_index_response(self, el_type, query, page, limit):
+        index = autocomplete_indexes.get(el_type)
+        if index is None:
             return JsonResponse({"results": []})
+
+        query_hash = hashlib.md5(query.strip().lower().encode(), usedforsecurity=False).hexdigest()[:12]
+        etag = quote_etag(f"{index.version}-{page}-{limit}-{query_hash}")
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            response = JsonResponse(index.get_page(query, page=page, limit=limit))
+
+        response["ETag"] = etag
+        patch_cache_control(response, public=True, max_age=get_setting("AUTOCOMPLETE_MAX_AGE", 300))
+        return response
+
+    def get(self, request, el_type, model_label=None):
+        query, page, limit = self.get_params()
+        if el_type == "objects" and model_label:
+            return self.get_objects_response(model_label, query, page, limit)
+        return self.get_index_response(el_type, query, page, limit)
+
+
+class AsyncMetadataElementsJsonView(MetadataElementsJsonView):
+    """
+    The autocomplete view for ASGI deployments, the indexed choices are served without query
+    and the rows of the relation models with the async ORM
+    """
+
+    async def ahas_view_permission(self, model):
+        # request.auser() and user.ahas_perm() come with Django 5.0 and 5.2
+        auser = getattr(self.request, "auser", None)
+        user = await auser() if auser else self.request.user
+        if hasattr(user, "ahas_perm"):
+            return await user.ahas_perm(self.get_view_permission(model))
+        return await sync_to_async(user.has_perm)(self.get_view_permission(model))
+
+    async def aget_objects_response(self, model_label, query, page, limit):
+        model = self.get_objects_model(model_label)
+        if model is None:
+            return JsonResponse({"results": []}, status=404)
+
+        if not await self.ahas_view_permission(model):
+            return JsonResponse({"results": []}, status=403)
+
+        start = (page - 1) * limit
+        objects = [obj async for obj in get_objects_queryset(model, query)[start : start + limit + 1]]
+        return self.get_objects_page(objects, page, limit)
+
+    async def get(self, request, el_type, model_label=None):
+        query, page, limit = self.get_params()
+        if el_type == "objects" and model_label:
+            return await self.aget_objects_response(model_label, query, page, limit)
+        return self.get_index_response(el_type, query, page, limit)
+
+
+class MetadataSchemaJsonView(View):
+    """
+    The JSON form schema of the metadata of an element type, ``?metadata_field=metadata``.
+    The schema is encoded once per version of the definitions of the type and served with a strong ``ETag``,
+    a client sending it back in ``If-None-Match`` gets a ``304`` without any query.
+    """
+
+    def get_type_model(self, model_label):
+        try:
+            model = apps.get_model(model_label)
+        except (LookupError, ValueError):
+            return None
+        if issubclass(model, GeneralMetadataTypeMixin):
+            return model
+
+    def is_metadata_field(self, model, metadata_field_name):
+        try:
+            field = model._meta.get_field(metadata_field_name)
+        except FieldDoesNotExist:
+            return False
+        metadata_model = swapper.load_model("django_model_metadata", "ModelGeneralMetaData")
+        return field.many_to_many and field.related_model is metadata_model
+
+    def build_content(self, model, pk, metadata_field_name):
+        element_type = model._default_manager.get(pk=pk)
+        return json.dumps(element_type.get_fields_schema(metadata_field_name))
+
+    def get(self, request, model_label, pk):
+        model = self.get_type_model(model_label)
+        metadata_field_name = request.GET.get("metadata_field") or "metadata"
+        if model is None or not self.is_metadata_field(model, metadata_field_name):
+            return JsonResponse({}, status=404)
+
+        if not request.user.has_perm(f"{model._meta.app_label}.view_{model._meta.model_name}"):
+            return JsonResponse({}, status=403)
+
+        try:
+            pk = model._meta.pk.to_python(pk)
+        except ValidationError:
+            return JsonResponse({}, status=404)
+
+        # The version of a type is only created once it is known to exist
+        version_key = definition_cache.get_version_key(model._meta.label_lower, pk)
+        if definition_cache.peek_version(version_key) is None and not model._default_manager.filter(pk=pk).exists():
+            return JsonResponse({}, status=404)
+
+        # The version only needs the label and the pk of the type
+        element_type = model(pk=pk)
+        global_version, type_version = definition_cache.get_version(element_type)
+        etag = quote_etag(f"{global_version}-{type_version}-{metadata_field_name}")
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                content = definition_cache.get_or_build(
+                    element_type,
+                    f"schema_json:{metadata_field_name}",
+                    lambda: self.build_content(model, pk, metadata_field_name),
+                )
+            except model.DoesNotExist:
+                return JsonResponse({}, status=404)
+            response = HttpResponse(content, content_type="application/json")
+
+        response["ETag"] = etag
+        # The clients keep the schema and revalidate it with the ETag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response